@@ -10,6 +10,9 @@ def optimize(evaluate, params):
     scan_params_name, n_iter = itemgetter(
         'scan_params_name', 'n_iter')(params)
 
+    # second objective is the standard error of the mean of the first one, used as per evaluation noise
+    sem_objective = params.get('sem_objective', False)
+
     scan_params_filename = f'{scan_params_name}.npy'
 
     # Load the dict that contains the parameters for the scan (control pv list, starting settings, and gp hyperparams)
@@ -39,7 +42,7 @@ def optimize(evaluate, params):
     gp = OGP(ndim, hyps)
 
     # Create the bayesian optimizer that will use the gp as the model to optimize the machine
-    opt = BayesOpt(gp, evaluate, acq_func='UCB', start_dev_vals=start_point)
+    opt = BayesOpt(gp, evaluate, acq_func='UCB', start_dev_vals=start_point, sem_objective=sem_objective)
     opt.ucb_params = scan_params['ucb_params']  # set the acquisition function parameters
 
     # Running BO
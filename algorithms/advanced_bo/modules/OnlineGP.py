@@ -32,7 +32,9 @@ Initialization parameters:
         add it to the model. Keeps matrices well-conditioned.
 
 Methods:
-    update(x_new, y_new): Runs an online GP iteration incorporating the new data.
+    update(x_new, y_new, noise_var=None): Runs an online GP iteration incorporating the new data.
+        noise_var is the noise variance of this measurement (ex: squared standard error
+        of the mean), noise_var hyperparameter if None.
     fit(X, Y): Calls update on multiple points for convenience. X is assumed to
         be a pandas DataFrame.
     predict(x): Computes GP prediction(s) for input point(s).
@@ -68,7 +70,7 @@ Change log:
 import numpy as np
 import numbers
 from numpy.linalg import solve, inv
-import collections
+import collections.abc
 
 class OGP(object):
     def __init__(self, dim, hyperparams, covar='RBF_ARD', maxBV=200,
@@ -137,7 +139,7 @@ class OGP(object):
             self.update(np.array(X[i],ndmin=2),np.array([Y[i]]))
                 #self.update(x, Y[i])
 
-    def update(self, x_new, y_new):
+    def update(self, x_new, y_new, noise_var=None):
         # compute covariance with BVs
         k_x = self.computeCov(self.BV, x_new)
         k = self.computeCov(x_new, x_new, is_self=True)
@@ -151,7 +153,10 @@ class OGP(object):
 
         pM = self.priorMean(x_new)
 
-        (logLik, K1, K2) = logLikelihood(self.noise_var, y_new, cM+pM, cV)
+        # per measurement noise if known, model noise otherwise
+        if noise_var is None:
+            noise_var = self.noise_var
+        (logLik, K1, K2) = logLikelihood(noise_var, y_new, cM+pM, cV)
 
         # compute gamma, a geometric measure of novelty
         if(self.KB.shape[0] > 0):
@@ -198,14 +203,14 @@ class OGP(object):
  #        print(('OGP: gpMean, gpVar = ',gpMean, gpVar))
 
         # combine with prior and return posterior PDF
-        if(isinstance(self.prmean, collections.Callable) and isinstance(self.prvar, collections.Callable)): # we have a prior mean & variance
+        if(isinstance(self.prmean, collections.abc.Callable) and isinstance(self.prvar, collections.abc.Callable)): # we have a prior mean & variance
             priorMean = self.priorMean(x_in)
             priorVar = self.priorVar(x_in)
             # posterior
             postMean = (priorMean * gpVar + gpMean * priorVar) / (gpVar + priorVar)
             postVar = gpVar * priorVar / (gpVar + priorVar)
             return postMean, postVar
-        elif(isinstance(self.prmean, collections.Callable)): # we have a prior mean
+        elif(isinstance(self.prmean, collections.abc.Callable)): # we have a prior mean
             priorMean = self.priorMean(x_in)
             return gpMean + priorMean, gpVar
         else: # no prior
@@ -247,7 +252,7 @@ class OGP(object):
         if(numBV > 1):
             self.KB[0:oldnumBV,[oldnumBV]] = k_x
             self.KB[[oldnumBV],0:oldnumBV] = k_x.transpose()
-        self.KB[oldnumBV,oldnumBV] = k
+        self.KB[[oldnumBV],[oldnumBV]] = k
         
         Ck = extendVector(np.dot(self.C, k_x), val=1)
         
@@ -282,7 +287,7 @@ class OGP(object):
         return scores.argmin()
 
     def priorMean(self, x):
-        if(isinstance(self.prmean, collections.Callable)):
+        if(isinstance(self.prmean, collections.abc.Callable)):
             if(self.prmeanp is not None):
                 return self.prmean(x, self.prmeanp)
             else:
@@ -294,7 +299,7 @@ class OGP(object):
             return 0
 
     def priorVar(self, x):
-        if(isinstance(self.prvar, collections.Callable)):
+        if(isinstance(self.prvar, collections.abc.Callable)):
             if(self.prvarp is not None):
                 return self.prvar(x, self.prvarp)
             else:
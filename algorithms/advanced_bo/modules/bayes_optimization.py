@@ -81,7 +81,7 @@ def normVector(nparray):
 
 
 class BayesOpt:
-    def __init__(self, model, evaluate, acq_func='EI', xi=0.0, alt_param=-1, m=200, bounds=None, iter_bound=False, prior_data=None, start_dev_vals=None, searchBoundScaleFactor=None):
+    def __init__(self, model, evaluate, acq_func='EI', xi=0.0, alt_param=-1, m=200, bounds=None, iter_bound=False, prior_data=None, start_dev_vals=None, searchBoundScaleFactor=None, sem_objective=False):
         self.model = model
         self.m = m
         self.bounds = bounds
@@ -94,6 +94,9 @@ class BayesOpt:
         self.iter_bound = iter_bound
         self.prior_data = prior_data # for seeding the GP with data acquired by another optimizer
         self.evaluate= evaluate
+        # if True, the second objective returned by evaluate is the standard error of the mean of the first,
+        # used as noise of each measurement
+        self.sem_objective = sem_objective
         print('target_func = ', evaluate)
         self.acq_func = (acq_func, xi, alt_param)
         ## the nus in these here should be increased by a factor of npts_per_sample if using standard error of the mean as noise param
@@ -164,12 +167,18 @@ class BayesOpt:
 
         # change position of interface and get resulting y-value
         y_new, _, _, x_new = self.evaluate(x_next)
+        noise_var = None
+        if self.sem_objective:
+            noise_var = np.asarray(y_new)[:, 1:2] ** 2
+            y_new = np.asarray(y_new)[:, 0:1]
+            if not np.all(np.isfinite(noise_var)):
+                noise_var = None  # no standard error (single sample): model noise
         # add new entry to observed data
         self.X_obs = np.concatenate((self.X_obs,x_new),axis=0)
         self.Y_obs.append(y_new)
 
         # update the model (may want to add noise if using testEI)
-        self.model.update(x_new, y_new)# + .5*np.random.randn())
+        self.model.update(x_new, y_new, noise_var)# + .5*np.random.randn())
 
     def best_seen(self):
         """
@@ -9,8 +9,32 @@ import logging
 def optimize(evaluate, params):
     start_from_current, num_init, num_iter, beta, obj_bound = itemgetter(
         'start_from_current', 'num_init', 'num_iter', 'beta', 'obj_bound')(params)
+    # second objective is the standard error of the mean of the first one, used as per evaluation noise
+    sem_objective = params.get('sem_objective', False)
+    # multi-fidelity: column of the routine variables setting the fidelity of an evaluation (ex: fidelity_shots
+    # of the injection environments), -1 if none. Candidates are evaluated at low_fidelity, and again at
+    # high_fidelity if within promising_sigma standard errors of the best objective (fidelities in scaled units)
+    fidelity_index = params.get('fidelity_index', -1)
+    low_fidelity = params.get('low_fidelity', 0.1)
+    high_fidelity = params.get('high_fidelity', 1.0)
+    promising_sigma = params.get('promising_sigma', 1.0)
+    if fidelity_index >= 0 and not sem_objective:
+        raise ValueError('fidelity_index needs sem_objective, evaluations are weighted by their standard error')
+
+    n_samples = 0
+
+    def evaluate_at(X, fidelity):
+        nonlocal n_samples
+        if fidelity_index >= 0:
+            X = np.insert(X, fidelity_index, fidelity, axis=1)
+        Y, _, _, _ = evaluate(X)
+        n_samples += count_samples(Y, sem_objective)
+        return split_noise(Y, obj_bound, sem_objective)
 
     _, _, _, x0 = evaluate(None)
+    if fidelity_index >= 0:
+        # the fidelity is chosen here, not modelled
+        x0 = np.delete(x0, fidelity_index, axis=1)
     num_controls = x0.shape[1]
 
     # Set min and max bounds in scaled units (0 to 1)
@@ -26,29 +50,91 @@ def optimize(evaluate, params):
         initial_pts[0] = torch.as_tensor(x0[0])
 
     train_X = torch.as_tensor(initial_pts)  # .type(torch.DoubleTensor)
-    train_Y, _, _, _ = evaluate(train_X.numpy())
-    train_Y = norm(train_Y, obj_bound[0], obj_bound[1])
-    train_Y = torch.as_tensor(train_Y)
+    train_Y, train_Yvar = evaluate_at(train_X.numpy(), low_fidelity)
 
     for i in range(num_iter - num_init):
-        x_new, _ = get_BO_point(train_X, train_Y, bounds, beta=beta)
+        x_new, _ = get_BO_point(train_X, train_Y, bounds, beta=beta, noise=train_Yvar)
 
         # to machine x_new
-        y_new, _, _, _ = evaluate(x_new.numpy())
-        y_new = norm(y_new, obj_bound[0], obj_bound[1])
-        y_new = torch.as_tensor(y_new)
+        y_new, yvar_new = evaluate_at(x_new.numpy(), low_fidelity)
+
+        if fidelity_index >= 0 and is_promising(y_new, yvar_new, train_Y, promising_sigma):
+            # both evaluations are kept, each with its own noise
+            y_high, yvar_high = evaluate_at(x_new.numpy(), high_fidelity)
+            x_new = torch.cat((x_new, x_new), 0)
+            y_new = torch.cat((y_new, y_high), 0)
+            yvar_new = torch.cat((yvar_new, yvar_high), 0)
 
         logging.debug(y_new)
+        if n_samples:
+            logging.info(f'{n_samples} samples averaged by the evaluations so far')
 
         train_X = torch.cat((train_X, x_new), 0)
         train_Y = torch.cat((train_Y, y_new), 0)
+        if sem_objective:
+            train_Yvar = torch.cat((train_Yvar, yvar_new), 0)
 
 
 def norm(x, lb, ub):
     return (x - lb) / (ub - lb)
 
 
-def get_BO_point(x, f, bounds, precision=None, beta=1.0):
+def split_noise(Y, obj_bound, sem_objective):
+    '''
+    normalized objective and, if sem_objective, its noise variance from the standard error
+    of the mean given as second objective
+
+    :return y, yvar: torch.tensor, shape (N,1), yvar is None if not sem_objective.
+                     yvar is nan for points without a standard error (single sample: inf)
+    '''
+    Y = np.asarray(Y)
+    if not sem_objective:
+        return torch.as_tensor(norm(Y, obj_bound[0], obj_bound[1])), None
+
+    y = norm(Y[:, 0:1], obj_bound[0], obj_bound[1])
+    yvar = (Y[:, 1:2] / (obj_bound[1] - obj_bound[0])) ** 2
+    yvar[~np.isfinite(yvar)] = np.nan
+    return torch.as_tensor(y), torch.as_tensor(yvar)
+
+
+def count_samples(Y, sem_objective):
+    '''
+    number of samples averaged by the evaluations, given as third objective after the standard error
+    (ex: inj_eff_shooting_samples). 0 if not given
+    '''
+    Y = np.asarray(Y)
+    if not sem_objective or Y.shape[1] < 3:
+        return 0
+    return int(np.nansum(np.abs(Y[:, 2])))
+
+
+def is_promising(y, yvar, train_y, sigma):
+    '''
+    True if an evaluation (minimized objective) may be better than the best one seen, within sigma standard errors.
+    Evaluations without standard error (nan variance) are promising
+
+    :param y: objective, torch.tensor, shape (1,1)
+    :param yvar: noise variance of y, torch.tensor, shape (1,1)
+    :param train_y: objectives seen so far, torch.tensor, shape (N,1)
+    '''
+    return bool(torch.isnan(yvar).any() or (y - sigma * yvar.sqrt() <= train_y.min()).all())
+
+
+def model_noise(x, f):
+    '''
+    noise variance inferred as a hyperparameter of a GP of the data
+
+    :param x: input points data, torch.tensor, shape (N,D)
+    :param f: output point data, torch.tensor, shape (N,1)
+    :return: torch.tensor, scalar
+    '''
+    gp = botorch.models.SingleTaskGP(x.double(), f.double())
+    mll = gpytorch.mlls.ExactMarginalLogLikelihood(gp.likelihood, gp)
+    botorch.fit.fit_gpytorch_model(mll)
+    return gp.likelihood.noise.detach().squeeze()
+
+
+def get_BO_point(x, f, bounds, precision=None, beta=1.0, noise=None):
     '''
 
     function that trains a GP model of data and returns the next observation point using UCB
@@ -60,11 +146,24 @@ def get_BO_point(x, f, bounds, precision=None, beta=1.0):
     :param bounds: input space bounds, torch.tensor, shape (2,D)
     :param precision: precision matrix used for RBF kernel (must be PSD), torch.tensor, (D,D)
     :param beta: UCB optimization parameter, float
+    :param noise: observation noise variance of each output point, torch.tensor, shape (N,1).
+                  if None, the noise level is a hyperparameter of the GP. Points with a nan variance
+                  get the noise level inferred by a GP of all the data
     :return x_candidate, model: next observation point and gp model w/observations
     '''
 
     # define GP model
-    gp = botorch.models.SingleTaskGP(x.double(), f.double())  # , precision)
+    if noise is not None and torch.isnan(noise).any():
+        if torch.isnan(noise).all():
+            noise = None
+        else:
+            # points without standard error get the noise level inferred from all the data
+            noise = torch.where(torch.isnan(noise), model_noise(x, f), noise.double())
+    if noise is None:
+        gp = botorch.models.SingleTaskGP(x.double(), f.double())  # , precision)
+    else:
+        # known heteroscedastic noise, floored to keep the kernel matrix well conditioned
+        gp = botorch.models.FixedNoiseGP(x.double(), f.double(), noise.double().clamp_min(1e-6))
     mll = gpytorch.mlls.ExactMarginalLogLikelihood(gp.likelihood, gp)
 
     for name, item in gp.named_parameters():
@@ -1,8 +1,194 @@
+import hashlib
 import math
-from at.acceptance.touschek import get_bunch_length_espread
+import os
+import pathlib
+import pickle
+from collections import OrderedDict
+import numpy as np
 
 __author__ = 'S.M.Liuzzo'
 
+# directory of the persisted bunch length / energy spread tables
+_table_dir = pathlib.Path(__file__).parent.resolve() / 'data'
+
+
+def bunch_current_range(I_bunch, digits=2, min_current=1e-6):
+    """
+    largest bunch current of a table covering I_bunch, rounded up to digits significant digits
+    so that close currents share the same table, and the table points stay in the range used
+    (with 2 digits, at most 10% above I_bunch)
+    :param I_bunch: largest bunch current to normalize in A (ex: maximum total current / number of bunches)
+    :param digits: number of significant digits kept
+    :param min_current: smallest table range in A
+    :return: max_bunch_current for BunchLengthTable.for_lattice, at least min_current
+    """
+    if I_bunch <= min_current:
+        return min_current
+    scale = 10.0 ** (math.floor(math.log10(I_bunch)) - digits + 1)
+    return float(f'{scale * math.ceil(I_bunch / scale - 1e-9):.{digits}g}')
+
+
+def lattice_digest(r):
+    """
+    sha1 of an AT lattice, identifies its bunch length table
+    """
+    try:
+        data = pickle.dumps(r)
+    except Exception:  # not picklable lattice: use its description
+        data = repr(r).encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+class BunchLengthTable:
+    """
+    bunch length and energy spread as a function of bunch current for a lattice,
+    linearly interpolated in a table computed once with get_bunch_length_espread
+    """
+    # tables already loaded, by file name
+    _loaded = {}
+    # tables of the last lattice objects seen, by id of the lattice and table parameters: (lattice, table).
+    # The lattice is kept so that its id is not reused, only cache_size of them are kept (AT lattices are
+    # lists, not hashable, so they cannot be weak keys)
+    _by_lattice = OrderedDict()
+    cache_size = 4
+
+    def __init__(self, bunch_currents, bunch_lengths, energy_spreads):
+        """
+        :param bunch_currents: increasing bunch currents in A
+        :param bunch_lengths: bunch lengths in m at bunch_currents
+        :param energy_spreads: energy spreads at bunch_currents
+        """
+        self.bunch_currents = np.asarray(bunch_currents, dtype=np.float64)
+        self.bunch_lengths = np.asarray(bunch_lengths, dtype=np.float64)
+        self.energy_spreads = np.asarray(energy_spreads, dtype=np.float64)
+
+    def __call__(self, I_bunch):
+        """
+        :param I_bunch: bunch current(s) in A
+        :return: bunch length(s) in m, energy spread(s)
+        :raise ValueError: if a bunch current is outside the table (it would be clamped by the interpolation)
+        """
+        I_max = np.max(I_bunch)
+        if np.min(I_bunch) < self.bunch_currents[0] or I_max > self.bunch_currents[-1]:
+            raise ValueError(f'bunch current {I_max} A outside the bunch length table '
+                             f'[{self.bunch_currents[0]}, {self.bunch_currents[-1]}] A, '
+                             f'use a table with max_bunch_current >= {bunch_current_range(I_max)}')
+        return (np.interp(I_bunch, self.bunch_currents, self.bunch_lengths),
+                np.interp(I_bunch, self.bunch_currents, self.energy_spreads))
+
+    @classmethod
+    def compute(cls, r, zn=0.35, max_bunch_current=0.01, n_points=101):
+        """
+        :param r: AT lattice
+        :param zn: longitudinal impedance for get_bunch_length_espread
+        :param max_bunch_current: largest bunch current of the table in A
+        :param n_points: number of bunch currents of the table
+        """
+        from at.acceptance.touschek import get_bunch_length_espread
+
+        bunch_currents = np.linspace(0.0, max_bunch_current, n_points)
+        bl, es = zip(*[get_bunch_length_espread(r, zn=zn, bunch_curr=I) for I in bunch_currents])
+        return cls(bunch_currents, bl, es)
+
+    def save(self, filename):
+        tmp = f'{filename}.tmp.npz'
+        np.savez(tmp, bunch_currents=self.bunch_currents,
+                 bunch_lengths=self.bunch_lengths, energy_spreads=self.energy_spreads)
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as table:
+            return cls(table['bunch_currents'], table['bunch_lengths'], table['energy_spreads'])
+
+    @classmethod
+    def for_lattice(cls, r, zn=0.35, max_bunch_current=0.01, n_points=101, directory=None):
+        """
+        table of lattice r, loaded from directory (default: data next to this file) or computed and saved there.
+        The table is then reused for the same lattice object without digesting it again
+        (a lattice modified in place after the first call keeps its table).
+        """
+        directory = pathlib.Path(directory) if directory is not None else _table_dir
+        memo_key = (id(r), zn, max_bunch_current, n_points, directory)
+        memo = cls._by_lattice.get(memo_key)
+        if memo is not None and memo[0] is r:
+            cls._by_lattice.move_to_end(memo_key)
+            return memo[1]
+
+        key = f'{lattice_digest(r)}-{zn}-{max_bunch_current}-{n_points}'
+        filename = directory / f'bunch-length-{hashlib.sha1(key.encode()).hexdigest()[:16]}.cache.npz'
+
+        table = cls._loaded.get(filename)
+        if table is None:
+            table = cls._load_or_compute(r, filename, zn, max_bunch_current, n_points)
+            cls._loaded[filename] = table
+
+        cls._by_lattice[memo_key] = (r, table)
+        cls._by_lattice.move_to_end(memo_key)
+        while len(cls._by_lattice) > cls.cache_size:
+            cls._by_lattice.popitem(last=False)
+        return table
+
+    @classmethod
+    def _load_or_compute(cls, r, filename, zn, max_bunch_current, n_points):
+        """
+        table persisted in filename, or computed and saved there
+        """
+        if filename.exists():
+            table = cls.load(filename)
+        else:
+            print(f'computing bunch length and energy spread table for {n_points} bunch currents')
+            table = cls.compute(r, zn=zn, max_bunch_current=max_bunch_current, n_points=n_points)
+            try:
+                table.save(filename)
+            except OSError as err:
+                print(f'cannot write bunch length table {filename}: {err}')
+        return table
+
+
+def _normalize(lt_tot, lt_single, I_tot, I_single, eh, ev, en_spread, r, bunch_table, n_bunches,
+               vacuum_lifetime, ref_I, ref_eh, ref_ev, ref_en_spread, ref_bunch_length):
+    """
+    common normalization of normalize_lifetime and normalize_total_losses, element wise on arrays
+    """
+    lt_tot, lt_single, I_tot, I_single, eh, ev = np.broadcast_arrays(
+        *[np.asarray(a, dtype=np.float64) for a in (lt_tot, lt_single, I_tot, I_single, eh, ev)])
+
+    # single bunch contribution only where the single bunch current is significant
+    with_single = I_single > 0.003
+    single_rate = np.divide(I_single, lt_single, out=np.zeros_like(I_single), where=with_single)
+    LT_tou_train = I_tot / (I_tot / lt_tot - single_rate - I_tot / vacuum_lifetime)
+
+    # normalize to 200mA
+    LT = LT_tou_train * I_tot / ref_I
+
+    # normalize to ev = 10pm and eh = 140 pm
+    LT = LT * np.sqrt(ref_ev / ev) * np.sqrt(ref_eh / eh)
+
+    # if input AT lattice is provided, compute bunch length and energy spread normalization
+    if bunch_table is None and r is not None:
+        # table covering the bunch currents of the filling pattern
+        bunch_table = BunchLengthTable.for_lattice(
+            r, max_bunch_current=bunch_current_range(np.max(I_tot) / n_bunches))
+
+    if bunch_table is not None:
+        # expected bunch length for the given current and filling pattern
+        bl_I, en_spread_I = bunch_table(I_tot / n_bunches)
+
+        # normalize with bunch length
+        LT = LT / bl_I * ref_bunch_length
+
+    if en_spread is not None:
+        # remove energy spread contribution from microwave instability,
+        # en_spread(current per bunch) is approximated with two straight lines
+        # THIS is not needed. Even if en_spread(cur_bunch), this is of no interest, 1/LT propto 1/en_spread.
+
+        # normalize for energy spread
+        LT = LT / en_spread * ref_en_spread
+
+    return LT if LT.ndim else float(LT)
+
+
 def normalize_lifetime(lt_tot,
                        lt_single,
                        I_tot,
@@ -17,10 +203,12 @@ def normalize_lifetime(lt_tot,
                        ref_eh=140e-12,  # m rad
                        ref_ev=10e-12,  # m rad
                        ref_en_spread=1e-3,  #
-                       ref_bunch_length=0.003  # m
+                       ref_bunch_length=0.003,  # m
+                       bunch_table=None
                        ):
     """
-    normalized Touschek lifetime
+    normalized Touschek lifetime. All measured inputs may be scalars or arrays of samples,
+    normalized element wise in one call.
     :param lt_tot: total lifetime measured in hours
     :param lt_single: single bunch lifetime in hours
     :param I_tot: total current at measurement time in A
@@ -35,51 +223,17 @@ def normalize_lifetime(lt_tot,
     :param ref_ev: (default 10*1e-12 mrad) reference ver. emittance for normalization
     :param ref_en_spread: (default 0.1%) reference energy spread for normalization
     :param ref_bunch_length: (default 0.003m) reference energy spread for normalization
-    :return:
+    :param bunch_table: BunchLengthTable used instead of the table of r (BunchLengthTable.for_lattice(r)).
+                        Precompute it to keep the table computation out of the acquisitions
+    :return: normalized lifetime in h, float or array
     """
-    if ev < 0.01 * 1e-12:
+    ev = np.asarray(ev, dtype=np.float64)
+    if np.any(ev < 0.01 * 1e-12):
         print('too small vertical emittance, setting to 0.1')
-        ev = 0.1 * 1e-12
-
-    if I_single > 0.003:
-        LT_tou_train = I_tot / (
-                    I_tot / lt_tot - I_single / lt_single - I_tot / vacuum_lifetime)
-    else:
-        LT_tou_train = I_tot / (
-                I_tot / lt_tot - I_tot / vacuum_lifetime)
-
-    # normalize to 200mA
-    LT = LT_tou_train * I_tot / ref_I
+        ev = np.where(ev < 0.01 * 1e-12, 0.1 * 1e-12, ev)
 
-    # normalize to ev = 10pm
-    LT = LT / math.sqrt(ev) * math.sqrt(ref_ev)
-
-    # normalize to eh = 140 pm
-    LT = LT / math.sqrt(eh) * math.sqrt(ref_eh)
-
-    # if input AT lattice is provided, compute bunch length and energy spread normalization
-    if r is not None:
-
-        # get expected bunch length and energy spread for the given current and filling pattern
-        I_bunch = I_tot / n_bunches
-
-        bl_I, en_spread_I = get_bunch_length_espread(r, zn=0.35, bunch_curr=I_bunch)
-
-        # normalize with bunch length
-        LT = LT / bl_I * ref_bunch_length
-
-    if en_spread is not None:
-        # remove energy spread contribution from microwave instability,
-        # en_spread(current per bunch) is approximated with two straight lines
-        # THIS is not needed. Even if en_spread(cur_bunch), this is of no interest, 1/LT propto 1/en_spread.
-
-        # normalize for energy spread
-        LT = LT / en_spread * ref_en_spread
-
-    # convert to h
-    lt_norm_hours = LT
-
-    return lt_norm_hours
+    return _normalize(lt_tot, lt_single, I_tot, I_single, eh, ev, en_spread, r, bunch_table, n_bunches,
+                      vacuum_lifetime, ref_I, ref_eh, ref_ev, ref_en_spread, ref_bunch_length)
 
 
 def normalize_total_losses(lt_tot,
@@ -96,10 +250,12 @@ def normalize_total_losses(lt_tot,
                        ref_eh=140e-12,  # m rad
                        ref_ev=10e-12,  # m rad
                        ref_en_spread=1e-3,  #
-                       ref_bunch_length=0.003  # m
+                       ref_bunch_length=0.003,  # m
+                       bunch_table=None
                        ):
     """
-    normalized total losses
+    normalized total losses. All measured inputs may be scalars or arrays of samples,
+    normalized element wise in one call.
     :param lt_tot: total losses measured in arb.units
     :param I_tot: total current at measurement time in A
     :param eh: horizontal emittance at measurement time in A
@@ -113,48 +269,13 @@ def normalize_total_losses(lt_tot,
     :param ref_ev: (default 10*1e-12 mrad) reference ver. emittance for normalization
     :param ref_en_spread: (default 0.1%) reference energy spread for normalization
     :param ref_bunch_length: (default 0.003m) reference energy spread for normalization
-    :return:
+    :param bunch_table: BunchLengthTable used instead of the table of r (BunchLengthTable.for_lattice(r)).
+                        Precompute it to keep the table computation out of the acquisitions
+    :return: normalized total losses, float or array
     """
 
-    if I_single > 0.003:
-        LT_tou_train = I_tot / (
-                    I_tot / lt_tot - I_single / lt_single - I_tot / vacuum_lifetime)
-    else:
-        LT_tou_train = I_tot / (
-                I_tot / lt_tot - I_tot / vacuum_lifetime)
-
-    # normalize to 200mA
-    LT = LT_tou_train * I_tot / ref_I
-
-    # normalize to ev = 10pm
-    LT = LT / math.sqrt(ev) * math.sqrt(ref_ev)
-
-    # normalize to eh = 140 pm
-    LT = LT / math.sqrt(eh) * math.sqrt(ref_eh)
-
-    # if input AT lattice is provided, compute bunch length and energy spread normalization
-    if r is not None:
-
-        # get expected bunch length and energy spread for the given current and filling pattern
-        I_bunch = I_tot / n_bunches
-
-        bl_I, en_spread_I = get_bunch_length_espread(r, zn=0.35, bunch_curr=I_bunch)
-
-        # normalize with bunch length
-        LT = LT / bl_I * ref_bunch_length
-
-    if en_spread is not None:
-        # remove energy spread contribution from microwave instability,
-        # en_spread(current per bunch) is approximated with two straight lines
-        # THIS is not needed. Even if en_spread(cur_bunch), this is of no interest, 1/LT propto 1/en_spread.
-
-        # normalize for energy spread
-        LT = LT / en_spread * ref_en_spread
-
-    # convert to h
-    lt_norm_hours = LT
-
-    return lt_norm_hours
+    return _normalize(lt_tot, lt_single, I_tot, I_single, eh, ev, en_spread, r, bunch_table, n_bunches,
+                      vacuum_lifetime, ref_I, ref_eh, ref_ev, ref_en_spread, ref_bunch_length)
 
 
 if __name__ == '__main__':
@@ -2,33 +2,12 @@ import time
 import numpy as np
 from badger import environment
 import pathlib
-from statistics import mean
 from itertools import compress
 from badger.errors import BadgerNoInterfaceError, BadgerEnvObsError
-from .NormalizeLifetime import normalize_lifetime
-
-class Knobs:
-    def __init__(self, csv_file_name, name):
-        self._matrix = self.load_knob_from_csv(csv_file_name)
-        # there are no names in csv so generate names
-        self._row_names = [f"knob-{name}-{i}" for i in range(self.get_count())]
-
-    @staticmethod
-    def load_knob_from_csv(filename) -> np.ndarray:
-        return np.genfromtxt(filename, delimiter=',')
-
-    def get_count(self):
-        return self._matrix.shape[0]
-
-    def get_names(self):
-        return self._row_names
-
-    def gen_matrix(self, vars):
-        if len(vars) == len(self._row_names):
-            return self._matrix
-        vars_hash = set(vars)
-        remove_row_idx = [idx for idx, name in enumerate(self._row_names) if not name in vars_hash]
-        return np.delete(self._matrix, remove_row_idx, axis=0)  # remove rows
+from .NormalizeLifetime import BunchLengthTable, bunch_current_range, normalize_lifetime
+from .knobs import Knobs, knob_names
+from .sampling import acquire_adaptive
+from .sampler import BackgroundSampler, relative_drift
 
 
 class Environment(environment.Environment):
@@ -37,27 +16,59 @@ class Environment(environment.Environment):
 
     # define knobs and add them to variables
     _path = pathlib.Path(__file__).parent.resolve()
-    _knobs_sext = Knobs(_path / "data" / "SextKnob.csv", "sext")
-    _knobs_oct = Knobs(_path / "data" / "OctKnob.csv", "octu")
-    _limits_knobs_sext = {name: [-1, 1] for name in _knobs_sext.get_names()}
+    # names from the number of rows only, the matrices are loaded by the Knobs of _get_knobs on first use
+    _limits_knobs_sext = {name: [-1, 1] for name in knob_names(_path / "data" / "SextKnob.csv", "sext")}
     _limits_knobs_sext['knob-sext-2'] = [-2, 2]
-    _limits_knobs_oct = {name: [-1, 1] for name in _knobs_oct.get_names()}
+    _limits_knobs_oct = {name: [-1, 1] for name in knob_names(_path / "data" / "OctKnob.csv", "octu")}
     variables = {}
     for _d in (_limits_knobs_sext, _limits_knobs_oct):
         variables.update(_d)
 
     observables = ['total_losses', 'libera_lifetime', 'normalized_libera_lifetime']
+    # standard error of the mean of each averaged observable, per-point noise for the algorithms
+    observables += [f'{obs}_sem' for obs in observables]
 
     # initial values for variables
     _variables = {v: 0.0 for v in variables.keys()}
     _initial_sext = None
     _initial_oct = None
+    _sext_buffer = None  # reusable output of initial + K^T x
+    _oct_buffer = None
+    _magnet_knobs = None  # (sext, oct) Knobs checking the magnet limits of this environment
     _cur_0 = None
+    _last_statistics = {}
+    _t_set = None  # epoch time of the last set_variables
+    _sampler = None
+    _sampler_channels = None  # channels of the last background sampled get_observables
+    _bunch_table = None  # bunch length table of lattice_file, computed at setup
 
     # Environment parameters
     waiting_time: int = 8
     number_of_acquisitions: int = 2
     seconds_between_acquisitions: int = 2
+    # adaptive sampling: acquire until the standard error of the mean of every observable is below
+    # relative_sem_tolerance times its mean, or max_acquisitions are taken. 0: number_of_acquisitions samples
+    relative_sem_tolerance: float = 0.0
+    max_acquisitions: int = 10
+    # stream the diagnostics from a background thread while magnets settle. Observables are computed from the
+    # acquisitions taken after the last set_variables + waiting_time, or earlier, as soon as every observable
+    # drifted by less than settle_drift_tolerance (relative) over the last drift_window s. 0: no early settle
+    background_sampling: bool = False
+    sampling_period: float = 0.5
+    settle_drift_tolerance: float = 0.0
+    drift_window: float = 2.0
+    max_timestamp_skew: float = 0.0  # s, samples of one acquisition read further apart are read again. 0: no check
+    # AT lattice (in data/ or absolute path) for the bunch length normalization of normalized_libera_lifetime,
+    # and number of bunches of the filling pattern. '': no bunch length normalization
+    lattice_file: str = ''
+    n_bunches: int = 882
+    # limits of each sextupole / octupole CorrectionStrength, checked before any write. 0: no limit
+    max_abs_sext_strength: float = 0.0
+    max_abs_oct_strength: float = 0.0
+    # per magnet limits, csv file with one 'low, high' line per magnet (in data/ or absolute path).
+    # If set, used instead of max_abs_sext_strength / max_abs_oct_strength
+    sext_limits_file: str = ''
+    oct_limits_file: str = ''
     verbose: bool = False
 
     def get_variables(self, variable_names: list[str]) -> dict:
@@ -68,9 +79,15 @@ class Environment(environment.Environment):
         # store initial values if not available
         if self._cur_0 == None:
             print(f'store intitial values of strengths and currents')
-            self._initial_sext = self.interface.get_value(channel_name='srmag/m-s/all/CorrectionStrengths')
-            self._initial_oct = self.interface.get_value(channel_name='srmag/m-o/all/CorrectionStrengths')
+            # private contiguous float64 copies, knob deltas are added to them at every set_variables
+            self._initial_sext = np.array(self.interface.get_value(channel_name='srmag/m-s/all/CorrectionStrengths'),
+                                          dtype=np.float64)
+            self._initial_oct = np.array(self.interface.get_value(channel_name='srmag/m-o/all/CorrectionStrengths'),
+                                         dtype=np.float64)
+            self._sext_buffer = np.empty_like(self._initial_sext)
+            self._oct_buffer = np.empty_like(self._initial_oct)
             self._cur_0 = self.interface.get_value(channel_name='srdiag/beam-current/total/Current')
+            self._bunch_table = self._get_bunch_table(self._cur_0)
             # print(self._cur_0)
             # print(self._initial_oct)
             # print(self._initial_sext)
@@ -92,32 +109,175 @@ class Environment(environment.Environment):
             __x.append(x)
             vars.append(var)
 
-        _x = np.array(__x)
+        _x = np.array(__x, dtype=np.float64)
 
-        # selected varaibles may be sext or oct. Order will be always sext first and then oct.
-        # prepare mask of sext and oct selected variables
-        mask_sext_vars = [v.find('sext') >= 0 for v in vars]
-        mask_oct_vars = [v.find('octu') >= 0 for v in vars]
+        # sextupoles and octupoles: initial + K^T x, computed in place in the reusable buffers
+        # and checked against the magnet limits in the same pass
+        mask_sext_vars, mask_oct_vars, feasible = self._project_knobs(_x, vars, self._sext_buffer, self._oct_buffer)
 
-        # set sextupoles
-        sext = np.sum(_x[0:sum(mask_sext_vars)] * np.transpose(
-            self._knobs_sext.gen_matrix(list(compress(vars, mask_sext_vars)))), axis=1)
+        # check all magnets before writing any of them
+        if not feasible:
+            raise ValueError(f'knobs {variable_inputs} set magnet strengths out of limits')
 
         if self.verbose:
-            [print(f'sext knob {c}: {k}') for c, k in enumerate(_x[0:sum(mask_sext_vars)])]
+            [print(f'sext knob {c}: {k}') for c, k in enumerate(_x[mask_sext_vars])]
 
         self.interface.set_value(channel_name='srmag/m-s/all/CorrectionStrengths',
-                                 channel_value=self._initial_sext + sext)
+                                 channel_value=self._sext_buffer)
         # set octupoles
-        oct = np.sum(_x[sum(mask_sext_vars):] * np.transpose(
-            self._knobs_oct.gen_matrix(list(compress(vars, mask_oct_vars)))), axis=1)
-
         if self.verbose:
-            [print(f'oct knob {c}: {k}') for c, k in enumerate(_x[sum(mask_sext_vars):])]
+            [print(f'oct knob {c}: {k}') for c, k in enumerate(_x[mask_oct_vars])]
 
         self.interface.set_value(channel_name='srmag/m-o/all/CorrectionStrengths',
-                                 channel_value=self._initial_oct + oct)
-
+                                 channel_value=self._oct_buffer)
+        self._t_set = time.time()
+
+        # sample the diagnostics while the magnets settle, until the end of the next get_observables
+        if self.background_sampling and self._sampler_channels is not None:
+            self._start_sampling(self._sampler_channels)
+
+    def _get_bunch_table(self, cur_0: float):
+        """
+        bunch length table of lattice_file (computed once and saved in data/), covering the bunch currents
+        of the filling pattern up to 10% above cur_0. None if no lattice_file
+        :param cur_0: initial total current in mA
+        """
+        if not self.lattice_file:
+            return None
+        from at import load_lattice
+
+        r = load_lattice(str(self._path / "data" / self.lattice_file))
+        max_bunch_current = bunch_current_range(1.1 * cur_0 / 1e3 / self.n_bunches)  # A
+        return BunchLengthTable.for_lattice(r, max_bunch_current=max_bunch_current)
+
+    def _get_knobs(self):
+        """
+        sextupole and octupole Knobs with the magnet strength limits of this environment, created on first use
+        """
+        if self._magnet_knobs is None:
+            self._magnet_knobs = (
+                Knobs(self._path / "data" / "SextKnob.csv", "sext",
+                      *self._magnet_limits(self.sext_limits_file, self.max_abs_sext_strength)),
+                Knobs(self._path / "data" / "OctKnob.csv", "octu",
+                      *self._magnet_limits(self.oct_limits_file, self.max_abs_oct_strength)))
+        return self._magnet_knobs
+
+    def _magnet_limits(self, limits_file: str, max_abs: float):
+        """
+        :return: (low, high) per magnet strength limits read from limits_file, or -max_abs, max_abs.
+                 None, None if not limited
+        """
+        if limits_file:
+            limits = np.genfromtxt(self._path / "data" / limits_file, delimiter=',', ndmin=2)
+            return limits[:, 0], limits[:, 1]
+        if max_abs > 0:
+            return -max_abs, max_abs
+        return None, None
+
+    def _project_knobs(self, x, variable_names, out_sext, out_oct):
+        """
+        sextupole and octupole strengths initial + K^T x, shared by set_variables and check_knobs.
+        Variables may be sext or oct knobs in any order, each amplitude stays with its own knob.
+        :param x: knob amplitudes (len(variable_names),) or (n candidates x len(variable_names))
+        :param variable_names: knob names, in the order of the last axis of x
+        :param out_sext: output array of the sextupole strengths, shape of x @ K_sext
+        :param out_oct: output array of the octupole strengths, shape of x @ K_oct
+        :return: boolean masks of the sext and oct variables,
+                 feasibility: all magnets within limits, bool or (n candidates,) bool array
+        """
+        mask_sext_vars = np.array([v.find('sext') >= 0 for v in variable_names], dtype=bool)
+        mask_oct_vars = np.array([v.find('octu') >= 0 for v in variable_names], dtype=bool)
+
+        knobs_sext, knobs_oct = self._get_knobs()
+        _, feasible_sext = knobs_sext.project(x[..., mask_sext_vars], compress(variable_names, mask_sext_vars),
+                                              initial=self._initial_sext, out=out_sext)
+        _, feasible_oct = knobs_oct.project(x[..., mask_oct_vars], compress(variable_names, mask_oct_vars),
+                                            initial=self._initial_oct, out=out_oct)
+
+        return mask_sext_vars, mask_oct_vars, feasible_sext & feasible_oct
+
+    def check_knobs(self, X, variable_names: list[str]) -> dict:
+        """
+        magnet strengths of a batch of candidate knob vectors, and their feasibility, without writing anything.
+        Lets algorithms screen candidates before evaluating them. Strengths are computed as in set_variables.
+        :param X: (n candidates x len(variable_names)) knob amplitudes, columns in the order of variable_names
+        :param variable_names: knob names
+        :return: dict with 'feasible' (n candidates,) bool array,
+                 'sext' and 'oct' (n candidates x n magnets) strength arrays
+        """
+        if self._initial_sext is None:
+            self.get_variables([])  # store initial strengths
+
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        sext = np.empty((X.shape[0], self._initial_sext.size))
+        oct = np.empty((X.shape[0], self._initial_oct.size))
+        _, _, feasible = self._project_knobs(X, variable_names, sext, oct)
+
+        return {'feasible': feasible, 'sext': sext, 'oct': oct}
+
+
+    def _read_together(self, channel_names: list[str]) -> dict:
+        """
+        read channel_names in one snapshot, so that currents and losses or lifetimes belong to the same instant
+        """
+        if not hasattr(self.interface, 'snapshot'):
+            return self.interface.get_values(channel_names)
+
+        max_skew = self.max_timestamp_skew if self.max_timestamp_skew > 0 else None
+        snapshot = self.interface.snapshot(channel_names, max_skew=max_skew)
+        return {name: sample.value for name, sample in snapshot.items()}
+
+    # raw channels needed by each observable, beyond the beam current
+    _observable_channels = {
+        'total_losses': ['srdiag/blm/all/TotalLoss'],
+        'libera_lifetime': ['srdiag/bpm/lifetime/Lifetime'],
+        'normalized_libera_lifetime': ['srdiag/emittance/id25/Emittance_h',
+                                       'srdiag/emittance/id25/Emittance_v',
+                                       'srdiag/bpm/lifetime/Lifetime'],
+    }
+
+    def _derive_observable(self, obs: str, acq: dict, cur_0: float, show: bool = True) -> float:
+        """
+        value of observable obs computed from one acquisition acq {channel: value}
+        :param show: print the inputs of the normalized lifetime
+        """
+        cur = acq['srdiag/beam-current/total/Current']
+
+        if obs == 'total_losses':
+            return acq['srdiag/blm/all/TotalLoss']*(cur_0/cur)**2
+
+        elif obs == 'libera_lifetime':
+            return acq['srdiag/bpm/lifetime/Lifetime']/3600*cur/cur_0  # convert to h
+
+        elif obs == 'normalized_libera_lifetime':
+            # eh = self.interface.get_value('srdiag/beam-emittance/main-h/Emittance_H')
+            # ev = self.interface.get_value('srdiag/beam-emittance/main-v/Emittance_V')
+            eh = acq['srdiag/emittance/id25/Emittance_h']
+            ev = acq['srdiag/emittance/id25/Emittance_v']
+            lt_tot = acq['srdiag/bpm/lifetime/Lifetime']
+
+            if show:
+                print(f'cur {cur:2.2f} mA')
+                print(f'lt tot {lt_tot / 3600:2.2f} h')
+
+                print(f'eh {eh*1e12:2.2f} pmrad')
+                print(f'ev {ev*1e12:2.2f} pmrad')
+
+            # normalize with measured current and emittances
+            norm_LT = normalize_lifetime(lt_tot/3600,  # h
+                                         0.0,
+                                         cur/1e3,  # A
+                                         0.0,
+                                         eh,  # mrad
+                                         ev,
+                                         n_bunches=self.n_bunches,
+                                         bunch_table=self._bunch_table)
+
+            if show:
+                print(f'normalized LT: {norm_LT:2.2f} h')
+            return norm_LT
+
+        raise BadgerEnvObsError(f'unknown observable {obs}')
 
     def get_observables(self, observable_names: list[str]) -> dict:
 
@@ -126,78 +286,126 @@ class Environment(environment.Environment):
 
         cur_0 = self._cur_0
 
-        time.sleep(self.waiting_time)
         n_acq = self.number_of_acquisitions
         dt_acq = self.seconds_between_acquisitions
 
+        # observables to sample: the requested ones and those whose standard error is requested
+        names = []
+        for obs in observable_names:
+            base = obs[:-len('_sem')] if obs.endswith('_sem') else obs
+            if base in self._observable_channels and base not in names:
+                names.append(base)
+
+        # union of the channels of all sampled observables, read together once per acquisition
+        channels = ['srdiag/beam-current/total/Current']
+        for obs in names:
+            for channel in self._observable_channels[obs]:
+                if channel not in channels:
+                    channels.append(channel)
+
+        try:
+            if self.background_sampling:
+                acquire = self._background_acquire(channels, names, cur_0)
+            else:
+                time.sleep(self.waiting_time)
+
+                def acquire():
+                    # one acquisition, shared by all observables
+                    acq = self._read_together(channels)
+                    return {obs: self._derive_observable(obs, acq, cur_0) for obs in names}
+
+            self._last_statistics = acquire_adaptive(acquire, names,
+                                                     min_samples=n_acq,
+                                                     max_samples=self.max_acquisitions,
+                                                     rel_tol=self.relative_sem_tolerance,
+                                                     dt=0.0 if self.background_sampling else dt_acq)
+        finally:
+            # no reads between evaluations, the sampler is started again by the next set_variables
+            self.stop_sampling()
+        if self.verbose:
+            [print(f'{obs}: {s.mean} +- {s.sem} ({s.n} samples)') for obs, s in self._last_statistics.items()]
+
         observable_outputs = {}
         for obs in observable_names:
-            if obs == 'total_losses':
-                _totloss = []
-                for i in range(n_acq):
-                    # get acquisition i
-                    cur = self.interface.get_value(channel_name='srdiag/beam-current/total/Current')
-                    _totloss.append(self.interface.get_value(channel_name='srdiag/blm/all/TotalLoss')*(cur_0/cur)**2)
-                    # wait before next acquisition
-                    if n_acq > 1:
-                        time.sleep(dt_acq)
-
-                mean_totloss = mean(_totloss)
-                observable_outputs[obs]=mean_totloss
-
-            elif obs == 'libera_lifetime':
-                _LT = []
-                for i in range(n_acq):
-                    # get acquisition i
-                    cur = self.interface.get_value(channel_name='srdiag/beam-current/total/Current')
-                    _LT.append(self.interface.get_value(channel_name='srdiag/bpm/lifetime/Lifetime')/3600*cur/cur_0)  # convert to h
-                    # wait before next acquisition
-                    if n_acq > 1:
-                        time.sleep(dt_acq)
-
-                mean_lifetime = mean(_LT)
-                observable_outputs[obs] = mean_lifetime
-
-            elif obs == 'normalized_libera_lifetime':
-                _LT = []
-                for i in range(n_acq):
-                    # get acquisition i
-                    cur = self.interface.get_value('srdiag/beam-current/total/Current')
-                    # eh = self.interface.get_value('srdiag/beam-emittance/main-h/Emittance_H')
-                    # ev = self.interface.get_value('srdiag/beam-emittance/main-v/Emittance_V')
-                    eh = self.interface.get_value('srdiag/emittance/id25/Emittance_h')
-                    ev = self.interface.get_value('srdiag/emittance/id25/Emittance_v')
-                    lt_tot = self.interface.get_value('srdiag/bpm/lifetime/Lifetime')
-
-                    print(f'cur {cur:2.2f} mA')
-                    print(f'lt tot {lt_tot / 3600:2.2f} h')
-
-                    print(f'eh {eh*1e12:2.2f} pmrad')
-                    print(f'ev {ev*1e12:2.2f} pmrad')
-
-                    # import math
-                    # print(math.sqrt(ev))
-
-                    # normalize with measured current and emittances
-                    norm_LT = normalize_lifetime(lt_tot/3600,  # h
-                                                 0.0,
-                                                 cur/1e3,  # A
-                                                 0.0,
-                                                 eh,  # mrad
-                                                 ev)
-                    _LT.append(norm_LT)
-
-                    print(f'normalized LT: {norm_LT:2.2f} h')
-
-                    # wait before next acquisition
-                    if n_acq > 1:
-                        time.sleep(dt_acq)
-
-                mean_lifetime = mean(_LT)
-                observable_outputs[obs] = mean_lifetime
+            if obs in self._last_statistics:
+                observable_outputs[obs] = self._last_statistics[obs].mean
+            elif obs.endswith('_sem') and obs[:-len('_sem')] in self._last_statistics:
+                observable_outputs[obs] = self._last_statistics[obs[:-len('_sem')]].sem
 
         return observable_outputs
 
+    def _settle(self, names: list[str], cur_0: float) -> float:
+        """
+        wait for the magnets to settle after the last set_variables
+        :return: time after which acquisitions are settled
+        """
+        t_set = self._t_set if self._t_set is not None else time.time()
+        t_end = t_set + self.waiting_time
+        while True:
+            now = time.time()
+            if now >= t_end:
+                return t_end
+
+            # drift detector on the acquisitions of the last drift_window s
+            if self.settle_drift_tolerance > 0 and now - t_set >= self.drift_window:
+                window = self._sampler.samples_between(max(t_set, now - self.drift_window), now)
+                times = [a.t for a in window]
+                drifts = [relative_drift(times, [self._derive_observable(obs, a.values, cur_0, show=False)
+                                                 for a in window])
+                          for obs in names]
+                if window and all(drift <= self.settle_drift_tolerance for drift in drifts):
+                    if self.verbose:
+                        print(f'settled after {now - t_set:.2f} s')
+                    # the stable window is used for the statistics
+                    return np.nextafter(window[0].t, -np.inf)
+
+            time.sleep(min(self.sampling_period, t_end - now))
+
+    def _start_sampling(self, channels: list[str]):
+        """
+        start the background sampler on channels, if not already running on them
+        """
+        if self._sampler is None:
+            self._sampler = BackgroundSampler(self._read_together, period=self.sampling_period)
+        self._sampler.start(channels)
+        self._sampler_channels = list(channels)
+
+    def _background_acquire(self, channels: list[str], names: list[str], cur_0: float):
+        """
+        start the background sampler if set_variables did not (first evaluation or other observables),
+        wait for the magnets to settle and return a function giving the next settled acquisition from the ring buffer
+        """
+        self._start_sampling(channels)
+
+        t_min = self._settle(names, cur_0)
+        # acquisitions used for the statistics are at least seconds_between_acquisitions apart
+        gap = max(self.seconds_between_acquisitions - 0.5 * self.sampling_period, 0.0)
+        timeout = self.seconds_between_acquisitions + 10 * self.sampling_period
+
+        def acquire():
+            nonlocal t_min
+            try:
+                acquisition = self._sampler.wait_sample(t_min, timeout)
+            except TimeoutError as err:
+                raise BadgerEnvObsError(str(err))
+            t_min = acquisition.t + gap
+            return {obs: self._derive_observable(obs, acquisition.values, cur_0) for obs in names}
+
+        return acquire
+
+    def stop_sampling(self):
+        """
+        stop the background sampler, called at the end of every get_observables
+        """
+        if self._sampler is not None:
+            self._sampler.stop()
+
+    def get_last_statistics(self) -> dict:
+        """
+        {observable name: SampleStats(mean, sem, n)} of the last get_observables
+        """
+        return dict(self._last_statistics)
+
 
 if __name__ =='__main__':
     envi = Environment()
@@ -0,0 +1,80 @@
+"""
+per write allocation and latency of the sextupole CorrectionStrengths update.
+
+compares the former path (new array for K^T x, new array for initial + delta, python list handed to tango)
+with the buffer path used by Environment.set_variables (matmul into a reusable float64 buffer,
+numpy array handed to tango).
+
+    python benchmark_spectrum.py                  # computation only, offline
+    python benchmark_spectrum.py --write          # also write to srmag/m-s/all/CorrectionStrengths
+"""
+import argparse
+import pathlib
+import time
+import tracemalloc
+import numpy as np
+
+_path = pathlib.Path(__file__).parent.resolve()
+
+
+def list_path(x, K, initial):
+    return list(initial + np.sum(x * np.transpose(K), axis=1))
+
+
+def buffer_path(x, K, initial, out):
+    np.matmul(x, K, out=out)
+    out += initial
+    return out
+
+
+def measure(func, n_repeat, *args):
+    """
+    :return: (bytes allocated per call, mean latency per call in s)
+    """
+    func(*args)  # warm up
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    for _ in range(n_repeat):
+        func(*args)
+    return peak, (time.perf_counter() - t0) / n_repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=None, help='number of magnets (default: SextKnob.csv columns)')
+    parser.add_argument('--repeat', type=int, default=1000)
+    parser.add_argument('--write', action='store_true', help='write to the control system (tango)')
+    parser.add_argument('--attribute', default='srmag/m-s/all/CorrectionStrengths')
+    args = parser.parse_args()
+
+    K = np.genfromtxt(_path / 'data' / 'SextKnob.csv', delimiter=',')
+    if args.size is not None:
+        K = np.resize(K, (K.shape[0], args.size))
+    x = np.random.uniform(-1, 1, K.shape[0])
+    initial = np.random.uniform(-1, 1, K.shape[1])
+    out = np.empty_like(initial)
+
+    print(f'{K.shape[0]} knobs, {K.shape[1]} magnets, {args.repeat} repetitions')
+    for label, func, fargs in (('list  ', list_path, (x, K, initial)),
+                               ('buffer', buffer_path, (x, K, initial, out))):
+        nbytes, dt = measure(func, args.repeat, *fargs)
+        print(f'{label}: {nbytes:8d} bytes allocated per write, {dt * 1e6:8.2f} us per write')
+
+    if args.write:
+        import tango
+        attr = tango.AttributeProxy(args.attribute)
+        initial = np.array(attr.read().w_value, dtype=np.float64)
+        n_write = min(args.repeat, 20)  # write the present set point back
+        for label, value in (('list  ', list(initial)), ('buffer', initial)):
+            nbytes, dt = measure(attr.write, n_write, value)
+            print(f'tango write {label}: {nbytes:8d} bytes allocated, {dt * 1e3:8.2f} ms per write')
+
+
+if __name__ == '__main__':
+    main()
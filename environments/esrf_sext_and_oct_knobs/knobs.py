@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import pathlib
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+
+
+def file_digest(filename):
+    """
+    sha1 of the content of filename
+    """
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def sidecar_paths(csv_file_name):
+    """
+    binary cache of a knob csv: SextKnob.csv -> SextKnob.cache.npy and SextKnob.cache.json (sha1 and mtime of the csv)
+    """
+    csv_file_name = pathlib.Path(csv_file_name)
+    stem = csv_file_name.with_suffix('')
+    return stem.with_suffix('.cache.npy'), stem.with_suffix('.cache.json')
+
+
+def sidecar_is_valid(csv_file_name):
+    """
+    True if the .npy sidecar of csv_file_name was generated from its present content.
+    The csv is hashed only if its mtime changed since the sidecar was written.
+    """
+    npy_file, meta_file = sidecar_paths(csv_file_name)
+    try:
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if not npy_file.exists():
+            return False
+        mtime = os.stat(csv_file_name).st_mtime
+        if meta['mtime'] == mtime:
+            return True
+        if meta['sha1'] != file_digest(csv_file_name):
+            return False
+        # touched but not changed: remember the new mtime
+        meta['mtime'] = mtime
+        with open(meta_file, 'w') as f:
+            json.dump(meta, f)
+        return True
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def count_rows(csv_file_name):
+    """
+    number of knobs of csv_file_name, from the .npy sidecar header if valid, without loading the matrix
+    """
+    if sidecar_is_valid(csv_file_name):
+        # reads the .npy header only
+        return np.load(sidecar_paths(csv_file_name)[0], mmap_mode='r').shape[0]
+    with open(csv_file_name) as f:
+        return sum(1 for line in f if line.strip())
+
+
+@lru_cache(maxsize=None)
+def knob_names(csv_file_name, name):
+    """
+    names knob-<name>-<row> of the knobs of csv_file_name (there are no names in csv), counted once per file
+    """
+    return tuple(f"knob-{name}-{i}" for i in range(count_rows(csv_file_name)))
+
+
+class Knobs:
+    # number of compiled variable selections kept
+    cache_size = 8
+
+    def __init__(self, csv_file_name, name, low=None, high=None):
+        """
+        :param csv_file_name: knob matrix, one line per knob, one column per magnet
+        :param name: knob family, knobs are named knob-<name>-<row>
+        :param low: per magnet lower strength limit, scalar or array of n magnets. None: no limit
+        :param high: per magnet upper strength limit, scalar or array of n magnets. None: no limit
+        """
+        # the matrix is loaded on first use, only the number of knobs is needed to name them
+        self._csv_file_name = csv_file_name
+        self._knob_matrix = None
+        self._row_names = list(knob_names(csv_file_name, name))
+        self._row_index = {name: idx for idx, name in enumerate(self._row_names)}
+        self._selections = OrderedDict()
+        # per magnet strength limits checked by project, None: no limit
+        self._low = None if low is None else np.asarray(low, dtype=np.float64)
+        self._high = None if high is None else np.asarray(high, dtype=np.float64)
+
+    @staticmethod
+    def load_knob_from_csv(filename) -> np.ndarray:
+        return np.genfromtxt(filename, delimiter=',')
+
+    @classmethod
+    def load_knob(cls, filename) -> np.ndarray:
+        """
+        knob matrix of csv filename, memory mapped from its .npy sidecar.
+        The sidecar is (re)generated when missing or when the csv changed.
+        """
+        npy_file, meta_file = sidecar_paths(filename)
+        if sidecar_is_valid(filename):
+            return np.load(npy_file, mmap_mode='r')
+
+        matrix = cls.load_knob_from_csv(filename)
+        try:
+            tmp = npy_file.with_suffix('.tmp.npy')
+            np.save(tmp, matrix)
+            os.replace(tmp, npy_file)
+            with open(meta_file, 'w') as f:
+                json.dump({'csv': os.path.basename(filename),
+                           'sha1': file_digest(filename),
+                           'mtime': os.stat(filename).st_mtime}, f)
+        except OSError as err:  # read only plugin directory: parse the csv every time
+            print(f'cannot write knob cache {npy_file}: {err}')
+            return matrix
+        return np.load(npy_file, mmap_mode='r')
+
+    @property
+    def _matrix(self) -> np.ndarray:
+        if self._knob_matrix is None:
+            self._knob_matrix = self.load_knob(self._csv_file_name)
+        return self._knob_matrix
+
+    def get_count(self):
+        if self._knob_matrix is not None:
+            return self._knob_matrix.shape[0]
+        return len(self._row_names)
+
+    def get_names(self):
+        return self._row_names
+
+    def _compile(self, vars):
+        """
+        index array and contiguous sub matrix of the knobs in vars, in the order of vars
+        :param vars: tuple of knob names
+        """
+        if vars == tuple(self._row_names):
+            return np.arange(self.get_count()), self._matrix
+        idx = np.array([self._row_index[name] for name in vars], dtype=np.intp)
+        return idx, np.ascontiguousarray(self._matrix[idx])
+
+    def gen_matrix(self, vars):
+        """
+        rows of the knob matrix selected by vars, in the order of vars.
+        Selections are compiled once and kept in a small LRU cache.
+        :param vars: list of knob names
+        :return: (len(vars) x n magnets) matrix
+        """
+        vars = tuple(vars)
+        selection = self._selections.get(vars)
+        if selection is None:
+            selection = self._selections[vars] = self._compile(vars)
+            if len(self._selections) > self.cache_size:
+                self._selections.popitem(last=False)
+        else:
+            self._selections.move_to_end(vars)
+        return selection[1]
+
+    def project(self, x, vars, initial=None, out=None):
+        """
+        magnet strengths for knob amplitudes x, initial + x @ K, and their check against the per magnet limits
+        :param x: knob amplitudes in the order of vars, or (n candidates x len(vars)) batch
+        :param vars: list of knob names
+        :param initial: strengths of n magnets added to the knob change, None: knob change only
+        :param out: optional float64 output array of n magnets (or n candidates x n magnets), reused between calls
+        :return: (strengths, feasible): array of n magnets (or n candidates x n magnets),
+                 bool (or (n candidates,) bool array): all magnets within limits
+        """
+        strengths = np.matmul(x, self.gen_matrix(vars), out=out)
+        if initial is not None:
+            strengths += initial
+        return strengths, self.within_limits(strengths)
+
+    def get_limits(self):
+        """
+        :return: (low, high) per magnet strength limits, None if not limited
+        """
+        return self._low, self._high
+
+    def within_limits(self, strengths):
+        """
+        :param strengths: array of n magnets, or (n candidates x n magnets) batch
+        :return: bool, or (n candidates,) bool array: all magnets within limits
+        """
+        ok = np.ones(np.shape(strengths)[:-1], dtype=bool)
+        if self._low is not None:
+            ok &= np.all(strengths >= self._low, axis=-1)
+        if self._high is not None:
+            ok &= np.all(strengths <= self._high, axis=-1)
+        return ok
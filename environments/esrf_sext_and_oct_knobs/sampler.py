@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import deque, namedtuple
+import numpy as np
+
+# one background acquisition: epoch time at the end of the read and {channel: value}
+Acquisition = namedtuple('Acquisition', ['t', 'values'])
+
+
+def relative_drift(times, values):
+    """
+    change of values over the time span of times, from a linear fit, relative to their mean
+    :param times: sample times, s
+    :param values: sample values
+    :return: |slope| * time span / |mean|, inf with less than 3 samples
+    """
+    if len(values) < 3:
+        return np.inf
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    slope = np.polyfit(times - times[0], values, 1)[0]
+    mean = abs(values.mean())
+    drift = abs(slope) * (times[-1] - times[0])
+    if drift == 0.0:
+        return 0.0
+    return drift / mean if mean > 0 else np.inf
+
+
+class BackgroundSampler:
+    """
+    thread reading a list of channels every period s into a timestamped ring buffer,
+    so that diagnostics are acquired while magnets settle
+    """
+
+    def __init__(self, read, period=0.5, buffer_size=1000):
+        """
+        :param read: function(list of channels) -> {channel: value}
+        :param period: s between the start of two reads
+        :param buffer_size: acquisitions kept
+        """
+        self._read = read
+        self._period = period
+        self._buffer = deque(maxlen=buffer_size)
+        self._channels = []
+        self._errors = 0
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def period(self):
+        return self._period
+
+    def start(self, channels):
+        """
+        start sampling channels. The buffer is cleared if the sampler was stopped or other channels were sampled,
+        acquisitions of a previous run are never served.
+        """
+        running = self.is_running()
+        with self._condition:
+            if list(channels) != self._channels or not running:
+                self._channels = list(channels)
+                self._buffer.clear()
+        if not running:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='badger-background-sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            t_start = time.monotonic()
+            with self._condition:
+                channels = self._channels
+            try:
+                values = self._read(channels)
+            except Exception as err:  # keep sampling, the next read may succeed
+                self._errors += 1
+                print(f'background sampling of {channels} failed: {err}')
+            else:
+                with self._condition:
+                    if channels == self._channels:
+                        self._buffer.append(Acquisition(time.time(), values))
+                        self._condition.notify_all()
+            self._stop.wait(max(self._period - (time.monotonic() - t_start), 0.0))
+
+    def samples_between(self, t_min, t_max=np.inf):
+        """
+        buffered acquisitions with t_min < t <= t_max, oldest first
+        """
+        with self._condition:
+            return [a for a in self._buffer if t_min < a.t <= t_max]
+
+    def wait_sample(self, t_min, timeout):
+        """
+        first acquisition taken after t_min, waiting for it if needed
+        :raise TimeoutError: if no acquisition arrives within timeout s
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                for acquisition in self._buffer:
+                    if acquisition.t > t_min:
+                        return acquisition
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.is_running():
+                    raise TimeoutError(f'no background acquisition of {self._channels} '
+                                       f'({self._errors} failed reads)')
+                self._condition.wait(remaining)
+
+    def errors(self):
+        return self._errors
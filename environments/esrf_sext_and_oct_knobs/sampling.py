@@ -0,0 +1,76 @@
+import math
+import time
+from collections import namedtuple
+
+# mean of the samples of an observable, its standard error and the number of samples
+SampleStats = namedtuple('SampleStats', ['mean', 'sem', 'n'])
+
+
+class RunningStats:
+    """
+    mean and variance of a stream of samples (Welford), without keeping the samples
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+
+    @property
+    def sem(self):
+        """
+        standard error of the mean, inf with less than 2 samples
+        """
+        if self.n < 2:
+            return math.inf
+        return math.sqrt(self._m2 / (self.n - 1) / self.n)
+
+    def relative_sem(self):
+        if self.sem == 0.0:
+            return 0.0
+        if self.mean == 0.0:
+            return math.inf
+        return self.sem / abs(self.mean)
+
+    def result(self):
+        """
+        :return: SampleStats, sem is inf with less than 2 samples (unknown uncertainty, not zero)
+        """
+        return SampleStats(self.mean, self.sem, self.n)
+
+
+def acquire_adaptive(acquire, names, min_samples, max_samples, rel_tol=0.0, dt=0.0):
+    """
+    call acquire until the relative standard error of the mean of every observable is below rel_tol,
+    or max_samples acquisitions were taken.
+    :param acquire: function without arguments returning {observable name: value} for one acquisition
+    :param names: observable names to sample
+    :param min_samples: acquisitions taken in any case
+    :param max_samples: maximum number of acquisitions. With rel_tol = 0, exactly max(min_samples, 1) are taken
+    :param rel_tol: target of sem / |mean|. 0: fixed number of acquisitions
+    :param dt: s to wait between acquisitions
+    :return: {observable name: SampleStats}
+    """
+    stats = {name: RunningStats() for name in names}
+    min_samples = max(min_samples, 1)
+    max_samples = max(max_samples, min_samples) if rel_tol > 0 else min_samples
+
+    for i in range(max_samples):
+        values = acquire()
+        for name, s in stats.items():
+            s.add(values[name])
+
+        if i + 1 >= min_samples and rel_tol > 0 and \
+                all(s.relative_sem() <= rel_tol for s in stats.values()):
+            break
+        # wait before next acquisition
+        if i + 1 < max_samples:
+            time.sleep(dt)
+
+    return {name: s.result() for name, s in stats.items()}
@@ -1,18 +1,15 @@
 import time
 import numpy as np
-import tango
-from tango import DevState
 from badger import environment
 from statistics import mean
-from ringcontrol.utils.timing import wait_for
-import sys
+from .sampling import SampleStats, acquire_adaptive, binomial_sem
+from .devices import devices
+from .sequencer import ShotSequencer
+from .history import HistoryReader
 from badger.errors import BadgerNoInterfaceError
 
-
-rips = tango.DeviceProxy('sy/ps-rips/manager')
-gun = tango.DeviceProxy('elin/beam/run')
-KE = tango.DeviceProxy('sy/ps-ke/1')
-treflite = tango.DeviceProxy('srdiag/trefflite/sy-sr')
+# bounds of the KE shots of inj_eff_shooting, declared as variable if fidelity_variable
+FIDELITY_VARIABLE = {'fidelity_shots': [2.0, 50.0]}
 
 # __authors__ = 'S.Liuzzo, T.Perron, N.Leclercq, L.Carver'
 
@@ -48,22 +45,47 @@ class Environment(environment.Environment):
                  'sy/ps-se/2-1/Current': [9700.0, 10500.0]  # SE2
                  }
 
-    observables = ['inj_eff_shooting', 'inj_eff_continuous']
+    observables = ['inj_eff_shooting', 'inj_eff_continuous',
+                    'inj_eff_continuous_sem',  # standard error of the mean of inj_eff_continuous
+                    'inj_eff_shooting_sem',  # binomial uncertainty of inj_eff_shooting
+                    'inj_eff_shooting_samples']  # number of treflite samples averaged in inj_eff_shooting
 
     wait_time: int = 1
-    number_of_shots: int = 10
+    number_of_shots: int = 10  # fidelity of inj_eff_shooting if the fidelity_shots variable is not set
+    # declare the fidelity_shots variable, [2, 50] KE shots of the next inj_eff_shooting evaluations, for
+    # multi-fidelity algorithms setting it themselves (botorch_bo fidelity_index). Off by default, so that
+    # algorithms optimizing all variables never tune the number of shots as a machine knob
+    fidelity_variable: bool = False
+    # spend extra_shots more on candidates whose inj_eff_shooting is within promising_sigma binomial
+    # uncertainties of the best one seen. 0: no extra shots
+    extra_shots: int = 0
+    promising_sigma: float = 1.0
     number_aquisitions: int = 2
+    # adaptive sampling of inj_eff_continuous: acquire until the standard error of the mean is below
+    # relative_sem_tolerance times the mean, or max_acquisitions are taken. 0: number_aquisitions samples
+    relative_sem_tolerance: float = 0.0
+    max_acquisitions: int = 10
+    # shot sequence: s between two device state reads, and maximum wait for a RIPS or gun transition
+    state_poll_period: float = 0.05
+    state_timeout: float = 10.0
+    # keep RIPS ramping and the gun on between inj_eff_shooting evaluations, only KE shots are triggered
+    # at each evaluation. They are stopped by end_session(), on error, after session_idle_timeout s
+    # without evaluation, or when the process exits
+    shooting_session: bool = False
+    session_idle_timeout: float = 60.0
+    # s waited after the last shot for the treflite entries of the burst to reach the polling history
+    history_latency: float = 1.0
     seconds_between_acquisitions: int = 2
     verbose: bool = False
 
-    # print limits
-    if verbose:
-        print('limits set in environment')
-        [print(f'{k} : {v}') for k, v in self.variables.items()]
-
-    self.current_vars = []
+    _current_vars = []
 
-    initial_values = {}
+    _initial_values = {}
+    _last_statistics = {}
+    _sequencer = None
+    _history = None
+    _fidelity_shots = None
+    _best_inj_eff = None
 
 
     # get current if 200mA, pause
@@ -74,6 +96,23 @@ class Environment(environment.Environment):
     # if SI3 is 'On' (string of char) refill is in progress. Revert to last step and wait untill not 'On'.
 
 
+    @property
+    def variable_names(self):
+        return list(self._get_all_variables())
+
+    def get_bounds(self, variable_names: list[str]) -> dict:
+        variables = self._get_all_variables()
+        return {name: variables[name] for name in variable_names}
+
+    def _get_all_variables(self) -> dict:
+        """
+        bounds of the variables of this instance: the class variables, plus fidelity_shots if fidelity_variable
+        (variables is a class attribute, the same for all instances)
+        """
+        if self.fidelity_variable:
+            return {**self.variables, **FIDELITY_VARIABLE}
+        return self.variables
+
     def get_variables(self, variable_names: list[str]) -> dict:
 
         variable_outputs = {}
@@ -82,20 +121,26 @@ class Environment(environment.Environment):
             raise BadgerNoInterfaceError
 
         if self.verbose:
+            # print limits
+            print('limits set in environment')
+            [print(f'{k} : {v}') for k, v in self._get_all_variables().items()]
             print(f"requested values: {variable_names}")
 
-        self.current_vars=[]
+        self._current_vars=[]
         for attr in variable_names:
+            if attr == 'fidelity_shots':
+                variable_outputs[attr] = self.get_fidelity()
+                continue
             val = self.interface.get_value(attr)
-            if not self.initial_values:
-                self.initial_values[attr] = val
-            self.current_vars.append(val)
+            if not self._initial_values:
+                self._initial_values[attr] = val
+            self._current_vars.append(val)
             variable_outputs.update({attr: val})
 
         if self.verbose:
             print('initial values of variables')
-            [print(f'{k} : initial = {self.initial_values[k]}, present = {v}')
-             for k, v in zip(self.initial_values.keys(), self.current_vars)]
+            [print(f'{k} : initial = {self._initial_values[k]}, present = {v}')
+             for k, v in zip(self._initial_values.keys(), self._current_vars)]
 
         return variable_outputs
 
@@ -104,42 +149,58 @@ class Environment(environment.Environment):
         if self.interface is None:
             raise BadgerNoInterfaceError
 
+        if 'fidelity_shots' in variable_inputs:
+            variable_inputs = dict(variable_inputs)
+            self.set_fidelity(variable_inputs.pop('fidelity_shots'))
+
         self.interface.set_values(variable_inputs)
 
     def get_observables(self, observable_names: list[str]) -> dict:
+        try:
+            return self._get_observables(observable_names)
+        except BaseException:
+            # do not leave the injector armed after a failed evaluation
+            self.end_session()
+            raise
+
+    def _get_observables(self, observable_names: list[str]) -> dict:
 
         if self.interface is None:
             raise BadgerNoInterfaceError
 
-        def is_not_on(dev):
-            return dev.state() != DevState.ON
-
-        dt=self.waiting_time
+        dt=self.wait_time
         time.sleep(dt)  # wait for magnets set point reached
 
         n_acq=self.number_aquisitions
         dt_acq =self.seconds_between_acquisitions
-        n_shots =  self.number_of_shots
+        n_shots = self.get_fidelity()
 
         observable_outputs = {}
+        self._last_statistics = {}
 
         for obs in observable_names:
-            if obs == 'inj_eff_continuous':
-                _ie = []
-                for i in range(n_acq):
-                    # get acquisition i
-                    ie = self.interface.get_value('srdiag/trefflite/sy-sr/InjectionEfficiency')
-                    _ie.append(ie)
-                    # wait before next acquisition
-                    if n_acq > 1:
-                        time.sleep(dt_acq)
-
-                mean_ie = mean(_ie)
-                observable_outputs[obs] = mean_ie
-
-            if obs == 'inj_eff_shooting':
-
-                _ie = []
+            if obs in ('inj_eff_continuous', 'inj_eff_continuous_sem') and \
+                    'inj_eff_continuous' not in self._last_statistics:
+                obs = 'inj_eff_continuous'
+                stats = acquire_adaptive(
+                    lambda: {obs: self.interface.get_value('srdiag/trefflite/sy-sr/InjectionEfficiency')},
+                    [obs],
+                    min_samples=n_acq,
+                    max_samples=self.max_acquisitions,
+                    rel_tol=self.relative_sem_tolerance,
+                    dt=dt_acq)
+                self._last_statistics.update(stats)
+                if self.verbose:
+                    print(f'Inj.Eff. <{stats[obs].n} acquisitions> is: {stats[obs].mean * 100}% '
+                          f'+- {stats[obs].sem * 100}%')
+
+                if obs in observable_names:
+                    observable_outputs[obs] = stats[obs].mean
+                if 'inj_eff_continuous_sem' in observable_names:
+                    observable_outputs['inj_eff_continuous_sem'] = stats[obs].sem
+
+            if obs in ('inj_eff_shooting', 'inj_eff_shooting_sem', 'inj_eff_shooting_samples') and \
+                    'inj_eff_shooting' not in self._last_statistics:
 
                 # check if need to kill in case stop till key
                 cur = self.interface.get_value('srdiag/beam-current/total/Current')
@@ -150,108 +211,104 @@ class Environment(environment.Environment):
                 if cur > 198.0:
                     raise ValueError('current is still above 198mA')
 
-                _ie = []
-
-                # rips on
-                if rips.state() != DevState.RUNNING:
-                    if rips.state() != DevState.MOVING:
-                        time.sleep(1)
-                    # RIPS with one retry
-                    try:
-                        rips.StartRamping()
-                    except Exception as ex:
-                        print('failed to start RIPS ramp, wait 5s and try again.')
-                        time.sleep(5)
-                        rips.StartRamping()
-                    time.sleep(1)  # wait for rips to start
-
-                # gun on
-                if gun.state() == DevState.OFF:
-                    gun.On()
-
-                # trig KE for a given number of time
-                if KE.state() == DevState.STANDBY:
-                    cm = KE.CounterMode
-                    KE.CounterMode = n_shots  # set number of shots
-                    # print(f'{n_shots}')
-
-                    # KE ON, with 1 retry
-                    try:
-                        KE.On()  # shoot
-                    except Exception as ex:
-                        KE.Reset()
-                        time.sleep(0.5)
-                        KE.On()  # try again
-
-                    time.sleep(0.25 * n_shots + 1.0)
-
-                    # KE Standby, with 1 retry
-                    try:
-                        KE.Standby()
-                    except Exception as ex:
-                        KE.Reset()
-                        time.sleep(0.5)
-                        KE.Standby()  # try again
-
-                    KE.CounterMode = cm  # restore initial counter mode state
-                else:
-                    if rips.state() != DevState.MOVING:
-                        time.sleep(1)
-
-                    # RIPS with one retry
-                    try:
-                        rips.StopRamping()
-                    except Exception as ex:
-                        print('failed to stop RIPS ramp, wait 5s and try again.')
-                        time.sleep(5)
-                        rips.StopRamping()  # try again
-
-                    gun.Off()
-                    KE.Standby()
-                    raise ValueError('KE not in standby')
-
-                # wait for shots
-                # wait_for(is_not_on(KE), period=0.25, ini=0, timeout=5)
-
-                # rips stop ramp
-                if rips.state() == DevState.RUNNING:
-                    if rips.state() != DevState.MOVING:
-                        time.sleep(1)
-                    # RIPS with one retry
-                    try:
-                        rips.StopRamping()
-                    except Exception as ex:
-                        print('failed to stop RIPS ramp, wait 5s and try again.')
-                        time.sleep(5)
-                        rips.StopRamping()  # try again
-
-                # gun off
-                if gun.state() == DevState.ON:
-                    gun.Off()
-
-                # get last train of non zero or NaN acquisition from HDB
-                last_treflite = [a.value for a in treflite.attribute_history('InjectionEfficiency', 50)]
-
-                print(f'last Inj. Eff. data: {last_treflite}')
-
-                # get good data
-                good_treff = []
-                for t in last_treflite:
-                    if t is not None:
-                        if t > 0:
-                            good_treff.append(t)
-
-                print(f'good Inj. Eff. data: {good_treff}')
-
-                if len(good_treff) == 0:
-                    mean_ie = 0.0
-                else:
-                    mean_ie = mean(np.array(good_treff))
-
-                print(f'Inj.Eff. <{n_shots} shots> is: {mean_ie * 100}%')
-
-                observable_outputs[obs] = mean_ie
+                # efficiency and number of treflite samples averaged
+                mean_ie, n_samples = self._shoot(n_shots)
+                sem_ie = binomial_sem(mean_ie, n_samples)
+
+                # promising candidate: refine with extra shots
+                if self.extra_shots > 0 and self._best_inj_eff is not None and \
+                        mean_ie + self.promising_sigma * sem_ie >= self._best_inj_eff:
+                    extra_ie, n_extra = self._shoot(self.extra_shots)
+                    if n_samples + n_extra > 0:
+                        mean_ie = (mean_ie * n_samples + extra_ie * n_extra) / (n_samples + n_extra)
+                    n_samples += n_extra
+                    sem_ie = binomial_sem(mean_ie, n_samples)
+                    if self.verbose:
+                        print(f'Inj.Eff. <{n_samples} samples> is: {mean_ie * 100}% +- {sem_ie * 100}%')
+
+                if self._best_inj_eff is None or mean_ie > self._best_inj_eff:
+                    self._best_inj_eff = mean_ie
+
+                self._last_statistics['inj_eff_shooting'] = SampleStats(mean_ie, sem_ie, n_samples)
+                for name, value in (('inj_eff_shooting', mean_ie),
+                                    ('inj_eff_shooting_sem', sem_ie),
+                                    ('inj_eff_shooting_samples', n_samples)):
+                    if name in observable_names:
+                        observable_outputs[name] = value
 
         return observable_outputs
 
-
+    def _get_sequencer(self) -> ShotSequencer:
+        if self._sequencer is None:
+            self._sequencer = ShotSequencer(devices)
+        # settings read at every evaluation, they may be changed between evaluations
+        self._sequencer.poll_period = self.state_poll_period
+        self._sequencer.state_timeout = self.state_timeout
+        self._sequencer.idle_timeout = self.session_idle_timeout
+        self._sequencer.verbose = self.verbose
+        return self._sequencer
+
+    def set_fidelity(self, n_shots: int = None):
+        """
+        number of KE shots of the next inj_eff_shooting evaluations, see fidelity_variable
+        :param n_shots: number of shots, None to go back to number_of_shots
+        """
+        self._fidelity_shots = None if n_shots is None else max(int(round(n_shots)), 1)
+
+    def get_fidelity(self) -> int:
+        """
+        number of KE shots of the next inj_eff_shooting evaluation
+        """
+        return self.number_of_shots if self._fidelity_shots is None else self._fidelity_shots
+
+    def _shoot(self, n_shots: int) -> tuple:
+        """
+        shoot n_shots and average the positive injection efficiencies of the burst
+        :return: mean injection efficiency (0 without good data), number of samples averaged
+        """
+        # entries of the polling history up to now are not part of this burst
+        self._get_history().mark()
+
+        # RIPS ramp, gun on, KE shots, standby, ramp stop, gun off
+        self._get_sequencer().run(n_shots, session=self.shooting_session)
+
+        # get the train of non zero or NaN acquisitions of this burst from the polling history
+        last_treflite = [value for t, value in self._get_history().read_new(wait=self.history_latency)]
+
+        print(f'last Inj. Eff. data: {last_treflite}')
+
+        # get good data
+        good_treff = []
+        for t in last_treflite:
+            if t is not None:
+                if t > 0:
+                    good_treff.append(t)
+
+        print(f'good Inj. Eff. data: {good_treff}')
+
+        if len(good_treff) == 0:
+            mean_ie = 0.0
+        else:
+            mean_ie = mean(np.array(good_treff))
+
+        print(f'Inj.Eff. <{n_shots} shots> is: {mean_ie * 100}%')
+
+        return mean_ie, len(good_treff)
+
+    def _get_history(self) -> HistoryReader:
+        if self._history is None:
+            self._history = HistoryReader(devices['treflite'], 'InjectionEfficiency')
+        return self._history
+
+    def end_session(self):
+        """
+        stop the RIPS ramp and the gun armed by a shooting session
+        """
+        if self._sequencer is not None:
+            self._sequencer.disarm()
+
+    def get_last_statistics(self) -> dict:
+        """
+        {observable name: SampleStats(mean, sem, n)} of the sampled observables of the last get_observables
+        """
+        return dict(self._last_statistics)
@@ -1,29 +1,24 @@
 import numpy as np
-import tango
-from tango import DevState
 from statistics import mean
-from ringcontrol.utils.timing import wait_for
-import time
-
-# tango devices
-rips = tango.DeviceProxy('sy/ps-rips/manager')
-gun = tango.DeviceProxy('elin/beam/run')
-KE = tango.DeviceProxy('sy/ps-ke/1')
-treflite = tango.DeviceProxy('srdiag/trefflite/sy-sr')
-cur = tango.DeviceProxy('srdiag/beam-current/total')
+try:
+    from .devices import devices
+    from .sequencer import ShotSequencer
+    from .history import HistoryReader
+except ImportError:  # run as a script
+    from devices import devices
+    from sequencer import ShotSequencer
+    from history import HistoryReader
 
 # __authors__ = 'S.Liuzzo, T.Perron, N.Leclercq, L.Carver, N.CArmignani, P.Raimondi'
 
 
-def is_not_on(dev):
-    return dev.state() != DevState.ON
-
-
 def get_injection_efficiency(n_shots=10.0):
     """
     get injection efficiency. ALL injectors should be on. guan off and rips not ramping
 
     """
+    # tango devices, connected on first use
+    treflite, cur = devices['treflite'], devices['cur']
 
     if cur.Current > 198.0:
         # input('Please kill beam. Press any key to continue')
@@ -32,87 +27,15 @@ def get_injection_efficiency(n_shots=10.0):
     if cur.Current > 198.0:
         raise ValueError('current is still above 198mA')
 
-    _ie = []
-
-    # rips on
-    if rips.state() != DevState.RUNNING:
-        if rips.state() != DevState.MOVING:
-            time.sleep(1)
-        # RIPS with one retry
-        try:
-            rips.StartRamping()
-        except Exception as ex:
-            print('failed to start RIPS ramp, wait 5s and try again.')
-            time.sleep(5)
-            rips.StartRamping()
-        time.sleep(1)  # wait for rips to start
-
-    # gun on
-    if gun.state() == DevState.OFF:
-        gun.On()
-
-    # trig KE for a given number of time
-    if KE.state() == DevState.STANDBY:
-        cm = KE.CounterMode
-        KE.CounterMode = n_shots  # set number of shots
-        # print(f'{n_shots}')
-
-        # KE ON, with 1 retry
-        try:
-            KE.On()  # shoot
-        except Exception as ex:
-            KE.Reset()
-            time.sleep(0.5)
-            KE.On()  # try again
-
-        time.sleep(0.25 * n_shots + 1.0)
-
-        # KE Standby, with 1 retry
-        try:
-            KE.Standby()
-        except Exception as ex:
-            KE.Reset()
-            time.sleep(0.5)
-            KE.Standby()  # try again
-
-        KE.CounterMode = cm  # restore initial counter mode state
-    else:
-        if rips.state() != DevState.MOVING:
-            time.sleep(1)
-
-        # RIPS with one retry
-        try:
-            rips.StopRamping()
-        except Exception as ex:
-            print('failed to stop RIPS ramp, wait 5s and try again.')
-            time.sleep(5)
-            rips.StopRamping()  # try again
-
-        gun.Off()
-        KE.Standby()
-        raise ValueError('KE not in standby')
-
-    # wait for shots
-    # wait_for(is_not_on(KE), period=0.25, ini=0, timeout=5)
-
-    # rips stop ramp
-    if rips.state() == DevState.RUNNING:
-        if rips.state() != DevState.MOVING:
-            time.sleep(1)
-        # RIPS with one retry
-        try:
-            rips.StopRamping()
-        except Exception as ex:
-            print('failed to stop RIPS ramp, wait 5s and try again.')
-            time.sleep(5)
-            rips.StopRamping()  # try again
-
-    # gun off
-    if gun.state() == DevState.ON:
-        gun.Off()
-
-    # get last train of non zero or NaN acquisition from HDB
-    last_treflite = [a.value for a in treflite.attribute_history('InjectionEfficiency', 50)]
+    # acquisitions already in the polling history are not part of this burst
+    reader = HistoryReader(treflite, 'InjectionEfficiency')
+    reader.mark()
+
+    # RIPS ramp, gun on, KE shots, standby, ramp stop, gun off
+    ShotSequencer(devices).run(n_shots)
+
+    # get the train of non zero or NaN acquisitions of this burst from the polling history
+    last_treflite = [value for t, value in reader.read_new(wait=1.0)]
 
     print(f'last Inj. Eff. data: {last_treflite}')
 
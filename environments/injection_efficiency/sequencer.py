@@ -0,0 +1,242 @@
+import atexit
+import logging
+import threading
+import time
+
+
+class ShotSequencer:
+    """
+    injection shot sequence: RIPS ramp start -> gun on -> KE counted shots -> KE standby -> RIPS ramp stop -> gun off.
+    Each phase ends as soon as the devices reach the expected state (polled every poll_period s),
+    instead of waiting a worst case time, and its duration is logged (logging.info, printed if verbose).
+    In a session, RIPS and the gun are armed once by the first run and only the KE shots are triggered
+    by the next ones, until disarm(), an error, or idle_timeout s without run (at exit as last fallback).
+    """
+
+    # phases of run(), in order
+    PHASES = ('ramp_start', 'gun_on', 'shots', 'ramp_stop', 'gun_off')
+    ARM_PHASES = ('ramp_start', 'gun_on')
+    DISARM_PHASES = ('ramp_stop', 'gun_off')
+
+    def __init__(self, devices, poll_period=0.05, state_timeout=10.0, retry_delay=5.0, ke_retry_delay=0.5,
+                 idle_timeout=300.0, verbose=True, states=None):
+        """
+        :param devices: DeviceRegistry giving 'rips', 'gun' and 'KE'
+        :param poll_period: s between two state reads
+        :param state_timeout: s to wait for a state transition of RIPS or the gun
+        :param retry_delay: s before retrying a failed RIPS command
+        :param ke_retry_delay: s before retrying a failed KE command, after its reset
+        :param idle_timeout: s without session run after which RIPS and the gun are stopped
+        :param verbose: also print the duration of each phase
+        :param states: enumeration of the device states, tango.DevState if None
+        """
+        if states is None:
+            from tango import DevState as states
+        self._devices = devices
+        self._states = states
+        self.poll_period = poll_period
+        self.state_timeout = state_timeout
+        self.retry_delay = retry_delay
+        self.ke_retry_delay = ke_retry_delay
+        self.idle_timeout = idle_timeout
+        self.verbose = verbose
+        self._durations = {}
+        self._armed = False
+        # runs and disarm by the idle watchdog thread are serialized
+        self._lock = threading.RLock()
+        self._watchdog = None
+        self._watchdog_id = 0
+
+    def wait_state(self, device, predicate, timeout):
+        """
+        poll device.state() until predicate(state) is True
+        :return: True if reached, False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while not predicate(device.state()):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_period)
+        return True
+
+    def _retry(self, command, on_error=None, message=None, delay=None):
+        """
+        call command, and again after delay s (default retry_delay) if it failed
+        """
+        try:
+            command()
+        except Exception:
+            if message is not None:
+                print(message)
+            if on_error is not None:
+                on_error()
+            time.sleep(self.retry_delay if delay is None else delay)
+            command()  # try again
+
+    def ramp_start(self):
+        rips = self._devices['rips']
+        if rips.state() == self._states.RUNNING:
+            return
+        self.wait_state(rips, lambda state: state != self._states.MOVING, self.state_timeout)
+        # RIPS with one retry
+        self._retry(rips.StartRamping, message=f'failed to start RIPS ramp, wait {self.retry_delay}s and try again.')
+        if not self.wait_state(rips, lambda state: state == self._states.RUNNING, self.state_timeout):
+            raise TimeoutError(f'RIPS not ramping after {self.state_timeout} s ({rips.state()})')
+
+    def gun_on(self):
+        gun = self._devices['gun']
+        if gun.state() == self._states.OFF:
+            gun.On()
+            if not self.wait_state(gun, lambda state: state == self._states.ON, self.state_timeout):
+                raise TimeoutError(f'gun not on after {self.state_timeout} s ({gun.state()})')
+
+    def shots(self, n_shots):
+        """
+        trigger KE for n_shots shots (4 Hz) and put it back in standby
+        """
+        KE = self._devices['KE']
+        if KE.state() != self._states.STANDBY:
+            raise ValueError('KE not in standby')
+
+        cm = KE.CounterMode
+        KE.CounterMode = n_shots  # set number of shots
+        try:
+            # KE ON, with 1 retry
+            self._retry(KE.On, on_error=KE.Reset, delay=self.ke_retry_delay)
+            # the counter switches KE off after the last shot. Past the worst case time, standby anyway
+            self.wait_state(KE, lambda state: state == self._states.ON, 1.0)
+            if not self.wait_state(KE, lambda state: state != self._states.ON, 0.25 * n_shots + 1.0):
+                print(f'KE still on after {n_shots} shots')
+            # KE Standby, with 1 retry
+            self._retry(KE.Standby, on_error=KE.Reset, delay=self.ke_retry_delay)
+        finally:
+            KE.CounterMode = cm  # restore initial counter mode state
+
+    def ramp_stop(self):
+        rips = self._devices['rips']
+        if rips.state() != self._states.RUNNING:
+            return
+        self.wait_state(rips, lambda state: state != self._states.MOVING, self.state_timeout)
+        # RIPS with one retry
+        self._retry(rips.StopRamping, message=f'failed to stop RIPS ramp, wait {self.retry_delay}s and try again.')
+        if not self.wait_state(rips, lambda state: state != self._states.RUNNING, self.state_timeout):
+            print(f'RIPS still ramping after {self.state_timeout} s')
+
+    def gun_off(self):
+        gun = self._devices['gun']
+        if gun.state() == self._states.ON:
+            gun.Off()
+
+    def abort(self):
+        """
+        stop the ramp, the gun and KE, whatever their state, and end the session
+        """
+        self._end_session()
+        for command in (self.ramp_stop, self.gun_off, lambda: self._devices['KE'].Standby()):
+            try:
+                command()
+            except Exception as ex:
+                print(f'abort: {ex}')
+
+    def _phase(self, name, *args):
+        t0 = time.monotonic()
+        getattr(self, name)(*args)
+        self._durations[name] = time.monotonic() - t0
+        self._log(f'{name}: {self._durations[name]:.2f} s')
+
+    def _log(self, message):
+        logging.info(message)
+        if self.verbose:
+            print(message)
+
+    def _run_phases(self, phases, n_shots=None):
+        """
+        run phases in order, aborting the sequence (ramp stopped, gun off, KE standby) if one fails or is interrupted
+        """
+        try:
+            for name in phases:
+                self._phase(name, *((n_shots,) if name == 'shots' else ()))
+        except BaseException:
+            self.abort()
+            raise
+
+    def run(self, n_shots, session=False):
+        """
+        :param n_shots: number of KE shots
+        :param session: keep RIPS ramping and the gun on after the shots, for the next run
+        """
+        with self._lock:
+            self._stop_watchdog()
+            self._durations = {}
+            t0 = time.monotonic()
+            if session:
+                self.arm()
+                self._run_phases(('shots',), n_shots)
+                self._start_watchdog()
+            else:
+                self.disarm()  # end a previous session
+                self._run_phases(self.PHASES, n_shots)
+        self._log(f'shot sequence: {time.monotonic() - t0:.2f} s')
+
+    def arm(self):
+        """
+        start the RIPS ramp and the gun for a session of runs. Once armed, only their state is checked
+        """
+        self._run_phases(self.ARM_PHASES)
+        if not self._armed:
+            self._armed = True
+            # do not leave the injector armed if the optimization ends without disarm
+            atexit.register(self.disarm)
+
+    def disarm(self):
+        """
+        stop the RIPS ramp and the gun at the end of a session
+        """
+        with self._lock:
+            if not self._armed:
+                return
+            self._end_session()
+            self._run_phases(self.DISARM_PHASES)
+
+    def _end_session(self):
+        self._stop_watchdog()
+        if self._armed:
+            self._armed = False
+            atexit.unregister(self.disarm)
+
+    def _start_watchdog(self):
+        """
+        disarm after idle_timeout s unless another session run comes first
+        """
+        if self.idle_timeout <= 0:
+            return
+        self._watchdog_id += 1
+        self._watchdog = threading.Timer(self.idle_timeout, self._idle, args=(self._watchdog_id,))
+        self._watchdog.daemon = True
+        self._watchdog.start()
+
+    def _stop_watchdog(self):
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            self._watchdog = None
+        self._watchdog_id += 1  # a watchdog already firing does nothing
+
+    def _idle(self, watchdog_id):
+        with self._lock:
+            if watchdog_id != self._watchdog_id or not self._armed:
+                return
+            print(f'no injection for {self.idle_timeout} s, stop RIPS ramp and gun')
+            self._watchdog = None
+            try:
+                self.disarm()
+            except Exception as ex:
+                print(f'disarm: {ex}')
+
+    def is_armed(self):
+        return self._armed
+
+    def get_durations(self):
+        """
+        {phase: duration in s} of the last run
+        """
+        return dict(self._durations)
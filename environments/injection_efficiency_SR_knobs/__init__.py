@@ -1,45 +1,21 @@
 import time
 import numpy as np
-import tango
-from tango import DevState
 from badger import environment
-from badger.interface import Interface
+from badger.errors import BadgerNoInterfaceError
 from statistics import mean
 from itertools import compress
-from ringcontrol.utils.timing import wait_for
 import pathlib
-import sys
+from .knobs import Knobs, knob_names
+from .sampling import SampleStats, acquire_adaptive, binomial_sem
+from .devices import devices
+from .sequencer import ShotSequencer
+from .history import HistoryReader
 
-rips = tango.DeviceProxy('sy/ps-rips/manager')
-gun = tango.DeviceProxy('elin/beam/run')
-KE = tango.DeviceProxy('sy/ps-ke/1')
-treflite = tango.DeviceProxy('srdiag/trefflite/sy-sr')
+# bounds of the KE shots of inj_eff_shooting, declared as variable if fidelity_variable
+FIDELITY_VARIABLE = {'fidelity_shots': [2.0, 50.0]}
 
 # __authors__ = 'S.Liuzzo, T.Perron, N.Leclercq, L.Carver'
 
-class Knobs:
-    def __init__(self, csv_file_name, name):
-        self._matrix = self.load_knob_from_csv(csv_file_name)
-        # there are no names in csv so generate names
-        self._row_names = [f"knob-{name}-{i}" for i in range(self.get_count())]
-
-    @staticmethod
-    def load_knob_from_csv(filename) -> np.ndarray:
-        return np.genfromtxt(filename, delimiter=',')
-
-    def get_count(self):
-        return self._matrix.shape[0]
-
-    def get_names(self):
-        return self._row_names
-
-    def gen_matrix(self, vars):
-        if len(vars) == len(self._row_names):
-            return self._matrix
-        vars_hash = set(vars)
-        remove_row_idx = [idx for idx, name in enumerate(self._row_names) if not name in vars_hash]
-        return np.delete(self._matrix, remove_row_idx, axis=0)  # remove rows
-
 
 class Environment(environment.Environment):
 
@@ -47,30 +23,86 @@ class Environment(environment.Environment):
 
     # define knobs and add them to variables
     _path = pathlib.Path(__file__).parent.resolve()
-    _knobs_sext = Knobs(_path / "data" / "SextKnob.csv", "sext")
-    _knobs_oct = Knobs(_path / "data" / "OctKnob.csv", "octu")
-    _limits_knobs_sext = {name: [-1, 1] for name in _knobs_sext.get_names()}
+    # names from the number of rows only, the matrices are loaded by the Knobs of _get_knobs on first use
+    _limits_knobs_sext = {name: [-1, 1] for name in knob_names(_path / "data" / "SextKnob.csv", "sext")}
     _limits_knobs_sext['knob-sext-2'] = [-2, 2]
-    _limits_knobs_oct = {name: [-1, 1] for name in _knobs_oct.get_names()}
+    _limits_knobs_oct = {name: [-1, 1] for name in knob_names(_path / "data" / "OctKnob.csv", "octu")}
     variables = {}
     for _d in (_limits_knobs_sext, _limits_knobs_oct):
         variables.update(_d)
 
-    observables =  ['inj_eff_shooting', 'inj_eff_continuous']
+    observables =  ['inj_eff_shooting', 'inj_eff_continuous',
+                    'inj_eff_continuous_sem',  # standard error of the mean of inj_eff_continuous
+                    'inj_eff_shooting_sem',  # binomial uncertainty of inj_eff_shooting
+                    'inj_eff_shooting_samples']  # number of treflite samples averaged in inj_eff_shooting
 
     # initial values for variables
     _variables = {v: 0.0 for v in variables.keys()}
     _initial_sext = None
     _initial_oct = None
+    _sext_buffer = None  # reusable output of initial + K^T x
+    _oct_buffer = None
+    _magnet_knobs = None  # (sext, oct) Knobs checking the magnet limits of this environment
     _cur_0 = None
+    _last_statistics = {}
+    _sequencer = None
+    _history = None
+    _fidelity_shots = None
+    _best_inj_eff = None
 
     # Environment parameters
     wait_time: int = 1
-    number_of_shots: int = 10
+    number_of_shots: int = 10  # fidelity of inj_eff_shooting if the fidelity_shots variable is not set
+    # declare the fidelity_shots variable, [2, 50] KE shots of the next inj_eff_shooting evaluations, for
+    # multi-fidelity algorithms setting it themselves (botorch_bo fidelity_index). Off by default, so that
+    # algorithms optimizing all variables never tune the number of shots as a machine knob
+    fidelity_variable: bool = False
+    # spend extra_shots more on candidates whose inj_eff_shooting is within promising_sigma binomial
+    # uncertainties of the best one seen. 0: no extra shots
+    extra_shots: int = 0
+    promising_sigma: float = 1.0
     number_aquisitions: int = 2
+    # adaptive sampling of inj_eff_continuous: acquire until the standard error of the mean is below
+    # relative_sem_tolerance times the mean, or max_acquisitions are taken. 0: number_aquisitions samples
+    relative_sem_tolerance: float = 0.0
+    max_acquisitions: int = 10
+    # shot sequence: s between two device state reads, and maximum wait for a RIPS or gun transition
+    state_poll_period: float = 0.05
+    state_timeout: float = 10.0
+    # keep RIPS ramping and the gun on between inj_eff_shooting evaluations, only KE shots are triggered
+    # at each evaluation. They are stopped by end_session(), on error, after session_idle_timeout s
+    # without evaluation, or when the process exits
+    shooting_session: bool = False
+    session_idle_timeout: float = 60.0
+    # s waited after the last shot for the treflite entries of the burst to reach the polling history
+    history_latency: float = 1.0
     seconds_between_acquisitions: int = 2
+    # limits of each sextupole / octupole CorrectionStrength, checked before any write. 0: no limit
+    max_abs_sext_strength: float = 0.0
+    max_abs_oct_strength: float = 0.0
+    # per magnet limits, csv file with one 'low, high' line per magnet (in data/ or absolute path).
+    # If set, used instead of max_abs_sext_strength / max_abs_oct_strength
+    sext_limits_file: str = ''
+    oct_limits_file: str = ''
     verbose: bool = False
 
+    @property
+    def variable_names(self):
+        return list(self._get_all_variables())
+
+    def get_bounds(self, variable_names: list[str]) -> dict:
+        variables = self._get_all_variables()
+        return {name: variables[name] for name in variable_names}
+
+    def _get_all_variables(self) -> dict:
+        """
+        bounds of the variables of this instance: the class variables, plus fidelity_shots if fidelity_variable
+        (variables is a class attribute, the same for all instances)
+        """
+        if self.fidelity_variable:
+            return {**self.variables, **FIDELITY_VARIABLE}
+        return self.variables
+
     def get_variables(self, variable_names: list[str]) -> dict:
 
         if self.interface is None:
@@ -79,14 +111,20 @@ class Environment(environment.Environment):
         # store initial values if not available
         if self._cur_0 == None:
             print(f'store intitial values of strengths and currents')
-            self._initial_sext = self.interface.get_value(channel_name='srmag/m-s/all/CorrectionStrengths')
-            self._initial_oct = self.interface.get_value(channel_name='srmag/m-o/all/CorrectionStrengths')
+            # private contiguous float64 copies, knob deltas are added to them at every set_variables
+            self._initial_sext = np.array(self.interface.get_value(channel_name='srmag/m-s/all/CorrectionStrengths'),
+                                          dtype=np.float64)
+            self._initial_oct = np.array(self.interface.get_value(channel_name='srmag/m-o/all/CorrectionStrengths'),
+                                         dtype=np.float64)
+            self._sext_buffer = np.empty_like(self._initial_sext)
+            self._oct_buffer = np.empty_like(self._initial_oct)
             self._cur_0 = self.interface.get_value(channel_name='srdiag/beam-current/total/Current')
             # print(self._cur_0)
             # print(self._initial_oct)
             # print(self._initial_sext)
 
-        variable_outputs = {v: self._variables[v] for v in variable_names}
+        variable_outputs = {v: self.get_fidelity() if v == 'fidelity_shots' else self._variables[v]
+                            for v in variable_names}
 
         return variable_outputs
 
@@ -96,6 +134,10 @@ class Environment(environment.Environment):
         if self.interface is None:
             raise BadgerNoInterfaceError
 
+        if 'fidelity_shots' in variable_inputs:
+            variable_inputs = dict(variable_inputs)
+            self.set_fidelity(variable_inputs.pop('fidelity_shots'))
+
         __x=[]
         vars = []
         for var, x in variable_inputs.items():
@@ -103,66 +145,139 @@ class Environment(environment.Environment):
             __x.append(x)
             vars.append(var)
 
-        _x = np.array(__x)
+        _x = np.array(__x, dtype=np.float64)
 
-        # selected varaibles may be sext or oct. Order will be always sext first and then oct.
-        # prepare mask of sext and oct selected variables
-        mask_sext_vars = [v.find('sext') >= 0 for v in vars]
-        mask_oct_vars = [v.find('octu') >= 0 for v in vars]
+        # sextupoles and octupoles: initial + K^T x, computed in place in the reusable buffers
+        # and checked against the magnet limits in the same pass
+        mask_sext_vars, mask_oct_vars, feasible = self._project_knobs(_x, vars, self._sext_buffer, self._oct_buffer)
 
-        # set sextupoles
-        sext = np.sum(_x[0:sum(mask_sext_vars)] * np.transpose(
-            self._knobs_sext.gen_matrix(list(compress(vars, mask_sext_vars)))), axis=1)
+        # check all magnets before writing any of them
+        if not feasible:
+            raise ValueError(f'knobs {variable_inputs} set magnet strengths out of limits')
 
         if self.verbose:
-            [print(f'sext knob {c}: {k}') for c, k in enumerate(_x[0:sum(mask_sext_vars)])]
+            [print(f'sext knob {c}: {k}') for c, k in enumerate(_x[mask_sext_vars])]
 
         self.interface.set_value(channel_name='srmag/m-s/all/CorrectionStrengths',
-                                 channel_value=self._initial_sext + sext)
+                                 channel_value=self._sext_buffer)
         # set octupoles
-        oct = np.sum(_x[sum(mask_sext_vars):] * np.transpose(
-            self._knobs_oct.gen_matrix(list(compress(vars, mask_oct_vars)))), axis=1)
-
         if self.verbose:
-            [print(f'oct knob {c}: {k}') for c, k in enumerate(_x[sum(mask_sext_vars):])]
+            [print(f'oct knob {c}: {k}') for c, k in enumerate(_x[mask_oct_vars])]
 
         self.interface.set_value(channel_name='srmag/m-o/all/CorrectionStrengths',
-                                 channel_value=self._initial_oct + oct)
+                                 channel_value=self._oct_buffer)
+
+    def _get_knobs(self):
+        """
+        sextupole and octupole Knobs with the magnet strength limits of this environment, created on first use
+        """
+        if self._magnet_knobs is None:
+            self._magnet_knobs = (
+                Knobs(self._path / "data" / "SextKnob.csv", "sext",
+                      *self._magnet_limits(self.sext_limits_file, self.max_abs_sext_strength)),
+                Knobs(self._path / "data" / "OctKnob.csv", "octu",
+                      *self._magnet_limits(self.oct_limits_file, self.max_abs_oct_strength)))
+        return self._magnet_knobs
+
+    def _magnet_limits(self, limits_file: str, max_abs: float):
+        """
+        :return: (low, high) per magnet strength limits read from limits_file, or -max_abs, max_abs.
+                 None, None if not limited
+        """
+        if limits_file:
+            limits = np.genfromtxt(self._path / "data" / limits_file, delimiter=',', ndmin=2)
+            return limits[:, 0], limits[:, 1]
+        if max_abs > 0:
+            return -max_abs, max_abs
+        return None, None
+
+    def _project_knobs(self, x, variable_names, out_sext, out_oct):
+        """
+        sextupole and octupole strengths initial + K^T x, shared by set_variables and check_knobs.
+        Variables may be sext or oct knobs in any order, each amplitude stays with its own knob.
+        :param x: knob amplitudes (len(variable_names),) or (n candidates x len(variable_names))
+        :param variable_names: knob names, in the order of the last axis of x
+        :param out_sext: output array of the sextupole strengths, shape of x @ K_sext
+        :param out_oct: output array of the octupole strengths, shape of x @ K_oct
+        :return: boolean masks of the sext and oct variables,
+                 feasibility: all magnets within limits, bool or (n candidates,) bool array
+        """
+        mask_sext_vars = np.array([v.find('sext') >= 0 for v in variable_names], dtype=bool)
+        mask_oct_vars = np.array([v.find('octu') >= 0 for v in variable_names], dtype=bool)
+
+        knobs_sext, knobs_oct = self._get_knobs()
+        _, feasible_sext = knobs_sext.project(x[..., mask_sext_vars], compress(variable_names, mask_sext_vars),
+                                              initial=self._initial_sext, out=out_sext)
+        _, feasible_oct = knobs_oct.project(x[..., mask_oct_vars], compress(variable_names, mask_oct_vars),
+                                            initial=self._initial_oct, out=out_oct)
+
+        return mask_sext_vars, mask_oct_vars, feasible_sext & feasible_oct
+
+    def check_knobs(self, X, variable_names: list[str]) -> dict:
+        """
+        magnet strengths of a batch of candidate knob vectors, and their feasibility, without writing anything.
+        Lets algorithms screen candidates before evaluating them. Strengths are computed as in set_variables.
+        :param X: (n candidates x len(variable_names)) knob amplitudes, columns in the order of variable_names
+        :param variable_names: knob names
+        :return: dict with 'feasible' (n candidates,) bool array,
+                 'sext' and 'oct' (n candidates x n magnets) strength arrays
+        """
+        if self._initial_sext is None:
+            self.get_variables([])  # store initial strengths
+
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        sext = np.empty((X.shape[0], self._initial_sext.size))
+        oct = np.empty((X.shape[0], self._initial_oct.size))
+        _, _, feasible = self._project_knobs(X, variable_names, sext, oct)
+
+        return {'feasible': feasible, 'sext': sext, 'oct': oct}
 
     def get_observables(self, observable_names: list[str]) -> dict:
+        try:
+            return self._get_observables(observable_names)
+        except BaseException:
+            # do not leave the injector armed after a failed evaluation
+            self.end_session()
+            raise
+
+    def _get_observables(self, observable_names: list[str]) -> dict:
 
         if self.interface is None:
             raise BadgerNoInterfaceError
 
-        def is_not_on(dev):
-            return dev.state() != DevState.ON
-
-        dt = self.waiting_time
+        dt = self.wait_time
         time.sleep(dt)  # wait for magnets set point reached
 
         n_acq = self.number_aquisitions
         dt_acq = self.seconds_between_acquisitions
-        n_shots = self.number_of_shots
+        n_shots = self.get_fidelity()
 
         observable_outputs = {}
+        self._last_statistics = {}
 
         for obs in observable_names:
-            if obs == 'inj_eff_continuous':
-                _ie = []
-                for i in range(n_acq):
-                    # get acquisition i
-                    ie = self.interface.get_value('srdiag/trefflite/sy-sr/InjectionEfficiency')
-                    _ie.append(ie)
-                    # wait before next acquisition
-                    if n_acq > 1:
-                        time.sleep(dt_acq)
-
-                mean_ie = mean(_ie)
-                observable_outputs[obs] = mean_ie
-
-            if obs == 'inj_eff_shooting':
-
-                _ie = []
+            if obs in ('inj_eff_continuous', 'inj_eff_continuous_sem') and \
+                    'inj_eff_continuous' not in self._last_statistics:
+                obs = 'inj_eff_continuous'
+                stats = acquire_adaptive(
+                    lambda: {obs: self.interface.get_value('srdiag/trefflite/sy-sr/InjectionEfficiency')},
+                    [obs],
+                    min_samples=n_acq,
+                    max_samples=self.max_acquisitions,
+                    rel_tol=self.relative_sem_tolerance,
+                    dt=dt_acq)
+                self._last_statistics.update(stats)
+                if self.verbose:
+                    print(f'Inj.Eff. <{stats[obs].n} acquisitions> is: {stats[obs].mean * 100}% '
+                          f'+- {stats[obs].sem * 100}%')
+
+                if obs in observable_names:
+                    observable_outputs[obs] = stats[obs].mean
+                if 'inj_eff_continuous_sem' in observable_names:
+                    observable_outputs['inj_eff_continuous_sem'] = stats[obs].sem
+
+            if obs in ('inj_eff_shooting', 'inj_eff_shooting_sem', 'inj_eff_shooting_samples') and \
+                    'inj_eff_shooting' not in self._last_statistics:
 
                 # check if need to kill in case stop till key
                 cur = self.interface.get_value('srdiag/beam-current/total/Current')
@@ -173,108 +288,104 @@ class Environment(environment.Environment):
                 if cur > 198.0:
                     raise ValueError('current is still above 198mA')
 
-                _ie = []
-
-                # rips on
-                if rips.state() != DevState.RUNNING:
-                    if rips.state() != DevState.MOVING:
-                        time.sleep(1)
-                    # RIPS with one retry
-                    try:
-                        rips.StartRamping()
-                    except Exception as ex:
-                        print('failed to start RIPS ramp, wait 5s and try again.')
-                        time.sleep(5)
-                        rips.StartRamping()
-                    time.sleep(1)  # wait for rips to start
-
-                # gun on
-                if gun.state() == DevState.OFF:
-                    gun.On()
-
-                # trig KE for a given number of time
-                if KE.state() == DevState.STANDBY:
-                    cm = KE.CounterMode
-                    KE.CounterMode = n_shots  # set number of shots
-                    # print(f'{n_shots}')
-
-                    # KE ON, with 1 retry
-                    try:
-                        KE.On()  # shoot
-                    except Exception as ex:
-                        KE.Reset()
-                        time.sleep(0.5)
-                        KE.On()  # try again
-
-                    time.sleep(0.25 * n_shots + 1.0)
-
-                    # KE Standby, with 1 retry
-                    try:
-                        KE.Standby()
-                    except Exception as ex:
-                        KE.Reset()
-                        time.sleep(0.5)
-                        KE.Standby()  # try again
-
-                    KE.CounterMode = cm  # restore initial counter mode state
-                else:
-                    if rips.state() != DevState.MOVING:
-                        time.sleep(1)
-
-                    # RIPS with one retry
-                    try:
-                        rips.StopRamping()
-                    except Exception as ex:
-                        print('failed to stop RIPS ramp, wait 5s and try again.')
-                        time.sleep(5)
-                        rips.StopRamping()  # try again
-
-                    gun.Off()
-                    KE.Standby()
-                    raise ValueError('KE not in standby')
-
-                # wait for shots
-                # wait_for(is_not_on(KE), period=0.25, ini=0, timeout=5)
-
-                # rips stop ramp
-                if rips.state() == DevState.RUNNING:
-                    if rips.state() != DevState.MOVING:
-                        time.sleep(1)
-                    # RIPS with one retry
-                    try:
-                        rips.StopRamping()
-                    except Exception as ex:
-                        print('failed to stop RIPS ramp, wait 5s and try again.')
-                        time.sleep(5)
-                        rips.StopRamping()  # try again
-
-                # gun off
-                if gun.state() == DevState.ON:
-                    gun.Off()
-
-                # get last train of non zero or NaN acquisition from HDB
-                last_treflite = [a.value for a in treflite.attribute_history('InjectionEfficiency', 50)]
-
-                print(f'last Inj. Eff. data: {last_treflite}')
-
-                # get good data
-                good_treff = []
-                for t in last_treflite:
-                    if t is not None:
-                        if t > 0:
-                            good_treff.append(t)
-
-                print(f'good Inj. Eff. data: {good_treff}')
-
-                if len(good_treff) == 0:
-                    mean_ie = 0.0
-                else:
-                    mean_ie = mean(np.array(good_treff))
-
-                print(f'Inj.Eff. <{n_shots} shots> is: {mean_ie * 100}%')
-
-                observable_outputs[obs] = mean_ie
+                # efficiency and number of treflite samples averaged
+                mean_ie, n_samples = self._shoot(n_shots)
+                sem_ie = binomial_sem(mean_ie, n_samples)
+
+                # promising candidate: refine with extra shots
+                if self.extra_shots > 0 and self._best_inj_eff is not None and \
+                        mean_ie + self.promising_sigma * sem_ie >= self._best_inj_eff:
+                    extra_ie, n_extra = self._shoot(self.extra_shots)
+                    if n_samples + n_extra > 0:
+                        mean_ie = (mean_ie * n_samples + extra_ie * n_extra) / (n_samples + n_extra)
+                    n_samples += n_extra
+                    sem_ie = binomial_sem(mean_ie, n_samples)
+                    if self.verbose:
+                        print(f'Inj.Eff. <{n_samples} samples> is: {mean_ie * 100}% +- {sem_ie * 100}%')
+
+                if self._best_inj_eff is None or mean_ie > self._best_inj_eff:
+                    self._best_inj_eff = mean_ie
+
+                self._last_statistics['inj_eff_shooting'] = SampleStats(mean_ie, sem_ie, n_samples)
+                for name, value in (('inj_eff_shooting', mean_ie),
+                                    ('inj_eff_shooting_sem', sem_ie),
+                                    ('inj_eff_shooting_samples', n_samples)):
+                    if name in observable_names:
+                        observable_outputs[name] = value
 
         return observable_outputs
 
-
+    def _get_sequencer(self) -> ShotSequencer:
+        if self._sequencer is None:
+            self._sequencer = ShotSequencer(devices)
+        # settings read at every evaluation, they may be changed between evaluations
+        self._sequencer.poll_period = self.state_poll_period
+        self._sequencer.state_timeout = self.state_timeout
+        self._sequencer.idle_timeout = self.session_idle_timeout
+        self._sequencer.verbose = self.verbose
+        return self._sequencer
+
+    def set_fidelity(self, n_shots: int = None):
+        """
+        number of KE shots of the next inj_eff_shooting evaluations, see fidelity_variable
+        :param n_shots: number of shots, None to go back to number_of_shots
+        """
+        self._fidelity_shots = None if n_shots is None else max(int(round(n_shots)), 1)
+
+    def get_fidelity(self) -> int:
+        """
+        number of KE shots of the next inj_eff_shooting evaluation
+        """
+        return self.number_of_shots if self._fidelity_shots is None else self._fidelity_shots
+
+    def _shoot(self, n_shots: int) -> tuple:
+        """
+        shoot n_shots and average the positive injection efficiencies of the burst
+        :return: mean injection efficiency (0 without good data), number of samples averaged
+        """
+        # entries of the polling history up to now are not part of this burst
+        self._get_history().mark()
+
+        # RIPS ramp, gun on, KE shots, standby, ramp stop, gun off
+        self._get_sequencer().run(n_shots, session=self.shooting_session)
+
+        # get the train of non zero or NaN acquisitions of this burst from the polling history
+        last_treflite = [value for t, value in self._get_history().read_new(wait=self.history_latency)]
+
+        print(f'last Inj. Eff. data: {last_treflite}')
+
+        # get good data
+        good_treff = []
+        for t in last_treflite:
+            if t is not None:
+                if t > 0:
+                    good_treff.append(t)
+
+        print(f'good Inj. Eff. data: {good_treff}')
+
+        if len(good_treff) == 0:
+            mean_ie = 0.0
+        else:
+            mean_ie = mean(np.array(good_treff))
+
+        print(f'Inj.Eff. <{n_shots} shots> is: {mean_ie * 100}%')
+
+        return mean_ie, len(good_treff)
+
+    def _get_history(self) -> HistoryReader:
+        if self._history is None:
+            self._history = HistoryReader(devices['treflite'], 'InjectionEfficiency')
+        return self._history
+
+    def end_session(self):
+        """
+        stop the RIPS ramp and the gun armed by a shooting session
+        """
+        if self._sequencer is not None:
+            self._sequencer.disarm()
+
+    def get_last_statistics(self) -> dict:
+        """
+        {observable name: SampleStats(mean, sem, n)} of the sampled observables of the last get_observables
+        """
+        return dict(self._last_statistics)
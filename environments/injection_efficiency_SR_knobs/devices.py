@@ -0,0 +1,49 @@
+import threading
+
+# tango devices of the injection, by short name
+DEVICE_NAMES = {
+    'rips': 'sy/ps-rips/manager',
+    'gun': 'elin/beam/run',
+    'KE': 'sy/ps-ke/1',
+    'treflite': 'srdiag/trefflite/sy-sr',
+    'cur': 'srdiag/beam-current/total',
+}
+
+
+class DeviceRegistry:
+    """
+    tango.DeviceProxy of the injection devices, created on first use and then reused,
+    so that importing the environment does not connect to the control system
+    """
+
+    def __init__(self, names=None):
+        self._names = dict(DEVICE_NAMES if names is None else names)
+        self._proxies = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: short name in DEVICE_NAMES (ex: 'KE') or full tango device name
+        :return: tango.DeviceProxy
+        """
+        name = self._names.get(key, key)
+        with self._lock:
+            proxy = self._proxies.get(name)
+            if proxy is None:
+                import tango
+                proxy = self._proxies[name] = tango.DeviceProxy(name)
+            return proxy
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def clear(self):
+        """
+        forget all proxies, they are created again on next use (ex: after a device server restart)
+        """
+        with self._lock:
+            self._proxies.clear()
+
+
+# registry shared by the environment and get_injeff
+devices = DeviceRegistry()
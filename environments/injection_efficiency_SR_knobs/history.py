@@ -0,0 +1,73 @@
+import time
+
+
+class HistoryReader:
+    """
+    incremental reader of the polling history of a tango attribute (treflite InjectionEfficiency).
+    Only entries newer than the last consumed one are returned, and the history depth requested
+    to the device follows the number of new entries instead of a fixed 50.
+    """
+
+    def __init__(self, device, attribute='InjectionEfficiency', depth=10, max_depth=200):
+        """
+        :param device: tango.DeviceProxy
+        :param attribute: polled attribute name
+        :param depth: initial number of history entries requested
+        :param max_depth: largest number of history entries requested
+        """
+        self._device = device
+        self._attribute = attribute
+        self._depth = depth
+        self.min_depth = depth
+        self.max_depth = max_depth
+        self._last_t = 0.0
+
+    def _fetch(self, depth):
+        """
+        :return: list of (epoch time, value), oldest first
+        """
+        history = self._device.attribute_history(self._attribute, depth)
+        entries = [(a.time.totime(), a.value) for a in history]
+        return sorted(entries, key=lambda entry: entry[0])
+
+    def newer(self, t_min):
+        """
+        history entries with a timestamp after t_min, the depth is doubled until the oldest entry
+        fetched is not newer than t_min (or max_depth)
+        """
+        depth = self._depth
+        entries = self._fetch(depth)
+        while len(entries) >= depth and entries[0][0] > t_min and depth < self.max_depth:
+            depth = min(2 * depth, self.max_depth)
+            entries = self._fetch(depth)
+        new = [entry for entry in entries if entry[0] > t_min]
+        # next time, ask for as many entries as were new this time, plus margin
+        self._depth = min(max(self.min_depth, 2 * len(new) + 2), self.max_depth)
+        return new
+
+    def mark(self):
+        """
+        consume the entries already in the history, read_new then returns only the entries polled after this call.
+        Only device timestamps are compared, the host clock may differ from the device one.
+        """
+        entries = self._fetch(1)
+        if entries:
+            self._last_t = max(self._last_t, entries[-1][0])
+
+    def read_new(self, wait=0.0):
+        """
+        entries not consumed yet (polled since the last mark or read), after waiting wait s
+        for the last ones to reach the history. The returned entries are consumed.
+        :return: list of (epoch time, value), oldest first
+        """
+        time.sleep(wait)
+        entries = self.newer(self._last_t)
+        if entries:
+            self._last_t = entries[-1][0]
+        return entries
+
+    def last_consumed(self):
+        """
+        timestamp of the last consumed entry
+        """
+        return self._last_t
@@ -0,0 +1,141 @@
+from badger import interface
+import glob
+import os
+import time
+from collections import namedtuple
+from typing import Any, Dict, List
+import numpy as np
+
+# value of a channel with its source timestamp (epoch s) and quality, as returned by tango Interface.snapshot
+Sample = namedtuple('Sample', ['value', 'timestamp', 'quality'])
+
+# one recorded value, see interfaces/tango/recorder.py for the file layout
+Entry = namedtuple('Entry', ['op', 'channel', 'value', 't', 'latency'])
+
+OPS = {0: 'read', 1: 'write'}
+KIND_SCALAR, KIND_ARRAY, KIND_TEXT, KIND_NONE = 0, 1, 2, 3
+
+
+def load_recording(directory):
+    """
+    read all npz chunks recorded by the tango interface (record_dir)
+    :param directory: recording directory
+    :return: list of Entry in recording order
+    """
+    entries = []
+    for filename in sorted(glob.glob(os.path.join(directory, 'chunk-*.npz'))):
+        with np.load(filename) as chunk:
+            values = chunk['values']
+            for op, channel, t, latency, kind, offset, size, text in zip(
+                    chunk['op'], chunk['channel'], chunk['t'], chunk['latency'],
+                    chunk['kind'], chunk['offset'], chunk['size'], chunk['text']):
+                if kind == KIND_SCALAR:
+                    value = float(values[offset])
+                elif kind == KIND_ARRAY:
+                    value = values[offset:offset + size].copy()
+                elif kind == KIND_TEXT:
+                    value = str(text)
+                else:
+                    value = None
+                entries.append(Entry(OPS[int(op)], str(channel), value, float(t), float(latency)))
+    return entries
+
+
+class Interface(interface.Interface):
+
+    name = 'replay'
+
+    # directory recorded by the tango interface (record_dir)
+    recording: str = ''
+    # sleep the recorded latency of each call, to replay the timing of the shift
+    replay_latency: bool = False
+    # compare written values with the recorded ones and count mismatches
+    check_writes: bool = True
+    # relative tolerance of the write comparison
+    write_tolerance: float = 1e-9
+
+    def __init__(self):
+        super().__init__()
+        self._reads = {}
+        self._writes = {}
+        self._read_pos = {}
+        self._write_pos = {}
+        self._stats = {'reads': 0, 'writes': 0, 'mismatches': 0, 'exhausted': set()}
+        if self.recording:
+            self.load(self.recording)
+
+    @staticmethod
+    def get_default_params():
+        return None
+
+    def load(self, directory: str):
+        """
+        load a recording and restart the replay from its beginning
+        """
+        self._reads = {}
+        self._writes = {}
+        for entry in load_recording(directory):
+            queues = self._reads if entry.op == 'read' else self._writes
+            queues.setdefault(entry.channel, []).append(entry)
+        self._read_pos = {channel: 0 for channel in self._reads}
+        self._write_pos = {channel: 0 for channel in self._writes}
+        self._stats = {'reads': 0, 'writes': 0, 'mismatches': 0, 'exhausted': set()}
+        print(f'replay {directory}: {sum(map(len, self._reads.values()))} reads, '
+              f'{sum(map(len, self._writes.values()))} writes')
+
+    def _next(self, queues, positions, channel):
+        """
+        next recorded entry of channel, the last one is repeated once the recording is exhausted
+        """
+        if channel not in queues:
+            raise KeyError(f'{channel} not in recording')
+        entries = queues[channel]
+        pos = positions[channel]
+        if pos >= len(entries):
+            self._stats['exhausted'].add(channel)
+            return entries[-1]
+        positions[channel] = pos + 1
+        return entries[pos]
+
+    def snapshot(self, channel_names: List[str], max_skew: float = None, max_attempts: int = 3) -> Dict[str, Sample]:
+        """
+        recorded values of channel_names, in recording order for each channel
+        """
+        entries = {name: self._next(self._reads, self._read_pos, name) for name in channel_names}
+        self._stats['reads'] += len(entries)
+        if self.replay_latency and entries:
+            time.sleep(max(e.latency for e in entries.values()))
+        return {name: Sample(e.value, e.t, 'ATTR_VALID') for name, e in entries.items()}
+
+    def get_values(self, channel_names: List[str]) -> Dict[str, Any]:
+        return {name: sample.value for name, sample in self.snapshot(channel_names).items()}
+
+    def set_values(self, channel_inputs: Dict[str, Any]):
+        latency = 0.0
+        for name, value in channel_inputs.items():
+            self._stats['writes'] += 1
+            if name not in self._writes:
+                print(f'{name} was not written in the recording')
+                self._stats['mismatches'] += 1
+                continue
+            entry = self._next(self._writes, self._write_pos, name)
+            latency = max(latency, entry.latency)
+            if self.check_writes and not self._same(value, entry.value):
+                print(f'{name}: written {value}, recorded {entry.value}')
+                self._stats['mismatches'] += 1
+
+        if self.replay_latency:
+            time.sleep(latency)
+
+    def _same(self, value, recorded):
+        try:
+            return bool(np.allclose(np.asarray(value, dtype=np.float64), recorded,
+                                    rtol=self.write_tolerance, atol=0.0))
+        except (TypeError, ValueError):
+            return str(value) == str(recorded)
+
+    def get_replay_stats(self) -> Dict[str, Any]:
+        """
+        reads served, writes received, write mismatches and channels whose recording is exhausted
+        """
+        return {**self._stats, 'exhausted': sorted(self._stats['exhausted'])}
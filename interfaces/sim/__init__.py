@@ -0,0 +1,221 @@
+from badger import interface
+import random
+import threading
+import time
+from collections import namedtuple
+from typing import Any, Dict, List
+import numpy as np
+
+# value of a channel with its source timestamp (epoch s) and quality, as returned by tango Interface.snapshot
+Sample = namedtuple('Sample', ['value', 'timestamp', 'quality'])
+
+# initial values of the channels used by the ESRF environments, other channels start at 0.0
+DEFAULT_VALUES = {
+    'srdiag/beam-current/total/Current': 200.0,  # mA
+    'srdiag/blm/all/TotalLoss': 1.0,
+    'srdiag/bpm/lifetime/Lifetime': 20.0 * 3600,  # s
+    'srdiag/emittance/id25/Emittance_h': 130e-12,
+    'srdiag/emittance/id25/Emittance_v': 10e-12,
+    'srdiag/trefflite/sy-sr/InjectionEfficiency': 0.8,
+    'srmag/m-s/all/CorrectionStrengths': np.zeros(192),
+    'srmag/m-o/all/CorrectionStrengths': np.zeros(64),
+}
+
+
+# channels returning their set point, as in the tango interface. Other channels return their (ramping) read value
+SET_POINT_PATTERNS = ('srmag', 'tl2', 'sr/ps', 'sy/ps', 'infra')
+
+
+class SnapshotSkewError(ValueError):
+    """
+    raised when the samples of a snapshot were not taken close enough in time (as tango SnapshotSkewError)
+    """
+    pass
+
+
+class SimulatedFailure(RuntimeError):
+    """
+    failure injected by the sim interface (stands for tango.DevFailed)
+    """
+    pass
+
+
+class SimAttribute:
+    """
+    attribute of the in-memory store. The read value ramps linearly from its value at the last write
+    to the set point at ramp_rate units/s (instantaneous if ramp_rate is 0).
+    """
+
+    def __init__(self, value):
+        self.set_point = self._copy(value)
+        self._start = self._copy(value)
+        self._t_set = time.time()
+
+    @staticmethod
+    def _copy(value):
+        return np.array(value, dtype=np.float64) if isinstance(value, (np.ndarray, list, tuple)) else value
+
+    def write(self, value, ramp_rate=0.0):
+        self._start = self.read(ramp_rate)
+        self.set_point = self._copy(value)
+        self._t_set = time.time()
+
+    def is_moving(self, ramp_rate=0.0):
+        return not np.array_equal(self.read(ramp_rate), self.set_point)
+
+    def read(self, ramp_rate=0.0):
+        if ramp_rate <= 0 or isinstance(self.set_point, str):
+            return self._copy(self.set_point)
+        step = ramp_rate * (time.time() - self._t_set)
+        delta = np.asarray(self.set_point) - np.asarray(self._start)
+        value = np.asarray(self._start) + np.clip(delta, -step, step)
+        return value if isinstance(self.set_point, np.ndarray) else float(value)
+
+
+class Interface(interface.Interface):
+
+    name = 'sim'
+
+    # latency in s of one read (one per device, as the tango interface groups reads by device)
+    # and of one write (writes of one set_values are concurrent: the slowest device sets the duration)
+    read_latency: float = 0.001
+    write_latency: float = 0.005
+    # uniform random jitter added to every latency, s
+    latency_jitter: float = 0.0005
+    # {device name: [read latency, write latency]} overriding the above for slow devices
+    device_latency: Dict[str, List[float]] = {}
+    # probability that a device call fails, and devices that always fail
+    failure_rate: float = 0.0
+    failing_devices: List[str] = []
+    # speed at which read values follow set points, units/s. 0: instantaneous
+    ramp_rate: float = 0.0
+    # relative gaussian noise on read values (diagnostics)
+    read_noise: float = 0.0
+    # {channel name: initial value}, completes DEFAULT_VALUES
+    initial_values: Dict[str, Any] = {}
+    seed: int = 0
+
+    def __init__(self):
+        super().__init__()
+        self._store = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(self.seed)
+        self._np_rng = np.random.default_rng(self.seed)
+        self._calls = {'read': 0, 'write': 0, 'failures': 0}
+
+    @staticmethod
+    def get_default_params():
+        return None
+
+    @staticmethod
+    def _device(channel_name):
+        return channel_name.rsplit('/', 1)[0]
+
+    def _attribute(self, channel_name):
+        with self._lock:
+            attr = self._store.get(channel_name)
+            if attr is None:
+                value = self.initial_values.get(channel_name, DEFAULT_VALUES.get(channel_name, 0.0))
+                attr = self._store[channel_name] = SimAttribute(value)
+            return attr
+
+    def _latency(self, device, op):
+        latency = self.device_latency.get(device, [self.read_latency, self.write_latency])[op == 'write']
+        # the generators are shared by all the threads reading or writing
+        with self._lock:
+            return latency + self._rng.uniform(0, self.latency_jitter)
+
+    def _call(self, device, op):
+        """
+        count a device call and inject failures
+        """
+        with self._lock:
+            self._calls[op] += 1
+            failed = device in self.failing_devices or self._rng.random() < self.failure_rate
+            if failed:
+                self._calls['failures'] += 1
+        if failed:
+            raise SimulatedFailure(f'simulated failure of {device} ({op})')
+
+    def _read(self, channel_name):
+        """
+        :return: Sample without timestamp. Set points of moving attributes have quality ATTR_CHANGING.
+        """
+        attr = self._attribute(channel_name)
+        quality = 'ATTR_CHANGING' if attr.is_moving(self.ramp_rate) else 'ATTR_VALID'
+        if any(pattern in channel_name for pattern in SET_POINT_PATTERNS):
+            return Sample(attr.read(), None, quality)
+
+        value = attr.read(self.ramp_rate)
+        if self.read_noise > 0 and not isinstance(value, str):
+            with self._lock:
+                noise = self._np_rng.standard_normal(np.shape(value))
+            value = value * (1 + self.read_noise * noise)
+            value = value if isinstance(value, np.ndarray) else float(value)
+        return Sample(value, None, quality)
+
+    def get_values(self, channel_names: List[str]) -> Dict[str, Any]:
+        return {name: sample.value for name, sample in self.snapshot(channel_names).items()}
+
+    def snapshot(self, channel_names: List[str], max_skew: float = None, max_attempts: int = 3) -> Dict[str, Sample]:
+        """
+        same contract as the tango Interface.snapshot. Devices are read one after the other,
+        so the timestamps of a snapshot differ by the read latencies.
+        :param channel_names: attribute names
+        :param max_skew: if not None, maximum difference in s between the timestamps.
+                         Snapshots exceeding it are read again, up to max_attempts times.
+        :param max_attempts: number of reads before raising SnapshotSkewError
+        :return: dict {channel name: Sample(value, timestamp, quality)}
+        """
+        devices = {}
+        for name in channel_names:
+            devices.setdefault(self._device(name), []).append(name)
+
+        for attempt in range(max_attempts):
+            samples = {}
+            for device, names in devices.items():
+                time.sleep(self._latency(device, 'read'))
+                self._call(device, 'read')
+                t = time.time()
+                for name in names:
+                    samples[name] = self._read(name)._replace(timestamp=t)
+
+            timestamps = [sample.timestamp for sample in samples.values()]
+            skew = max(timestamps) - min(timestamps) if timestamps else 0.0
+            if max_skew is None or skew <= max_skew:
+                return {name: samples[name] for name in channel_names}
+            print(f'snapshot timestamps differ by {skew:.3f} s > {max_skew} s, read again')
+
+        raise SnapshotSkewError(f'timestamps of {channel_names} differ by {skew:.3f} s > {max_skew} s '
+                                f'after {max_attempts} attempts')
+
+    def set_values(self, channel_inputs: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        devices = {self._device(name) for name in channel_inputs}
+        latencies = {device: self._latency(device, 'write') for device in devices}
+        # concurrent writes: the evaluation lasts as long as the slowest device
+        time.sleep(max(latencies.values(), default=0.0))
+
+        report = {}
+        failed = []
+        for name, value in channel_inputs.items():
+            device = self._device(name)
+            try:
+                self._call(device, 'write')
+            except SimulatedFailure as err:
+                failed.append(name)
+                report[name] = {'success': False, 'skipped': False, 'latency': latencies[device], 'error': err}
+                continue
+            self._attribute(name).write(value, self.ramp_rate)
+            report[name] = {'success': True, 'skipped': False, 'latency': latencies[device], 'error': None}
+
+        if failed:
+            raise report[failed[0]]['error']
+
+        return report
+
+    def get_calls(self) -> Dict[str, int]:
+        """
+        number of device reads, writes and injected failures so far
+        """
+        with self._lock:
+            return dict(self._calls)
@@ -2,7 +2,16 @@ import tango
 from badger import interface
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List
+from .pool import ProxyPool, group_by_device, split_attribute_name
+from .events import EventCache
+from .channels import ChannelResolver
+from .deadband import Deadband
+from .retry import CircuitBreaker, CircuitOpenError, Retrier, RetryPolicy
+from .telemetry import Telemetry, estimate_bytes
+from .snapshot import Sample, SnapshotSkewError, timestamp_skew
+from .recorder import Recorder
 
 class Interface(interface.Interface):
 
@@ -14,52 +23,314 @@ class Interface(interface.Interface):
     _tango_host = 'tango://ebs-simu-1.esrf.fr:10000/'
     os.environ['TANGO_HOST'] = 'ebs-simu-1:10000'
 
+    # maximum number of attributes written in parallel by set_values
+    max_write_workers: int = 16
+    # maximum number of devices read in parallel by snapshot
+    max_read_workers: int = 8
+    # attributes served from CHANGE or PERIODIC events instead of polling
+    # (ex: srdiag/beam-current/total/Current, srdiag/blm/all/TotalLoss, srdiag/bpm/lifetime/Lifetime)
+    event_channels: List[str] = []
+    event_type: str = 'CHANGE'
+    # number of samples kept in memory for each event channel
+    event_buffer_size: int = 1000
+    # event samples older than max_event_age s are not served, the channel is polled instead (0: no limit)
+    max_event_age: float = 0.0
+    # writes closer than the tolerance to the last confirmed set point are skipped
+    # {channel name: tolerance}, channels not listed use default_deadband (0: always written)
+    deadbands: Dict[str, float] = {}
+    default_deadband: float = 0.0
+    # failed tango calls are retried up to retry_max_attempts times, waiting retry_initial_delay * 2**n s
+    # (jittered, at most retry_max_delay) between attempts
+    retry_max_attempts: int = 3
+    retry_initial_delay: float = 0.005
+    retry_max_delay: float = 0.5
+    # after breaker_threshold consecutive failures, calls to a device fail immediately for breaker_reset_time s
+    breaker_threshold: int = 3
+    breaker_reset_time: float = 30.0
+    # if set, per channel statistics are written every telemetry_period s to this file ('json' or 'prometheus')
+    telemetry_file: str = ''
+    telemetry_format: str = 'json'
+    telemetry_period: float = 10.0
+    # if set, every get_values / set_values is recorded to this directory (npz chunks of record_chunk_size
+    # entries), to be served offline by the replay interface
+    record_dir: str = ''
+    record_chunk_size: int = 10000
+
     def __init__(self):
         super().__init__()
+        self._pool = ProxyPool(self._tango_host)
+        # separate pools: a snapshot does not queue behind a burst of writes
+        self._executor = ThreadPoolExecutor(max_workers=self.max_write_workers,
+                                            thread_name_prefix='tango-write')
+        self._read_executor = ThreadPoolExecutor(max_workers=self.max_read_workers,
+                                                 thread_name_prefix='tango-read')
+        self._last_write_report = {}
+        self._retrier = Retrier(RetryPolicy(max_attempts=self.retry_max_attempts,
+                                            initial_delay=self.retry_initial_delay,
+                                            max_delay=self.retry_max_delay),
+                                CircuitBreaker(threshold=self.breaker_threshold,
+                                               reset_time=self.breaker_reset_time),
+                                errors=tango.DevFailed)
+        self._channels = ChannelResolver(self._pool, self._retrier)
+        self._events = EventCache(self._pool, self._channels.extract,
+                                  buffer_size=self.event_buffer_size,
+                                  event_type=self.event_type)
+        self._events_started = False
+        self._deadband = Deadband(self.deadbands, self.default_deadband)
+        self._telemetry = Telemetry()
+        if self.telemetry_file:
+            self._telemetry.start_flush(self.telemetry_file, self.telemetry_period, self.telemetry_format)
+        self._recorder = Recorder(self.record_dir, self.record_chunk_size) if self.record_dir else None
 
     @staticmethod
     def get_default_params():
         return None
 
+    def _read_device(self, device, attributenames):
+        """
+        read all attributenames of device in a single read_attributes round trip
+        :return: list of tango.DeviceAttribute in the order of attributenames
+        """
+        attributes = [split_attribute_name(name)[1] for name in attributenames]
+        readings = self._retrier.call(device,
+                                      lambda: self._pool.device(device).read_attributes(attributes),
+                                      on_error=lambda err: self._pool.handle_error(device, err))
+
+        # attributes failing inside a group are read alone to raise their own DevFailed
+        return [self._read_attribute(name) if reading.has_failed else reading
+                for name, reading in zip(attributenames, readings)]
+
+    def _read_attribute(self, attributename):
+        return self._retrier.call(split_attribute_name(attributename)[0],
+                                  lambda: self._pool.attribute(attributename).read(),
+                                  on_error=lambda err: self._pool.handle_error(attributename, err))
+
+    def _read_group(self, device, attributenames):
+        """
+        read attributenames of device in one round trip, with telemetry
+        :return: list of (value, tango.DeviceAttribute) in the order of attributenames
+        """
+        t0 = time.perf_counter()
+        try:
+            # read value or set point, scalar or numpy spectrum: decided once per channel
+            self._channels.resolve(device, attributenames)
+            readings = self._read_device(device, attributenames)
+        except (tango.DevFailed, CircuitOpenError):
+            for attributename in attributenames:
+                self._telemetry.record('read', attributename, time.perf_counter() - t0,
+                                       retries=self._retrier.last_retries(), failed=True)
+            raise
+        latency = time.perf_counter() - t0
+        retries = self._retrier.last_retries()
+
+        values = []
+        for attributename, reading in zip(attributenames, readings):
+            val = self._channels.extract(attributename, reading)
+            if self._channels.strategy(attributename).field == 'w_value':
+                self._deadband.confirm(attributename, val)
+            # all attributes of the group share the round trip
+            self._telemetry.record('read', attributename, latency, estimate_bytes(val), retries)
+            values.append((val, reading))
+        return values
+
+    def snapshot(self, channel_names: List[str], max_skew: float = None, max_attempts: int = 3) -> Dict[str, Sample]:
+        """
+        read channel_names together (one read_attributes per device, devices read in parallel)
+        and return values with their source timestamp and quality.
+        :param channel_names: attribute names
+        :param max_skew: if not None, maximum difference in s between the source timestamps.
+                         Snapshots exceeding it are read again, up to max_attempts times.
+        :param max_attempts: number of reads before raising SnapshotSkewError
+        :return: dict {channel name: Sample(value, timestamp, quality)}
+        """
+        groups = group_by_device(channel_names)
+        t_call, t0 = time.time(), time.perf_counter()
+
+        for attempt in range(max_attempts):
+            if len(groups) <= 1:
+                results = {device: self._read_group(device, names) for device, names in groups.items()}
+            else:
+                futures = {device: self._read_executor.submit(self._read_group, device, names)
+                           for device, names in groups.items()}
+                results = {device: future.result() for device, future in futures.items()}
+
+            samples = {}
+            for device, names in groups.items():
+                for name, (val, reading) in zip(names, results[device]):
+                    samples[name] = Sample(val, reading.time.totime(), str(reading.quality))
+
+            skew = timestamp_skew(samples)
+            if max_skew is None or skew <= max_skew:
+                if self._recorder is not None:
+                    latency = time.perf_counter() - t0
+                    for name in channel_names:
+                        self._recorder.record('read', name, samples[name].value, t_call, latency)
+                return {name: samples[name] for name in channel_names}
+            print(f'snapshot timestamps differ by {skew:.3f} s > {max_skew} s, read again')
+
+        raise SnapshotSkewError(f'timestamps of {channel_names} differ by {skew:.3f} s > {max_skew} s '
+                                f'after {max_attempts} attempts')
+
+    def subscribe(self, channel_names: List[str]):
+        """
+        serve channel_names from tango events. Each channel keeps a timestamped ring buffer of its samples.
+        """
+        for name in channel_names:
+            self._events.subscribe(name)
+
+    def get_samples_since(self, channel_name: str, timestamp: float) -> List[Any]:
+        """
+        samples of an event channel received after timestamp
+        :param channel_name: attribute name, must be subscribed (see event_channels or subscribe)
+        :param timestamp: epoch time in s (ex: time.time() at the end of set_values)
+        :return: list of (timestamp, value)
+        """
+        if not self._events.is_subscribed(channel_name):
+            raise ValueError(f'{channel_name} is not subscribed to events')
+        return self._events.since(channel_name, timestamp)
+
     def get_values(self, channel_names: List[str]) -> Dict[str, Any]:
 
+        t_call, t0 = time.time(), time.perf_counter()
+
+        if not self._events_started:
+            self.subscribe(self.event_channels)
+            self._events_started = True
+
         channel_outputs = {}
 
+        # answer subscribed channels from memory
+        polled = []
         for attributename in channel_names:
-            try:
-                attrprox = tango.AttributeProxy(self._tango_host + attributename)
-            except tango.DevFailed as err:
-                print('DevFailed, try once more')
-                time.sleep(2)
-                attrprox = tango.AttributeProxy(self._tango_host + attributename)
-            # print(attrprox)
-            val = None
-            if 'srdiag' in attributename:
-                val = attrprox.read().value
-            if 'srmag' in attributename:
-                val = attrprox.read().w_value  # read set point
-            if 'tl2' in attributename:
-                val = attrprox.read().w_value
-            if 'sr/ps' in attributename:
-                val = attrprox.read().w_value
-            if 'sy/ps' in attributename:
-                val = attrprox.read().w_value
-            if 'infra' in attributename:
-                val = attrprox.read().w_value
-            # print(val)
-            channel_outputs[attributename] = val
+            sample = self._events.latest(attributename)
+            if sample is None or (self.max_event_age > 0 and t_call - sample[0] > self.max_event_age):
+                polled.append(attributename)
+            else:
+                channel_outputs[attributename] = sample[1]
+
+        # one round trip per device instead of one per attribute
+        for device, attributenames in group_by_device(polled).items():
+            for attributename, (val, _) in zip(attributenames, self._read_group(device, attributenames)):
+                channel_outputs[attributename] = val
+
+        channel_outputs = {attributename: channel_outputs[attributename] for attributename in channel_names}
+
+        if self._recorder is not None:
+            latency = time.perf_counter() - t0
+            for attributename, val in channel_outputs.items():
+                self._recorder.record('read', attributename, val, t_call, latency)
 
         return channel_outputs
 
-    def set_values(self, channel_inputs: Dict[str, Any]):
+    def _write(self, attributename, value) -> Dict[str, Any]:
+        """
+        write value to attributename with the retry policy
+        :return: dict with success, latency [s] and error (tango.DevFailed, CircuitOpenError, any other
+                 exception raised while preparing or writing the value, or None)
+        """
+        t0 = time.perf_counter()
+        try:
+            value = self._channels.prepare_write(attributename, value)
+            self._retrier.call(split_attribute_name(attributename)[0],
+                               lambda: self._pool.attribute(attributename).write(value),
+                               on_error=lambda err: self._pool.handle_error(attributename, err))
+        except Exception as err:  # reported for this attribute, the other writes of the barrier go on
+            latency = time.perf_counter() - t0
+            self._deadband.forget(attributename)
+            self._telemetry.record('write', attributename, latency, estimate_bytes(value),
+                                   self._retrier.last_retries(), failed=True)
+            return {'success': False, 'skipped': False, 'latency': latency, 'error': err}
+
+        latency = time.perf_counter() - t0
+        self._deadband.confirm(attributename, value)
+        self._telemetry.record('write', attributename, latency, estimate_bytes(value), self._retrier.last_retries())
+        return {'success': True, 'skipped': False, 'latency': latency, 'error': None}
+
+    def set_values(self, channel_inputs: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """
+        write all channel_inputs in parallel and wait for all of them to complete.
+        Values within the deadband (if configured) of the last confirmed set point are not written.
+        The per attribute report (success, skipped, latency, error) is returned and kept for get_last_write_report.
+        The first failure is raised once all writes are completed.
+        """
+
+        t_call = time.time()
+        report = {}
+        to_write = {}
+        for name, value in channel_inputs.items():
+            skipped = self._deadband.is_noop(name, value)
+            self._deadband.count(name, skipped)
+            if skipped:
+                report[name] = {'success': True, 'skipped': True, 'latency': 0.0, 'error': None}
+            else:
+                to_write[name] = value
+
+        if len(to_write) <= 1:
+            report.update({name: self._write(name, value) for name, value in to_write.items()})
+        else:
+            futures = {name: self._executor.submit(self._write, name, value)
+                       for name, value in to_write.items()}
+            # completion barrier: the evaluation lasts as long as the slowest write
+            report.update({name: future.result() for name, future in futures.items()})
+
+        self._last_write_report = report
+
+        if self._recorder is not None:
+            for name, value in channel_inputs.items():
+                self._recorder.record('write', name, value, t_call, report[name]['latency'])
+
+        failed = [name for name, res in report.items() if not res['success']]
+        if failed:
+            print(f'failed to write {failed}')
+            raise report[failed[0]]['error']
+
+        return report
+
+    def close(self):
+        """
+        unsubscribe events, stop the read, write and telemetry threads, write the pending recording
+        """
+        if self._recorder is not None:
+            self._recorder.close()
+        self._telemetry.stop_flush()
+        self._events.unsubscribe_all()
+        self._executor.shutdown(wait=True)
+        self._read_executor.shutdown(wait=True)
+
+    def get_last_write_report(self) -> Dict[str, Dict[str, Any]]:
+        """
+        per attribute success, skipped, latency and error of the last set_values
+        """
+        return self._last_write_report
+
+    def get_deadband_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        number of written and skipped (deadband) set_values per channel
+        """
+        return self._deadband.stats()
+
+    def get_retry_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        retries, failures and circuit breaker state (consecutive failures, trips, open) per device
+        """
+        return self._retrier.stats()
+
+    def get_telemetry(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        per channel read and write statistics: count, bytes, retries, failures, latency p50/p95/p99 [s]
+        :return: {'read': {channel: stats}, 'write': {channel: stats}}
+        """
+        return self._telemetry.summary()
+
+    def write_telemetry(self, filename: str, fmt: str = 'json'):
+        """
+        write the telemetry to filename as 'json' or 'prometheus' text
+        """
+        self._telemetry.write(filename, fmt)
 
-        for attributename, value in channel_inputs.items():
+    def get_pool_stats(self) -> Dict[str, int]:
+        """
+        size, hits, misses and evictions of the proxy pool
+        """
+        return self._pool.stats()
 
-            try:
-                dev = tango.AttributeProxy(self._tango_host + attributename)
-                dev.write(value)
-            except tango.DevFailed as err:
-                print('DevFailed, try once more')
-                time.sleep(2)
-                dev = tango.AttributeProxy(self._tango_host + attributename)
-                dev.write(value)
@@ -0,0 +1,132 @@
+import threading
+from collections import namedtuple
+import numpy as np
+import tango
+from .pool import split_attribute_name
+
+# how to get the value of a channel out of a tango.DeviceAttribute
+#   field: 'value' (read value) or 'w_value' (set point)
+#   dtype: numpy dtype for spectrum attributes, None for scalars
+#   dim: maximum spectrum length, 0 for scalars
+ReadStrategy = namedtuple('ReadStrategy', ['field', 'dtype', 'dim'])
+
+# channels read as set point (w_value) or read value, decided on the attribute name
+FIELD_RULES = (('srdiag', 'value'),
+               ('srmag', 'w_value'),  # read set point
+               ('tl2', 'w_value'),
+               ('sr/ps', 'w_value'),
+               ('sy/ps', 'w_value'),
+               ('infra', 'w_value'))
+
+NUMPY_TYPES = {tango.CmdArgType.DevDouble: np.float64,
+               tango.CmdArgType.DevFloat: np.float32,
+               tango.CmdArgType.DevLong64: np.int64,
+               tango.CmdArgType.DevULong64: np.uint64,
+               tango.CmdArgType.DevLong: np.int32,
+               tango.CmdArgType.DevULong: np.uint32,
+               tango.CmdArgType.DevShort: np.int16,
+               tango.CmdArgType.DevUShort: np.uint16,
+               tango.CmdArgType.DevUChar: np.uint8,
+               tango.CmdArgType.DevBoolean: np.bool_}
+
+
+def make_strategy(name, config):
+    """
+    decide once how channel name has to be read
+    :param name: attribute name
+    :param config: tango.AttributeInfoEx of the attribute
+    :return: ReadStrategy
+    """
+    field = None
+    for pattern, rule_field in FIELD_RULES:
+        if pattern in name:
+            field = rule_field
+
+    # channels matching no rule: set point if the attribute is writable, read value otherwise
+    if field is None:
+        field = 'value' if config.writable == tango.AttrWriteType.READ else 'w_value'
+
+    if config.data_format == tango.AttrDataFormat.SPECTRUM and config.data_type in NUMPY_TYPES:
+        return ReadStrategy(field, NUMPY_TYPES[config.data_type], config.max_dim_x)
+
+    return ReadStrategy(field, None, 0)
+
+
+class ChannelResolver:
+    """
+    table of ReadStrategy per channel. The attribute configuration is fetched on first use only,
+    with the retry policy and circuit breaker of the reads and writes.
+    """
+
+    def __init__(self, pool, retrier):
+        """
+        :param pool: ProxyPool
+        :param retrier: Retrier of the interface
+        """
+        self._pool = pool
+        self._retrier = retrier
+        self._strategies = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, device, names):
+        """
+        resolve all unknown channels of device with a single get_attribute_config round trip
+        :param device: device name
+        :param names: attribute names of device
+        """
+        with self._lock:
+            unknown = [name for name in names if name not in self._strategies]
+        if not unknown:
+            return
+
+        attributes = [split_attribute_name(name)[1] for name in unknown]
+        configs = self._retrier.call(device,
+                                     lambda: self._pool.device(device).get_attribute_config(attributes),
+                                     on_error=lambda err: self._pool.handle_error(device, err))
+
+        with self._lock:
+            for name, config in zip(unknown, configs):
+                self._strategies[name] = make_strategy(name, config)
+
+    def strategy(self, name):
+        """
+        :return: ReadStrategy of channel name, resolved now if unknown
+        """
+        strategy = self._strategies.get(name)
+        if strategy is None:
+            config = self._retrier.call(split_attribute_name(name)[0],
+                                        lambda: self._pool.attribute(name).get_config(),
+                                        on_error=lambda err: self._pool.handle_error(name, err))
+            strategy = make_strategy(name, config)
+            with self._lock:
+                self._strategies[name] = strategy
+        return strategy
+
+    def extract(self, name, reading):
+        """
+        get the value of channel name out of reading. Spectra are returned as numpy arrays
+        of the attribute dtype, without copy when tango already extracted them as such.
+        :param name: attribute name
+        :param reading: tango.DeviceAttribute
+        """
+        strategy = self.strategy(name)
+        val = getattr(reading, strategy.field)
+        if strategy.dtype is not None and val is not None:
+            val = np.asarray(val, dtype=strategy.dtype)
+        return val
+
+    def prepare_write(self, name, value):
+        """
+        spectrum values are handed to tango as contiguous numpy arrays of the attribute dtype,
+        without copy if value already is one (no python list conversion)
+        :param name: attribute name
+        :param value: value to write
+        """
+        strategy = self.strategy(name)
+        if strategy.dtype is not None:
+            return np.ascontiguousarray(value, dtype=strategy.dtype)
+        return value
+
+    def forget(self, name):
+        with self._lock:
+            self._strategies.pop(name, None)
@@ -0,0 +1,70 @@
+import threading
+import numpy as np
+
+
+class Deadband:
+    """
+    remembers the last confirmed set point of each channel and tells if a new write can be skipped,
+    because the value differs from it by less than the channel tolerance (ex: power supply resolution).
+    Opt-in: channels without a positive tolerance are always written, even with identical values.
+    """
+
+    def __init__(self, tolerances=None, default_tolerance=0.0):
+        """
+        :param tolerances: dict {channel name: absolute tolerance}
+        :param default_tolerance: tolerance of channels not in tolerances (0: not skipped)
+        """
+        self._tolerances = dict(tolerances or {})
+        self._default_tolerance = default_tolerance
+        self._set_points = {}
+        self._skip_counts = {}
+        self._write_counts = {}
+        self._lock = threading.Lock()
+
+    def tolerance(self, name):
+        return self._tolerances.get(name, self._default_tolerance)
+
+    def confirm(self, name, value):
+        """
+        store value as the present set point of channel name (after a write or a set point read)
+        """
+        if isinstance(value, np.ndarray):
+            value = value.copy()  # callers may reuse their buffers
+        with self._lock:
+            self._set_points[name] = value
+
+    def forget(self, name):
+        with self._lock:
+            self._set_points.pop(name, None)
+
+    def is_noop(self, name, value):
+        """
+        :return: True if value differs from the set point of channel name by less than its tolerance
+        """
+        tolerance = self.tolerance(name)
+        if not tolerance > 0:
+            return False
+        with self._lock:
+            last = self._set_points.get(name)
+        if last is None:
+            return False
+
+        try:
+            return bool(np.all(np.abs(np.asarray(value) - np.asarray(last)) < tolerance))
+        except (TypeError, ValueError):  # non numeric or shape change
+            return bool(np.array_equal(np.asarray(value), np.asarray(last)))
+
+    def count(self, name, skipped):
+        with self._lock:
+            counts = self._skip_counts if skipped else self._write_counts
+            counts[name] = counts.get(name, 0) + 1
+
+    def stats(self):
+        """
+        :return: dict {channel name: {'written': n, 'skipped': n}}
+        """
+        with self._lock:
+            names = set(self._skip_counts) | set(self._write_counts)
+            return {name: {'written': self._write_counts.get(name, 0),
+                           'skipped': self._skip_counts.get(name, 0)}
+                    for name in names}
@@ -0,0 +1,140 @@
+import threading
+from collections import deque
+import tango
+from .pool import split_attribute_name
+
+EVENT_TYPES = {'CHANGE': tango.EventType.CHANGE_EVENT,
+               'PERIODIC': tango.EventType.PERIODIC_EVENT}
+
+
+class RingBuffer:
+    """
+    fixed size buffer of (timestamp, value) samples, oldest samples are dropped first
+    """
+
+    def __init__(self, size):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+    def append(self, timestamp, value):
+        with self._lock:
+            self._samples.append((timestamp, value))
+
+    def last(self):
+        """
+        :return: last (timestamp, value) sample or None if empty
+        """
+        with self._lock:
+            return self._samples[-1] if self._samples else None
+
+    def since(self, timestamp):
+        """
+        :param timestamp: epoch time in s
+        :return: list of (timestamp, value) samples strictly newer than timestamp
+        """
+        with self._lock:
+            return [s for s in self._samples if s[0] > timestamp]
+
+
+class EventCache:
+    """
+    keeps a ring buffer per attribute filled by tango CHANGE or PERIODIC events,
+    so that reads of hot diagnostics are answered from memory.
+    After an error event, the last value of the attribute is not served until the next valid event.
+    """
+
+    def __init__(self, pool, select_value, buffer_size=1000, event_type='CHANGE'):
+        """
+        :param pool: ProxyPool
+        :param select_value: function(attribute name, tango.DeviceAttribute) returning the value to store
+        :param buffer_size: number of samples kept per attribute
+        :param event_type: 'CHANGE' or 'PERIODIC'
+        """
+        self._pool = pool
+        self._select_value = select_value
+        self._buffer_size = buffer_size
+        self._event_type = EVENT_TYPES[event_type]
+        self._buffers = {}
+        self._subscriptions = {}
+        # attributes whose last event is an error
+        self._invalid = set()
+        self._lock = threading.Lock()
+
+    def _callback(self, name):
+        buffer = self._buffers[name]
+
+        def push(event):
+            if event.err:
+                print(f'event error on {name}: {event.errors[0].desc if event.errors else ""}, will be polled')
+                with self._lock:
+                    self._invalid.add(name)
+                return
+            attr_value = event.attr_value
+            buffer.append(attr_value.time.totime(), self._select_value(name, attr_value))
+            with self._lock:
+                self._invalid.discard(name)
+
+        return push
+
+    def subscribe(self, name):
+        """
+        subscribe to events of attribute name. Attributes without events configured are left to polling.
+        :return: True if subscribed
+        """
+        with self._lock:
+            if name in self._subscriptions:
+                return True
+            self._buffers[name] = RingBuffer(self._buffer_size)
+
+        device, attribute = split_attribute_name(name)
+        try:
+            event_id = self._pool.device(device).subscribe_event(
+                attribute, self._event_type, self._callback(name))
+        except tango.DevFailed as err:
+            print(f'cannot subscribe to events of {name}, will be polled: {err.args[0].desc}')
+            with self._lock:
+                del self._buffers[name]
+            return False
+
+        with self._lock:
+            self._subscriptions[name] = (device, event_id)
+        return True
+
+    def is_subscribed(self, name):
+        with self._lock:
+            return name in self._subscriptions
+
+    def latest(self, name):
+        """
+        :return: last (timestamp, value) received for attribute name, None if not subscribed, no event yet
+                 or the last event is an error
+        """
+        with self._lock:
+            if name in self._invalid:
+                return None
+        buffer = self._buffers.get(name)
+        return buffer.last() if buffer is not None else None
+
+    def since(self, name, timestamp):
+        """
+        :return: list of (timestamp, value) of attribute name received after timestamp
+        """
+        buffer = self._buffers.get(name)
+        return buffer.since(timestamp) if buffer is not None else []
+
+    def unsubscribe_all(self):
+        with self._lock:
+            subscriptions = list(self._subscriptions.items())
+            self._subscriptions.clear()
+            self._buffers.clear()
+            self._invalid.clear()
+
+        for name, (device, event_id) in subscriptions:
+            try:
+                self._pool.device(device).unsubscribe_event(event_id)
+            except tango.DevFailed:
+                print(f'failed to unsubscribe events of {name}')
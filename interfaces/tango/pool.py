@@ -0,0 +1,129 @@
+import threading
+import tango
+
+# DevFailed reasons meaning that the device behind a cached proxy went away
+# (server restarted, device re-exported, host down). The proxy has to be rebuilt.
+CONNECTION_REASONS = ('API_CantConnectToDevice',
+                      'API_CommunicationFailed',
+                      'API_ConnectionFailed',
+                      'API_CorbaException',
+                      'API_DeviceNotExported',
+                      'API_ServerNotRunning')
+
+
+def is_connection_error(err):
+    """
+    True if a tango.DevFailed was caused by a lost connection to the device
+    :param err: tango.DevFailed exception
+    :return: bool
+    """
+    return any(getattr(e, 'reason', None) in CONNECTION_REASONS for e in err.args)
+
+
+def split_attribute_name(name):
+    """
+    split attribute name in device name and attribute
+    :param name: ex: srdiag/beam-current/total/Current
+    :return: ('srdiag/beam-current/total', 'Current')
+    """
+    device, attribute = name.rsplit('/', 1)
+    return device, attribute
+
+
+def group_by_device(names):
+    """
+    group attribute names by device, preserving the order of first appearance
+    :param names: list of attribute names
+    :return: dict {device name: [attribute names]}
+    """
+    groups = {}
+    for name in names:
+        device, _ = split_attribute_name(name)
+        groups.setdefault(device, []).append(name)
+    return groups
+
+
+class ProxyPool:
+    """
+    long lived pool of tango.AttributeProxy and tango.DeviceProxy objects keyed by fully qualified name.
+    Proxies are created lazily on first use and kept for the lifetime of the interface,
+    so that a read or write costs only the attribute round trip.
+    """
+
+    def __init__(self, tango_host):
+        self._tango_host = tango_host
+        self._attributes = {}
+        self._devices = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def full_name(self, name):
+        return self._tango_host + name
+
+    def _get(self, cache, key, factory):
+        with self._lock:
+            proxy = cache.get(key)
+            if proxy is not None:
+                self.hits += 1
+                return proxy
+            self.misses += 1
+
+        # build outside the lock, it involves a database lookup and a device import
+        proxy = factory(key)
+
+        with self._lock:
+            return cache.setdefault(key, proxy)
+
+    def attribute(self, name):
+        """
+        get (or create) the AttributeProxy of attribute name
+        :param name: attribute name without tango host (ex: srdiag/beam-current/total/Current)
+        :return: tango.AttributeProxy
+        """
+        return self._get(self._attributes, self.full_name(name), tango.AttributeProxy)
+
+    def device(self, name):
+        """
+        get (or create) the DeviceProxy of device name
+        :param name: device name without tango host (ex: srdiag/beam-current/total)
+        :return: tango.DeviceProxy
+        """
+        return self._get(self._devices, self.full_name(name), tango.DeviceProxy)
+
+    def evict(self, name):
+        """
+        drop the proxies of attribute (or device) name and of its device, next access will rebuild them
+        """
+        key = self.full_name(name)
+        with self._lock:
+            evicted = self._attributes.pop(key, None) is not None
+            evicted |= self._devices.pop(key, None) is not None
+            if '/' in name:
+                device, _ = split_attribute_name(name)
+                evicted |= self._devices.pop(self.full_name(device), None) is not None
+            if evicted:
+                self.evictions += 1
+
+    def handle_error(self, name, err):
+        """
+        evict the proxies of attribute (or device) name if err is a connection error (ex: device restarted)
+        :return: True if the proxies were evicted
+        """
+        if is_connection_error(err):
+            self.evict(name)
+            return True
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._attributes.clear()
+            self._devices.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._attributes) + len(self._devices),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
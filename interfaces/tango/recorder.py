@@ -0,0 +1,117 @@
+import atexit
+import os
+import threading
+import numpy as np
+
+# file layout of a recording: <directory>/chunk-00000.npz, chunk-00001.npz, ... each holding the columns
+#   op       uint8    0 read, 1 write
+#   channel  str      attribute name
+#   t        float64  epoch time at the start of the call, s
+#   latency  float64  duration of the call, s
+#   kind     uint8    KIND_* below
+#   offset   int64    start of the value in values (KIND_SCALAR, KIND_ARRAY)
+#   size     int64    number of elements of the value in values
+#   text     str      value of KIND_TEXT entries, '' otherwise
+#   values   float64  numeric values of all entries, concatenated
+OPS = {'read': 0, 'write': 1}
+KIND_SCALAR, KIND_ARRAY, KIND_TEXT, KIND_NONE = 0, 1, 2, 3
+
+
+def chunk_name(directory, index):
+    return os.path.join(directory, f'chunk-{index:05d}.npz')
+
+
+class Recorder:
+    """
+    append-only columnar recording of the interface traffic, written as compressed npz chunks
+    of chunk_size entries
+    """
+
+    def __init__(self, directory, chunk_size=10000):
+        self._directory = directory
+        self._chunk_size = chunk_size
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # continue an existing recording after its last chunk
+        self._index = 0
+        while os.path.exists(chunk_name(directory, self._index)):
+            self._index += 1
+        self._reset()
+        # do not lose the last partial chunk if the interface is not closed
+        atexit.register(self.flush)
+
+    def _reset(self):
+        self._columns = {k: [] for k in ('op', 'channel', 't', 'latency', 'kind', 'offset', 'size', 'text')}
+        self._values = []
+        self._n_values = 0
+
+    def record(self, op, channel, value, t, latency):
+        """
+        :param op: 'read' or 'write'
+        :param channel: attribute name
+        :param value: value read or written
+        :param t: epoch time at the start of the call
+        :param latency: duration of the call in s
+        """
+        text = ''
+        if value is None:
+            kind, data = KIND_NONE, None
+        elif isinstance(value, str):
+            kind, data = KIND_TEXT, None
+            text = value
+        else:
+            data = np.asarray(value)
+            if data.dtype.kind not in 'biuf':
+                kind, data = KIND_TEXT, None
+                text = str(value)
+            else:
+                kind = KIND_ARRAY if data.ndim > 0 else KIND_SCALAR
+                data = data.astype(np.float64).ravel()  # copy, callers may reuse their buffers
+
+        with self._lock:
+            columns = self._columns
+            columns['op'].append(OPS[op])
+            columns['channel'].append(channel)
+            columns['t'].append(t)
+            columns['latency'].append(latency)
+            columns['kind'].append(kind)
+            columns['text'].append(text)
+            columns['offset'].append(self._n_values)
+            columns['size'].append(0 if data is None else data.size)
+            if data is not None:
+                self._values.append(data)
+                self._n_values += data.size
+
+            if len(columns['op']) >= self._chunk_size:
+                self._flush()
+
+    def _flush(self):
+        columns = self._columns
+        if not columns['op']:
+            return
+        np.savez_compressed(chunk_name(self._directory, self._index),
+                            op=np.array(columns['op'], dtype=np.uint8),
+                            channel=np.array(columns['channel'], dtype=str),
+                            t=np.array(columns['t'], dtype=np.float64),
+                            latency=np.array(columns['latency'], dtype=np.float64),
+                            kind=np.array(columns['kind'], dtype=np.uint8),
+                            offset=np.array(columns['offset'], dtype=np.int64),
+                            size=np.array(columns['size'], dtype=np.int64),
+                            text=np.array(columns['text'], dtype=str),
+                            values=np.concatenate(self._values) if self._values else np.zeros(0))
+        self._index += 1
+        self._reset()
+
+    def flush(self):
+        """
+        write the pending entries as a new chunk
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """
+        write the pending entries, the recorder is no longer flushed at exit
+        """
+        atexit.unregister(self.flush)
+        self.flush()
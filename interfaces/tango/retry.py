@@ -0,0 +1,158 @@
+import random
+import threading
+import time
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    raised without contacting the device when its circuit breaker is open
+    """
+    pass
+
+
+class RetryPolicy:
+    """
+    jittered exponential backoff: attempt n waits initial_delay * 2**n (at most max_delay),
+    scaled by a random factor in [1 - jitter, 1 + jitter]
+    """
+
+    def __init__(self, max_attempts=3, initial_delay=0.005, max_delay=0.5, jitter=0.5):
+        self.max_attempts = max(1, max_attempts)
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        """
+        :param attempt: index of the failed attempt (0 for the first one)
+        :return: time to wait in s before the next attempt
+        """
+        delay = min(self.initial_delay * 2 ** attempt, self.max_delay)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class CircuitBreaker:
+    """
+    per device circuit breaker. After threshold consecutive failed calls the device is considered dead
+    and calls fail immediately, until reset_time has elapsed and a trial call succeeds.
+    """
+
+    def __init__(self, threshold=3, reset_time=30.0):
+        self.threshold = threshold
+        self.reset_time = reset_time
+        self._failures = {}
+        self._opened_at = {}
+        self._trips = {}
+        self._lock = threading.Lock()
+
+    def check(self, device):
+        """
+        raise CircuitOpenError if device calls are blocked
+        """
+        with self._lock:
+            opened_at = self._opened_at.get(device)
+            if opened_at is None:
+                return
+            if time.monotonic() - opened_at < self.reset_time:
+                raise CircuitOpenError(f'{device} failed {self._failures[device]} times in a row, '
+                                       f'calls blocked for {self.reset_time} s')
+            # half open: let one trial call through, a failure opens the circuit again
+            self._opened_at[device] = time.monotonic()
+
+    def success(self, device):
+        with self._lock:
+            self._failures[device] = 0
+            self._opened_at.pop(device, None)
+
+    def failure(self, device):
+        with self._lock:
+            self._failures[device] = self._failures.get(device, 0) + 1
+            if self._failures[device] >= self.threshold:
+                if device not in self._opened_at:
+                    self._trips[device] = self._trips.get(device, 0) + 1
+                    print(f'{device} circuit breaker open')
+                self._opened_at[device] = time.monotonic()
+
+    def is_open(self, device):
+        with self._lock:
+            return device in self._opened_at
+
+    def stats(self):
+        with self._lock:
+            return {device: {'consecutive_failures': self._failures.get(device, 0),
+                             'trips': self._trips.get(device, 0),
+                             'open': device in self._opened_at}
+                    for device in set(self._failures) | set(self._trips)}
+
+
+class Retrier:
+    """
+    calls functions talking to a device with RetryPolicy and CircuitBreaker, and counts retries and failures
+    """
+
+    def __init__(self, policy, breaker, errors=Exception):
+        """
+        :param policy: RetryPolicy
+        :param breaker: CircuitBreaker
+        :param errors: exception type(s) retried (ex: tango.DevFailed), others are raised immediately
+        """
+        self.policy = policy
+        self.breaker = breaker
+        self.errors = errors
+        self._retries = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _count(self, counts, device):
+        with self._lock:
+            counts[device] = counts.get(device, 0) + 1
+
+    def call(self, device, func, on_error=None):
+        """
+        :param device: device name, key of the circuit breaker
+        :param func: function without arguments, may raise errors
+        :param on_error: function(error) called after each failed attempt (ex: evict proxies)
+        :return: func()
+        """
+        self._local.retries = 0
+        self.breaker.check(device)
+
+        for attempt in range(self.policy.max_attempts):
+            self._local.retries = attempt
+            try:
+                result = func()
+            except self.errors as err:
+                if on_error is not None:
+                    on_error(err)
+                if attempt + 1 == self.policy.max_attempts:
+                    self._count(self._failures, device)
+                    self.breaker.failure(device)
+                    raise
+                self._count(self._retries, device)
+                time.sleep(self.policy.delay(attempt))
+            else:
+                self.breaker.success(device)
+                return result
+
+    def last_retries(self):
+        """
+        :return: number of retries of the last call made by the calling thread
+        """
+        return getattr(self._local, 'retries', 0)
+
+    def retries(self, device):
+        with self._lock:
+            return self._retries.get(device, 0)
+
+    def stats(self):
+        """
+        :return: dict {device: {'retries', 'failures', 'consecutive_failures', 'trips', 'open'}}
+        """
+        breaker = self.breaker.stats()
+        with self._lock:
+            devices = set(self._retries) | set(self._failures) | set(breaker)
+            return {device: {'retries': self._retries.get(device, 0),
+                             'failures': self._failures.get(device, 0),
+                             **breaker.get(device, {'consecutive_failures': 0, 'trips': 0, 'open': False})}
+                    for device in devices}
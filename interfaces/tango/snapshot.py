@@ -0,0 +1,20 @@
+from collections import namedtuple
+
+# value of a channel with its source timestamp (epoch s) and tango quality (ex: 'ATTR_VALID')
+Sample = namedtuple('Sample', ['value', 'timestamp', 'quality'])
+
+
+class SnapshotSkewError(ValueError):
+    """
+    raised when the samples of a snapshot were not taken close enough in time
+    """
+    pass
+
+
+def timestamp_skew(samples):
+    """
+    :param samples: dict {channel name: Sample}
+    :return: difference in s between the newest and the oldest sample
+    """
+    timestamps = [s.timestamp for s in samples.values()]
+    return max(timestamps) - min(timestamps) if timestamps else 0.0
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+import numpy as np
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def estimate_bytes(value):
+    """
+    approximate size of a value transferred to or from the control system
+    """
+    if value is None:
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_bytes(v) for v in value)
+    return 8
+
+
+class ChannelStats:
+    """
+    call count, latency samples (last window_size), bytes, retries and failures of one channel and operation
+    """
+
+    def __init__(self, window_size=10000):
+        self.count = 0
+        self.bytes = 0
+        self.retries = 0
+        self.failures = 0
+        self.latency_sum = 0.0
+        self._latencies = deque(maxlen=window_size)
+
+    def add(self, latency, nbytes=0, retries=0, failed=False):
+        self.count += 1
+        self.bytes += nbytes
+        self.retries += retries
+        self.failures += int(failed)
+        self.latency_sum += latency
+        self._latencies.append(latency)
+
+    def summary(self):
+        if self._latencies:
+            quantiles = np.quantile(np.fromiter(self._latencies, dtype=float), QUANTILES)
+        else:
+            quantiles = [float('nan')] * len(QUANTILES)
+        return {'count': self.count,
+                'bytes': self.bytes,
+                'retries': self.retries,
+                'failures': self.failures,
+                'latency_sum': self.latency_sum,
+                **{f'p{int(q * 100)}': float(v) for q, v in zip(QUANTILES, quantiles)}}
+
+
+class Telemetry:
+    """
+    per channel statistics of the interface reads and writes, available in process (summary)
+    or written periodically to a JSON or Prometheus text file
+    """
+
+    def __init__(self, window_size=10000):
+        self._window_size = window_size
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._flush_thread = None
+        self._stop = threading.Event()
+
+    def record(self, op, channel, latency, nbytes=0, retries=0, failed=False):
+        """
+        :param op: 'read' or 'write'
+        :param channel: attribute name
+        :param latency: duration of the call in s
+        :param nbytes: bytes transferred
+        :param retries: number of retries of the call
+        :param failed: True if the call finally failed
+        """
+        with self._lock:
+            stats = self._stats.get((op, channel))
+            if stats is None:
+                stats = self._stats[(op, channel)] = ChannelStats(self._window_size)
+            stats.add(latency, nbytes, retries, failed)
+
+    def summary(self):
+        """
+        :return: dict {op: {channel: {'count', 'bytes', 'retries', 'failures', 'latency_sum', 'p50', 'p95', 'p99'}}}
+        """
+        with self._lock:
+            out = {}
+            for (op, channel), stats in self._stats.items():
+                out.setdefault(op, {})[channel] = stats.summary()
+            return out
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def to_json(self):
+        return json.dumps({'timestamp': time.time(), 'channels': self.summary()}, indent=1)
+
+    def to_prometheus(self, prefix='badger_tango'):
+        lines = []
+        summary = self.summary()
+
+        def metric(name, kind, field):
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            for op, channels in summary.items():
+                for channel, stats in channels.items():
+                    lines.append(f'{prefix}_{name}{{op="{op}",channel="{channel}"}} {stats[field]}')
+
+        metric('calls_total', 'counter', 'count')
+        metric('bytes_total', 'counter', 'bytes')
+        metric('retries_total', 'counter', 'retries')
+        metric('failures_total', 'counter', 'failures')
+
+        lines.append(f'# TYPE {prefix}_latency_seconds summary')
+        for op, channels in summary.items():
+            for channel, stats in channels.items():
+                labels = f'op="{op}",channel="{channel}"'
+                for q in QUANTILES:
+                    lines.append(f'{prefix}_latency_seconds{{{labels},quantile="{q}"}} {stats[f"p{int(q * 100)}"]}')
+                lines.append(f'{prefix}_latency_seconds_sum{{{labels}}} {stats["latency_sum"]}')
+                lines.append(f'{prefix}_latency_seconds_count{{{labels}}} {stats["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename, fmt='json'):
+        """
+        write the statistics to filename, atomically (readers never see a partial file)
+        :param fmt: 'json' or 'prometheus'
+        """
+        text = self.to_prometheus() if fmt == 'prometheus' else self.to_json()
+        tmp = f'{filename}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, filename)
+
+    def start_flush(self, filename, period=10.0, fmt='json'):
+        """
+        write the statistics to filename every period s in a background thread
+        """
+        if self._flush_thread is not None:
+            return
+
+        def flush():
+            while not self._stop.wait(period):
+                self.write(filename, fmt)
+            self.write(filename, fmt)
+
+        self._stop.clear()
+        self._flush_thread = threading.Thread(target=flush, name='tango-telemetry', daemon=True)
+        self._flush_thread.start()
+
+    def stop_flush(self):
+        if self._flush_thread is not None:
+            self._stop.set()
+            self._flush_thread.join()
+            self._flush_thread = None
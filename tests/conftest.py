@@ -0,0 +1,55 @@
+import importlib.util
+import pathlib
+import sys
+import types
+import pytest
+
+ROOT = pathlib.Path(__file__).parent.parent
+
+# The plugin directories are registered as packages without running their __init__, which imports badger
+# (and tango or pyAT). Their modules can then be tested alone, ex: from interfaces.tango.retry import Retrier
+for top in ('interfaces', 'environments', 'algorithms'):
+    package = sys.modules[top] = types.ModuleType(top)
+    package.__path__ = [str(ROOT / top)]
+    for directory in sorted((ROOT / top).iterdir()):
+        if (directory / '__init__.py').exists():
+            plugin = sys.modules[f'{top}.{directory.name}'] = types.ModuleType(f'{top}.{directory.name}')
+            plugin.__path__ = [str(directory)]
+
+
+@pytest.fixture
+def plugin():
+    """
+    load(name) runs the __init__ of plugin name (ex: 'interfaces.sim') and returns it.
+    The test is skipped if badger is not installed.
+    """
+    def load(name):
+        pytest.importorskip('badger')
+        module = sys.modules[name]
+        if not hasattr(module, '__file__'):
+            path = ROOT.joinpath(*name.split('.'))
+            spec = importlib.util.spec_from_file_location(name, path / '__init__.py',
+                                                          submodule_search_locations=[str(path)])
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            sys.modules[name] = module
+        return module
+
+    return load
+
+
+@pytest.fixture
+def dev_failed():
+    """
+    dev_failed(reason) builds a tango.DevFailed with one error of the given reason.
+    The test is skipped if PyTango is not installed.
+    """
+    tango = pytest.importorskip('tango')
+
+    def make(reason='API_CommandTimedOut'):
+        error = tango.DevError()
+        error.reason = reason
+        error.desc = f'{reason} (test)'
+        return tango.DevFailed(error)
+
+    return make
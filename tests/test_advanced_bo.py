@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from algorithms.advanced_bo.modules.OnlineGP import OGP
+
+
+def make_gp():
+    # unit length scale, amplitude and noise variance hyperparameters
+    return OGP(1, [np.zeros((1, 1)), np.log(1.0), np.log(1.0)])
+
+
+class RecordingGP(OGP):
+    def __init__(self):
+        super().__init__(1, [np.zeros((1, 1)), np.log(1.0), np.log(1.0)])
+        self.noise_vars = []
+
+    def update(self, x_new, y_new, noise_var=None):
+        self.noise_vars.append(noise_var)
+        super().update(x_new, y_new, noise_var)
+
+
+def test_noise_var_per_measurement():
+    x, y = np.zeros((1, 1)), np.array([[1.0]])
+    model_noise, known_noise = make_gp(), make_gp()
+    model_noise.update(x, y)
+    known_noise.update(x, y, noise_var=1e-4)
+
+    # the likelihood variance is the measurement noise plus the prior variance at x
+    # (amplitude and noise hyperparameter): 1 + 2 with the model noise, 1e-4 + 2 with a known one
+    assert model_noise.predict(x)[0].item() == pytest.approx(1 / 3)
+    assert known_noise.predict(x)[0].item() == pytest.approx(1 / 2.0001)
+    assert known_noise.predict(x)[1].item() < model_noise.predict(x)[1].item()
+    assert known_noise.noise_var == model_noise.noise_var == 1.0
+
+    # a noisier measurement moves the posterior less
+    noisy = make_gp()
+    noisy.update(x, y, noise_var=10.0)
+    assert noisy.predict(x)[0].item() == pytest.approx(1 / 12)
+
+
+@pytest.mark.parametrize('sem, noise_var', [(0.1, 0.01), (np.inf, None), (np.nan, None)])
+def test_sem_objective_noise(sem, noise_var):
+    pytest.importorskip('scipy')
+    from algorithms.advanced_bo.modules.bayes_optimization import BayesOpt
+
+    def evaluate(X):
+        X = np.array(X, ndmin=2)
+        return np.array([[2.0, sem]]), None, None, X
+
+    model = RecordingGP()
+    optimizer = BayesOpt(model, evaluate, acq_func='UCB', start_dev_vals=[0.5], sem_objective=True)
+    optimizer.acquire = lambda: np.array([[0.3]])
+    optimizer.OptIter()
+
+    # squared standard error as noise of the measurement, model noise without a finite standard error
+    assert model.noise_vars == [None if noise_var is None else pytest.approx(noise_var)]
+    np.testing.assert_array_equal(optimizer.Y_obs[-1], [[2.0]])
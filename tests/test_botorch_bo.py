@@ -0,0 +1,80 @@
+import math
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+botorch = pytest.importorskip('botorch')
+
+
+@pytest.fixture
+def bo(plugin):
+    return plugin('algorithms.botorch_bo')
+
+
+def test_split_noise(bo):
+    Y = np.array([[1.0, 0.1, 5], [2.0, math.inf, 1]])
+    y, yvar = bo.split_noise(Y, [0.0, 2.0], sem_objective=True)
+    np.testing.assert_allclose(y.numpy(), [[0.5], [1.0]])
+    # the standard error is scaled as the objective, none for a single sample
+    np.testing.assert_allclose(yvar.numpy(), [[0.0025], [np.nan]])
+    assert bo.count_samples(Y, sem_objective=True) == 6
+
+    y, yvar = bo.split_noise(Y[:, :1], [0.0, 2.0], sem_objective=False)
+    assert yvar is None and y.shape == (2, 1)
+    assert bo.count_samples(Y, sem_objective=False) == 0
+
+
+@pytest.fixture
+def data():
+    torch.manual_seed(0)
+    x = torch.rand(6, 2, dtype=torch.float64)
+    f = (x ** 2).sum(dim=1, keepdim=True)
+    bounds = torch.tensor([[0.0, 0.0], [1.0, 1.0]])
+    return x, f, bounds
+
+
+def test_finite_sem_fixed_noise(bo, data):
+    x, f, bounds = data
+    noise = torch.full_like(f, 0.01)
+    candidate, gp = bo.get_BO_point(x, f, bounds, noise=noise)
+    assert isinstance(gp, botorch.models.FixedNoiseGP)
+    np.testing.assert_allclose(gp.likelihood.noise.detach().numpy(), 0.01)
+    assert candidate.shape == (1, 2)
+
+
+def test_missing_sem_model_noise(bo, data):
+    x, f, bounds = data
+    # no standard error at all: the noise is a hyperparameter
+    _, gp = bo.get_BO_point(x, f, bounds, noise=torch.full_like(f, math.nan))
+    assert not isinstance(gp, botorch.models.FixedNoiseGP)
+
+    # points without standard error get the noise level inferred from all the data
+    noise = torch.full_like(f, 0.01)
+    noise[0] = math.nan
+    _, gp = bo.get_BO_point(x, f, bounds, noise=noise)
+    assert isinstance(gp, botorch.models.FixedNoiseGP)
+    fitted = gp.likelihood.noise.detach().numpy()
+    assert np.isfinite(fitted).all() and fitted[0] != 0.01
+    np.testing.assert_allclose(fitted[1:], 0.01)
+
+
+def test_sem_objective_optimize(bo):
+    evaluations = []
+
+    def evaluate(X):
+        if X is None:
+            return None, None, None, np.array([[0.5, 0.5, 0.5]])
+        evaluations.append(X)
+        y = (X[:, [0]] - 0.3) ** 2
+        # objective, its standard error and the number of samples. The second column of X is the fidelity
+        return np.hstack((y, np.full_like(y, 0.01), np.full_like(y, 10.0))), None, None, X
+
+    params = {'start_from_current': True, 'num_init': 3, 'num_iter': 5, 'beta': 2.0, 'obj_bound': [0.0, 1.0],
+              'sem_objective': True, 'fidelity_index': 1, 'low_fidelity': 0.1, 'high_fidelity': 1.0}
+    bo.optimize(evaluate, params)
+    X = np.vstack(evaluations)
+    # the fidelity column is set by the algorithm, at low fidelity first
+    assert np.all(np.isclose(X[:, 1], 0.1) | np.isclose(X[:, 1], 1.0))
+    assert np.allclose(evaluations[0][:, 1], 0.1)
+    assert len(X) >= 5 and X.shape[1] == 3
+
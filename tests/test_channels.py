@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+tango = pytest.importorskip('tango')
+
+from interfaces.tango import pool as pool_module
+from interfaces.tango.channels import ChannelResolver
+from interfaces.tango.pool import ProxyPool
+from interfaces.tango.retry import CircuitBreaker, CircuitOpenError, Retrier, RetryPolicy
+
+
+def spectrum_config():
+    return SimpleNamespace(writable=tango.AttrWriteType.READ_WRITE, data_format=tango.AttrDataFormat.SPECTRUM,
+                           data_type=tango.CmdArgType.DevDouble, max_dim_x=288)
+
+
+def scalar_config():
+    return SimpleNamespace(writable=tango.AttrWriteType.READ, data_format=tango.AttrDataFormat.SCALAR,
+                           data_type=tango.CmdArgType.DevDouble, max_dim_x=1)
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    """
+    ChannelResolver of a ProxyPool whose DeviceProxy fail with the errors listed in failures
+    """
+    failures = []
+    created = []
+
+    class Device:
+        def __init__(self, name):
+            created.append(name)
+            self.config_calls = 0
+
+        def get_attribute_config(self, attributes):
+            self.config_calls += 1
+            if failures:
+                raise failures.pop(0)
+            return [spectrum_config() if a == 'CorrectionStrengths' else scalar_config() for a in attributes]
+
+    monkeypatch.setattr(pool_module.tango, 'DeviceProxy', Device)
+    pool = ProxyPool('tango://test:10000/')
+    retrier = Retrier(RetryPolicy(max_attempts=3, initial_delay=0.0), CircuitBreaker(threshold=2, reset_time=60.0),
+                      errors=tango.DevFailed)
+    return SimpleNamespace(channels=ChannelResolver(pool, retrier), pool=pool, retrier=retrier,
+                           failures=failures, created=created)
+
+
+def test_strategy_resolved_once(resolver):
+    resolver.channels.resolve('srmag/m-s/all', ['srmag/m-s/all/CorrectionStrengths', 'srmag/m-s/all/State'])
+    resolver.channels.resolve('srmag/m-s/all', ['srmag/m-s/all/CorrectionStrengths'])
+    assert resolver.pool.device('srmag/m-s/all').config_calls == 1
+
+    assert resolver.channels.strategy('srmag/m-s/all/CorrectionStrengths') == ('w_value', np.float64, 288)
+    assert resolver.channels.strategy('srmag/m-s/all/State') == ('w_value', None, 0)
+    reading = SimpleNamespace(value=None, w_value=[1.0, 2.0])
+    val = resolver.channels.extract('srmag/m-s/all/CorrectionStrengths', reading)
+    assert isinstance(val, np.ndarray) and val.dtype == np.float64
+
+
+def test_config_fetch_retried(resolver, dev_failed):
+    # the device restarted: the proxy is rebuilt and the config fetch retried
+    resolver.failures.append(dev_failed('API_DeviceNotExported'))
+    resolver.channels.resolve('srdiag/beam-current/total', ['srdiag/beam-current/total/Current'])
+    assert resolver.channels.strategy('srdiag/beam-current/total/Current') == ('value', None, 0)
+    assert resolver.retrier.retries('srdiag/beam-current/total') == 1
+    assert resolver.pool.stats()['evictions'] == 1
+    assert len(resolver.created) == 2
+
+
+def test_config_fetch_of_dead_device_opens_breaker(resolver, dev_failed):
+    resolver.failures.extend(dev_failed('API_CantConnectToDevice') for _ in range(6))
+    for _ in range(2):
+        with pytest.raises(tango.DevFailed):
+            resolver.channels.resolve('sr/d/1', ['sr/d/1/Current'])
+    with pytest.raises(CircuitOpenError):
+        resolver.channels.resolve('sr/d/1', ['sr/d/1/Current'])
+    assert resolver.retrier.stats()['sr/d/1']['trips'] == 1
@@ -0,0 +1,52 @@
+import numpy as np
+from interfaces.tango.deadband import Deadband
+
+
+def test_no_tolerance_always_written():
+    db = Deadband()
+    db.confirm('sr/ps/1/Current', 1.0)
+    assert not db.is_noop('sr/ps/1/Current', 1.0)
+
+
+def test_unknown_set_point_written():
+    db = Deadband({'sr/ps/1/Current': 0.1})
+    assert not db.is_noop('sr/ps/1/Current', 1.0)
+
+
+def test_strict_tolerance():
+    db = Deadband({'sr/ps/1/Current': 0.1})
+    db.confirm('sr/ps/1/Current', 1.0)
+    assert db.is_noop('sr/ps/1/Current', 1.0)
+    assert db.is_noop('sr/ps/1/Current', 1.05)
+    assert not db.is_noop('sr/ps/1/Current', 1.1)
+    assert not db.is_noop('sr/ps/1/Current', 0.8)
+
+    db.forget('sr/ps/1/Current')
+    assert not db.is_noop('sr/ps/1/Current', 1.0)
+
+
+def test_default_tolerance():
+    db = Deadband({'sr/ps/1/Current': 0.0}, default_tolerance=0.1)
+    db.confirm('sr/ps/1/Current', 1.0)
+    db.confirm('sr/ps/2/Current', 1.0)
+    assert not db.is_noop('sr/ps/1/Current', 1.0)
+    assert db.is_noop('sr/ps/2/Current', 1.05)
+
+
+def test_arrays():
+    db = Deadband(default_tolerance=0.1)
+    set_point = np.zeros(4)
+    db.confirm('srmag/m-s/all/CorrectionStrengths', set_point)
+    set_point[0] = 1.0  # the confirmed set point is a copy of the caller buffer
+    assert db.is_noop('srmag/m-s/all/CorrectionStrengths', np.full(4, 0.05))
+    # one magnet out of the deadband, or a shape change: written
+    assert not db.is_noop('srmag/m-s/all/CorrectionStrengths', np.array([0.0, 0.0, 0.0, 0.2]))
+    assert not db.is_noop('srmag/m-s/all/CorrectionStrengths', np.zeros(3))
+
+
+def test_stats():
+    db = Deadband()
+    db.count('sr/ps/1/Current', skipped=True)
+    db.count('sr/ps/1/Current', skipped=False)
+    db.count('sr/ps/1/Current', skipped=False)
+    assert db.stats() == {'sr/ps/1/Current': {'written': 2, 'skipped': 1}}
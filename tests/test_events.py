@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+import pytest
+
+tango = pytest.importorskip('tango')
+
+from interfaces.tango.events import EventCache, RingBuffer
+
+
+class Pool:
+    """
+    ProxyPool whose devices keep the event callbacks, to push events by hand
+    """
+
+    def __init__(self, dev_failed):
+        self.callbacks = {}
+        self.unsubscribed = []
+        self.dev_failed = dev_failed
+
+    def device(self, device):
+        pool = self
+
+        class Device:
+            def subscribe_event(self, attribute, event_type, callback):
+                if attribute == 'NoEvents':
+                    raise pool.dev_failed('API_EventPropertiesNotSet')
+                pool.callbacks[f'{device}/{attribute}'] = callback
+                return len(pool.callbacks)
+
+            def unsubscribe_event(self, event_id):
+                pool.unsubscribed.append(event_id)
+
+        return Device()
+
+
+def event(timestamp, value):
+    return SimpleNamespace(err=False, errors=[],
+                           attr_value=SimpleNamespace(value=value, time=SimpleNamespace(totime=lambda: timestamp)))
+
+
+def error_event():
+    return SimpleNamespace(err=True, errors=[SimpleNamespace(desc='API_EventTimeout')], attr_value=None)
+
+
+@pytest.fixture
+def cache(dev_failed):
+    pool = Pool(dev_failed)
+    return SimpleNamespace(events=EventCache(pool, lambda name, attr_value: attr_value.value, buffer_size=3),
+                           pool=pool)
+
+
+def test_ring_buffer_drops_oldest():
+    buffer = RingBuffer(2)
+    assert buffer.last() is None
+    for t in (1.0, 2.0, 3.0):
+        buffer.append(t, 10 * t)
+    assert len(buffer) == 2
+    assert buffer.since(0.0) == [(2.0, 20.0), (3.0, 30.0)]
+    assert buffer.since(2.0) == [(3.0, 30.0)]
+
+
+def test_latest_invalidated_by_error_event(cache):
+    name = 'srdiag/beam-current/total/Current'
+    assert cache.events.subscribe(name)
+    assert cache.events.latest(name) is None
+
+    push = cache.pool.callbacks[name]
+    push(event(1.0, 0.2))
+    push(event(2.0, 0.3))
+    assert cache.events.latest(name) == (2.0, 0.3)
+
+    # the last value is not served after an error, until the next valid event
+    push(error_event())
+    assert cache.events.latest(name) is None
+    push(event(3.0, 0.4))
+    assert cache.events.latest(name) == (3.0, 0.4)
+    assert cache.events.since(name, 1.0) == [(2.0, 0.3), (3.0, 0.4)]
+
+
+def test_attribute_without_events_left_to_polling(cache):
+    assert not cache.events.subscribe('srdiag/blm/all/NoEvents')
+    assert not cache.events.is_subscribed('srdiag/blm/all/NoEvents')
+    assert cache.events.since('srdiag/blm/all/NoEvents', 0.0) == []
+
+
+def test_unsubscribe_all(cache):
+    cache.events.subscribe('srdiag/beam-current/total/Current')
+    cache.events.subscribe('srdiag/blm/all/TotalLoss')
+    cache.events.unsubscribe_all()
+    assert sorted(cache.pool.unsubscribed) == [1, 2]
+    assert not cache.events.is_subscribed('srdiag/blm/all/TotalLoss')
@@ -0,0 +1,71 @@
+import time
+from types import SimpleNamespace
+import pytest
+from environments.injection_efficiency.history import HistoryReader
+
+
+class Device:
+    """
+    polling history of one attribute, entries (epoch time, value) appended by the test
+    """
+
+    def __init__(self, entries=()):
+        self.entries = list(entries)
+        self.depths = []
+
+    def attribute_history(self, attribute, depth):
+        self.depths.append(depth)
+        # newest first, as returned by tango
+        return [SimpleNamespace(time=SimpleNamespace(totime=lambda t=t: t), value=value)
+                for t, value in reversed(self.entries[-depth:])]
+
+
+def test_read_new_since_mark():
+    # device timestamps far from the host clock: only their order matters
+    device = Device([(t, 0.1 * t) for t in range(1, 11)])
+    reader = HistoryReader(device, depth=4, max_depth=100)
+    reader.mark()
+    assert reader.last_consumed() == 10 and reader.read_new() == []
+
+    device.entries += [(t, 0.1 * t) for t in range(11, 15)]
+    entries = reader.read_new()
+    assert [t for t, _ in entries] == [11, 12, 13, 14]
+    assert entries[0][1] == pytest.approx(1.1)
+    # consumed entries are not returned again
+    assert reader.read_new() == [] and reader.last_consumed() == 14
+
+
+def test_mark_empty_history():
+    device = Device()
+    reader = HistoryReader(device)
+    reader.mark()
+    device.entries += [(1.0, 0.5), (2.0, 0.6)]
+    assert reader.read_new() == [(1.0, 0.5), (2.0, 0.6)]
+
+
+def test_depth_follows_new_entries():
+    device = Device([(t, 1.0) for t in range(1, 51)])
+    reader = HistoryReader(device, depth=4, max_depth=64)
+    reader.mark()
+    # more new entries than the first depth requested: depth doubled up to max_depth
+    device.entries += [(t, 1.0) for t in range(51, 101)]
+    device.depths.clear()
+    assert [t for t, _ in reader.read_new()] == list(range(51, 101))
+    assert device.depths == [4, 8, 16, 32, 64]
+
+    device.entries += [(101, 1.0), (102, 1.0)]
+    device.depths.clear()
+    assert [t for t, _ in reader.read_new()] == [101, 102]
+    assert device.depths == [64]
+    # next request sized on the 2 new entries
+    reader.read_new()
+    assert device.depths[-1] == 6
+
+
+def test_read_new_waits():
+    device = Device([(1.0, 1.0)])
+    reader = HistoryReader(device)
+    reader.mark()
+    t0 = time.monotonic()
+    assert reader.read_new(wait=0.05) == []
+    assert time.monotonic() - t0 >= 0.05
@@ -0,0 +1,83 @@
+import math
+import pytest
+from environments.injection_efficiency.sampling import binomial_sem
+
+
+def test_binomial_sem():
+    assert binomial_sem(0.8, 0) == math.inf
+    # continuity corrected: no zero uncertainty for 0 or 100 % efficiency
+    assert binomial_sem(1.0, 10) == pytest.approx(math.sqrt((10.5 / 11) * (0.5 / 11) / 10))
+    assert binomial_sem(0.0, 10) == pytest.approx(binomial_sem(1.0, 10))
+    assert binomial_sem(0.5, 40) < binomial_sem(0.5, 10)
+
+
+@pytest.fixture
+def interface(plugin):
+    interface = plugin('interfaces.sim').Interface()
+    interface.read_latency = interface.write_latency = interface.latency_jitter = 0.0
+    # below 198 mA, no beam to kill before shooting
+    interface.initial_values = {'srdiag/beam-current/total/Current': 10.0}
+    return interface
+
+
+def test_fidelity_variable(plugin, interface):
+    module = plugin('environments.injection_efficiency')
+    # not a variable by default, algorithms optimizing all variables do not tune it
+    assert 'fidelity_shots' not in module.Environment(interface=interface).variable_names
+
+    environment = module.Environment(interface=interface, fidelity_variable=True)
+    assert 'fidelity_shots' in environment.variable_names
+    assert environment.get_bounds(['fidelity_shots', 'tl2/ps/qf7/Current']) == {'fidelity_shots': [2.0, 50.0],
+                                                                                 'tl2/ps/qf7/Current': [5.0, 15.0]}
+    assert 'fidelity_shots' not in module.Environment.variables
+    assert environment.get_variables(['fidelity_shots']) == {'fidelity_shots': environment.number_of_shots}
+
+    environment.set_variables({'tl2/ps/qf7/Current': 11.0, 'fidelity_shots': 6.6})
+    # the fidelity is not written to the control system
+    assert interface.get_calls()['write'] == 1
+    assert environment.get_fidelity() == 7
+    assert environment.get_variables(['fidelity_shots', 'tl2/ps/qf7/Current']) == {'fidelity_shots': 7,
+                                                                                  'tl2/ps/qf7/Current': 11.0}
+
+
+class Sequencer:
+    def __init__(self):
+        self.shots = []
+
+    def run(self, n_shots, session=False):
+        self.shots.append(n_shots)
+
+
+class History:
+    def __init__(self, *bursts):
+        self.bursts = list(bursts)
+
+    def mark(self):
+        pass
+
+    def read_new(self, wait=0.0):
+        return [(0.5, value) for value in self.bursts.pop(0)]
+
+
+@pytest.fixture
+def shooting(plugin, interface):
+    environment = plugin('environments.injection_efficiency').Environment(interface=interface, wait_time=0)
+    environment._sequencer = Sequencer()
+    return environment
+
+
+def test_shooting_samples(shooting):
+    shooting._history = History([0.5, 0.0, None, 1.0])
+    observables = shooting.get_observables(['inj_eff_shooting', 'inj_eff_shooting_sem', 'inj_eff_shooting_samples'])
+    # zero and missing treflite data are not averaged, the observable counts samples, not shots
+    assert observables == {'inj_eff_shooting': 0.75,
+                           'inj_eff_shooting_sem': pytest.approx(binomial_sem(0.75, 2)),
+                           'inj_eff_shooting_samples': 2}
+    assert shooting._sequencer.shots == [shooting.number_of_shots]
+
+
+def test_shooting_without_good_data(shooting):
+    shooting._history = History([0.0, None])
+    observables = shooting.get_observables(['inj_eff_shooting', 'inj_eff_shooting_sem', 'inj_eff_shooting_samples'])
+    assert observables == {'inj_eff_shooting': 0.0, 'inj_eff_shooting_sem': math.inf, 'inj_eff_shooting_samples': 0}
+    assert shooting.get_last_statistics()['inj_eff_shooting'].n == 0
@@ -0,0 +1,67 @@
+import math
+import pytest
+
+
+@pytest.fixture
+def interface(plugin):
+    class Interface(plugin('interfaces.sim').Interface):
+        # channel names of every snapshot
+        snapshots: list = []
+
+        def snapshot(self, channel_names, **kwargs):
+            self.snapshots.append(list(channel_names))
+            return super().snapshot(channel_names, **kwargs)
+
+    interface = Interface()
+    interface.read_latency = interface.write_latency = interface.latency_jitter = 0.0
+    return interface
+
+
+@pytest.fixture
+def environment(plugin, interface):
+    environment = plugin('environments.esrf_sext_and_oct_knobs').Environment(
+        interface=interface, waiting_time=0, number_of_acquisitions=3, seconds_between_acquisitions=0)
+    environment.get_variables([])  # store initial values
+    return environment
+
+
+def test_background_sampling_not_reused(environment, interface):
+    environment.background_sampling = True
+    environment.sampling_period = 0.01
+    environment.get_observables(['total_losses'])
+    environment.set_variables({'knob-sext-0': 0.0})
+    assert environment._sampler.is_running()
+    assert environment.get_observables(['total_losses'])['total_losses'] == pytest.approx(1.0)
+
+    # no set_variables in between: the second evaluation is acquired again
+    interface.set_values({'srdiag/blm/all/TotalLoss': 2.0})
+    stats = environment.get_last_statistics()
+    assert environment.get_observables(['total_losses'])['total_losses'] == pytest.approx(2.0)
+    assert environment.get_last_statistics()['total_losses'].n == stats['total_losses'].n == 3
+    assert not environment._sampler.is_running()
+
+
+def test_one_read_per_acquisition(environment, interface, monkeypatch):
+    monkeypatch.setattr(interface, 'read_noise', 0.01)
+    environment.relative_sem_tolerance = 1e-6
+    environment.max_acquisitions = 5
+    snapshots = interface.snapshots
+    snapshots.clear()
+    names = ['total_losses', 'libera_lifetime', 'normalized_libera_lifetime']
+    observables = environment.get_observables(names + [f'{obs}_sem' for obs in names])
+
+    # every acquisition reads the channels of all observables together, once
+    assert len(snapshots) == 5
+    assert all(sorted(channels) == sorted(snapshots[0]) for channels in snapshots)
+    assert len(snapshots[0]) == len(set(snapshots[0])) == 5
+    stats = environment.get_last_statistics()
+    assert sorted(stats) == sorted(names) and all(s.n == 5 for s in stats.values())
+    assert observables == {**{obs: stats[obs].mean for obs in names},
+                           **{f'{obs}_sem': stats[obs].sem for obs in names}}
+    assert all(0 < observables[f'{obs}_sem'] < math.inf for obs in names)
+
+    # a standard error alone samples its observable, and only its channels are read
+    snapshots.clear()
+    assert list(environment.get_observables(['total_losses_sem'])) == ['total_losses_sem']
+    assert list(environment.get_last_statistics()) == ['total_losses']
+    assert snapshots[0] == ['srdiag/beam-current/total/Current', 'srdiag/blm/all/TotalLoss']
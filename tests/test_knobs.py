@@ -0,0 +1,102 @@
+import os
+import numpy as np
+import pytest
+from environments.esrf_sext_and_oct_knobs.knobs import Knobs, knob_names, sidecar_is_valid, sidecar_paths
+
+
+@pytest.fixture
+def matrix():
+    # 3 knobs of 5 magnets
+    return np.arange(15, dtype=np.float64).reshape(3, 5)
+
+
+@pytest.fixture
+def csv_file(tmp_path, matrix):
+    filename = tmp_path / 'SextKnob.csv'
+    np.savetxt(filename, matrix, delimiter=',')
+    return filename
+
+
+def test_project_with_limits(csv_file, matrix):
+    initial = np.ones(5)
+    knobs = Knobs(csv_file, 'sext', low=-20.0, high=np.array([20.0, 20.0, 20.0, 20.0, 30.0]))
+    out = np.empty(5)
+    strengths, feasible = knobs.project(np.array([1.0]), ['knob-sext-1'], initial=initial, out=out)
+    assert strengths is out
+    np.testing.assert_allclose(out, initial + matrix[1])
+    assert feasible
+
+    # magnet 4 above its own limit, magnet 3 not
+    strengths, feasible = knobs.project(np.array([2.0]), ['knob-sext-1'], initial=initial)
+    np.testing.assert_allclose(strengths, [11.0, 13.0, 15.0, 17.0, 19.0])
+    assert feasible
+    _, feasible = knobs.project(np.array([2.0]), ['knob-sext-2'], initial=initial)
+    assert not feasible
+
+
+def test_project_batch_feasibility(csv_file, matrix):
+    knobs = Knobs(csv_file, 'sext', low=-10.0, high=10.0)
+    X = np.array([[0.5, 0.0], [0.0, 1.0], [-1.0, 0.0]])
+    strengths, feasible = knobs.project(X, ['knob-sext-0', 'knob-sext-2'])
+    np.testing.assert_allclose(strengths, [0.5 * matrix[0], matrix[2], -matrix[0]])
+    np.testing.assert_array_equal(feasible, [True, False, True])
+
+
+def test_no_limits(csv_file):
+    knobs = Knobs(csv_file, 'sext')
+    assert knobs.get_limits() == (None, None)
+    _, feasible = knobs.project(np.array([1e6]), ['knob-sext-2'])
+    assert feasible
+
+
+def test_amplitudes_paired_by_name(csv_file, matrix):
+    knobs = Knobs(csv_file, 'sext')
+    assert knobs.get_names() == ['knob-sext-0', 'knob-sext-1', 'knob-sext-2']
+    x = np.array([1.0, -2.0])
+    # amplitudes follow the order of the names, not the order of the knob matrix
+    np.testing.assert_allclose(knobs.project(x, ['knob-sext-2', 'knob-sext-0'])[0], matrix[2] - 2.0 * matrix[0])
+    np.testing.assert_allclose(knobs.project(x, ['knob-sext-0', 'knob-sext-2'])[0], matrix[0] - 2.0 * matrix[2])
+    np.testing.assert_allclose(knobs.project(np.ones(3), knobs.get_names())[0], matrix.sum(axis=0))
+
+
+def test_selections_cached(csv_file, matrix):
+    knobs = Knobs(csv_file, 'sext')
+    knobs.cache_size = 2
+    selection = knobs.gen_matrix(['knob-sext-2', 'knob-sext-1'])
+    assert selection.flags.c_contiguous
+    np.testing.assert_array_equal(selection, matrix[[2, 1]])
+    assert knobs.gen_matrix(('knob-sext-2', 'knob-sext-1')) is selection
+
+    # least recently used selections are dropped
+    knobs.gen_matrix(['knob-sext-0'])
+    knobs.gen_matrix(['knob-sext-1'])
+    assert knobs.gen_matrix(['knob-sext-2', 'knob-sext-1']) is not selection
+
+
+def test_sidecar_loaded_lazily_and_regenerated(csv_file, matrix):
+    npy_file, meta_file = sidecar_paths(csv_file)
+    knobs = Knobs(csv_file, 'sext')
+    assert knobs.get_count() == 3
+    assert not npy_file.exists()  # naming the knobs does not load the matrix
+
+    np.testing.assert_allclose(knobs.gen_matrix(['knob-sext-1']), matrix[[1]])
+    assert npy_file.exists() and sidecar_is_valid(csv_file)
+    assert isinstance(Knobs.load_knob(csv_file), np.memmap)
+
+    # touched but unchanged csv: the sidecar is kept
+    os.utime(csv_file, (0, 0))
+    assert sidecar_is_valid(csv_file)
+
+    np.savetxt(csv_file, 2 * matrix, delimiter=',')
+    assert not sidecar_is_valid(csv_file)
+    np.testing.assert_allclose(Knobs(csv_file, 'sext').gen_matrix(['knob-sext-1']), 2 * matrix[[1]])
+
+
+def test_names_counted_once(csv_file):
+    npy_file, _ = sidecar_paths(csv_file)
+    names = knob_names(csv_file, 'sext')
+    assert names == ('knob-sext-0', 'knob-sext-1', 'knob-sext-2') and not npy_file.exists()
+
+    # the Knobs of the same file reuse the names, counted once
+    assert knob_names(csv_file, 'sext') is names
+    assert Knobs(csv_file, 'sext').get_names() == list(names)
@@ -0,0 +1,92 @@
+from collections import OrderedDict
+import numpy as np
+import pytest
+from environments.esrf_sext_and_oct_knobs import NormalizeLifetime
+from environments.esrf_sext_and_oct_knobs.NormalizeLifetime import (BunchLengthTable, bunch_current_range,
+                                                                    normalize_lifetime)
+
+
+def linear_table(max_bunch_current=0.01, n_points=11):
+    # bunch lengthening with current
+    bunch_currents = np.linspace(0.0, max_bunch_current, n_points)
+    return BunchLengthTable(bunch_currents, 0.003 + 0.1 * bunch_currents, 1e-3 + 0.01 * bunch_currents)
+
+
+@pytest.fixture
+def computed(monkeypatch):
+    """
+    BunchLengthTable.compute replaced by linear_table, lattices counted in calls
+    """
+    calls = []
+
+    def compute(cls, r, zn=0.35, max_bunch_current=0.01, n_points=101):
+        calls.append((r, max_bunch_current))
+        return linear_table(max_bunch_current, n_points)
+
+    monkeypatch.setattr(BunchLengthTable, 'compute', classmethod(compute))
+    monkeypatch.setattr(BunchLengthTable, '_loaded', {})
+    monkeypatch.setattr(BunchLengthTable, '_by_lattice', OrderedDict())
+    return calls
+
+
+def test_bunch_current_range():
+    assert bunch_current_range(0.0) == 1e-6
+    # the table is sized to the bunch currents, not to a fixed step
+    assert bunch_current_range(0.2 / 882) == 0.00023
+    assert bunch_current_range(0.2005 / 882) == bunch_current_range(0.2 / 882)
+    assert bunch_current_range(0.01) == 0.01
+    assert bunch_current_range(0.2 / 16) == 0.013
+    for I_bunch in np.geomspace(1e-5, 0.1, 50):
+        assert I_bunch <= bunch_current_range(I_bunch) <= 1.1 * I_bunch
+
+
+def test_interpolated_within_the_table():
+    table = linear_table()
+    bl, es = table(np.array([0.0, 0.0025, 0.01]))
+    np.testing.assert_allclose(bl, [0.003, 0.00325, 0.004])
+    np.testing.assert_allclose(es, [1e-3, 1.025e-3, 1.1e-3])
+    # a few bunches carry more current than the table: not clamped
+    with pytest.raises(ValueError):
+        table(0.2 / 16)
+
+
+def test_normalized_arrays_match_scalars():
+    table = linear_table(0.02)
+    I_tot = np.array([0.19, 0.2, 0.21])
+    lt = normalize_lifetime(np.array([20.0, 21.0, 22.0]), 0.0, I_tot, 0.0, 130e-12, 10e-12,
+                            n_bunches=16, bunch_table=table)
+    expected = [normalize_lifetime(lt_tot, 0.0, I, 0.0, 130e-12, 10e-12, n_bunches=16, bunch_table=table)
+                for lt_tot, I in zip([20.0, 21.0, 22.0], I_tot)]
+    np.testing.assert_allclose(lt, expected)
+    with pytest.raises(ValueError):
+        normalize_lifetime(20.0, 0.0, 0.2, 0.0, 130e-12, 10e-12, n_bunches=16, bunch_table=linear_table())
+
+
+def test_table_of_lattice_covers_the_filling_pattern(computed, tmp_path, monkeypatch):
+    monkeypatch.setattr(NormalizeLifetime, '_table_dir', tmp_path)
+    lattice = ['ring']
+    normalize_lifetime(20.0, 0.0, 0.2, 0.0, 130e-12, 10e-12, r=lattice, n_bunches=16)
+    normalize_lifetime(20.0, 0.0, 0.2, 0.0, 130e-12, 10e-12, r=lattice, n_bunches=882)
+    assert [max_bunch_current for _, max_bunch_current in computed] == pytest.approx([0.013, 0.00023])
+
+
+def test_table_persisted_and_memoized(computed, tmp_path):
+    lattice = ['ring']
+    table = BunchLengthTable.for_lattice(lattice, directory=tmp_path)
+    assert BunchLengthTable.for_lattice(lattice, directory=tmp_path) is table
+    assert len(computed) == 1 and len(list(tmp_path.glob('bunch-length-*.cache.npz'))) == 1
+
+    # another process loads the saved table
+    BunchLengthTable._loaded.clear()
+    BunchLengthTable._by_lattice.clear()
+    loaded = BunchLengthTable.for_lattice(['ring'], directory=tmp_path)
+    assert len(computed) == 1
+    np.testing.assert_array_equal(loaded.bunch_lengths, table.bunch_lengths)
+
+
+def test_lattices_not_kept_forever(computed, tmp_path, monkeypatch):
+    monkeypatch.setattr(BunchLengthTable, 'cache_size', 2)
+    lattices = [[f'ring {i}'] for i in range(3)]
+    for lattice in lattices:
+        BunchLengthTable.for_lattice(lattice, directory=tmp_path)
+    assert [memo[0] for memo in BunchLengthTable._by_lattice.values()] == lattices[1:]
@@ -0,0 +1,36 @@
+import pytest
+
+tango = pytest.importorskip('tango')
+
+from interfaces.tango.pool import ProxyPool, is_connection_error
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(tango, 'AttributeProxy', lambda name: ('attribute', name))
+    monkeypatch.setattr(tango, 'DeviceProxy', lambda name: ('device', name))
+    return ProxyPool('tango://test:10000/')
+
+
+def test_proxies_reused(pool):
+    proxy = pool.attribute('srdiag/beam-current/total/Current')
+    assert proxy == ('attribute', 'tango://test:10000/srdiag/beam-current/total/Current')
+    assert pool.attribute('srdiag/beam-current/total/Current') is proxy
+    assert pool.device('srdiag/beam-current/total') == ('device', 'tango://test:10000/srdiag/beam-current/total')
+    assert pool.stats() == {'size': 2, 'hits': 1, 'misses': 2, 'evictions': 0}
+
+
+def test_evicted_on_connection_error(pool, dev_failed):
+    proxy = pool.attribute('srdiag/beam-current/total/Current')
+    pool.device('srdiag/beam-current/total')
+
+    # a timeout keeps the proxies, a restarted device drops the attribute and its device
+    assert not pool.handle_error('srdiag/beam-current/total/Current', dev_failed('API_CommandTimedOut'))
+    assert pool.stats()['size'] == 2
+    assert is_connection_error(dev_failed('API_DeviceNotExported'))
+    assert pool.handle_error('srdiag/beam-current/total/Current', dev_failed('API_DeviceNotExported'))
+    assert pool.stats()['size'] == 0 and pool.stats()['evictions'] == 1
+
+    rebuilt = pool.attribute('srdiag/beam-current/total/Current')
+    assert rebuilt == proxy and rebuilt is not proxy
+    assert pool.stats()['misses'] == 3
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from interfaces.tango import recorder as recorder_module
+from interfaces.tango.recorder import Recorder, chunk_name
+
+
+def record_session(directory, chunk_size=3):
+    recorder = Recorder(str(directory), chunk_size=chunk_size)
+    strengths = np.arange(4.0)
+    recorder.record('read', 'srdiag/beam-current/total/Current', 0.2, 100.0, 0.001)
+    recorder.record('write', 'srmag/m-s/all/CorrectionStrengths', strengths, 100.1, 0.005)
+    strengths += 1.0  # callers reuse their buffers
+    recorder.record('read', 'sy/ps-rips/manager/State', 'ON', 100.2, 0.001)
+    recorder.record('read', 'srdiag/beam-current/total/Current', None, 100.3, 0.001)
+    recorder.record('write', 'srmag/m-s/all/CorrectionStrengths', strengths, 100.4, 0.005)
+    return recorder
+
+
+def test_chunks(tmp_path):
+    recorder = record_session(tmp_path)
+    # full chunks are written as they fill, the rest on flush
+    assert (tmp_path / 'chunk-00000.npz').exists() and not (tmp_path / 'chunk-00001.npz').exists()
+    recorder.flush()
+    recorder.flush()  # nothing pending: no empty chunk
+    assert not (tmp_path / 'chunk-00002.npz').exists()
+
+    with np.load(chunk_name(str(tmp_path), 0)) as chunk:
+        np.testing.assert_array_equal(chunk['op'], [0, 1, 0])
+        np.testing.assert_array_equal(chunk['values'], [0.2, 0.0, 1.0, 2.0, 3.0])
+        np.testing.assert_array_equal(chunk['offset'], [0, 1, 5])
+        assert chunk['text'][2] == 'ON'
+
+    # a new recorder appends after the existing chunks
+    Recorder(str(tmp_path), chunk_size=1).record('read', 'srdiag/blm/all/TotalLoss', 3.0, 101.0, 0.001)
+    assert (tmp_path / 'chunk-00002.npz').exists()
+
+
+def test_close_unregisters_exit_flush(tmp_path, monkeypatch):
+    registered = []
+    monkeypatch.setattr(recorder_module.atexit, 'register', registered.append)
+    monkeypatch.setattr(recorder_module.atexit, 'unregister', registered.remove)
+    recorder = Recorder(str(tmp_path))
+    assert registered == [recorder.flush]
+
+    recorder.record('read', 'srdiag/blm/all/TotalLoss', 3.0, 101.0, 0.001)
+    recorder.close()
+    # closed recorders are written and released, not kept alive until exit
+    assert registered == [] and (tmp_path / 'chunk-00000.npz').exists()
+
+
+def test_replayed(tmp_path, plugin):
+    record_session(tmp_path).flush()
+    replay = plugin('interfaces.replay')
+    entries = replay.load_recording(str(tmp_path))
+    assert [(e.op, e.channel) for e in entries][:2] == [('read', 'srdiag/beam-current/total/Current'),
+                                                        ('write', 'srmag/m-s/all/CorrectionStrengths')]
+    np.testing.assert_array_equal(entries[1].value, np.arange(4.0))
+    assert entries[2].value == 'ON' and entries[3].value is None
+
+    interface = replay.Interface()
+    interface.load(str(tmp_path))
+    channel = 'srdiag/beam-current/total/Current'
+    sample = interface.snapshot([channel])[channel]
+    assert (sample.value, sample.timestamp) == (0.2, 100.0)
+    assert interface.get_values([channel]) == {channel: None}
+    assert interface.get_values([channel]) == {channel: None}  # exhausted: the last value is repeated
+
+    interface.set_values({'srmag/m-s/all/CorrectionStrengths': np.arange(4.0)})
+    interface.set_values({'srmag/m-s/all/CorrectionStrengths': np.zeros(4)})
+    interface.set_values({'tl2/ps/qf1/Current': 1.0})
+    stats = interface.get_replay_stats()
+    assert (stats['reads'], stats['writes'], stats['mismatches']) == (3, 3, 2)
+    assert stats['exhausted'] == [channel]
+    with pytest.raises(KeyError):
+        interface.get_values(['srdiag/blm/all/TotalLoss'])
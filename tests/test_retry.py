@@ -0,0 +1,91 @@
+import time
+import pytest
+from interfaces.tango import retry
+
+
+class DeviceError(Exception):
+    pass
+
+
+def test_breaker_opens_after_threshold():
+    breaker = retry.CircuitBreaker(threshold=2, reset_time=60.0)
+    breaker.failure('sr/d/1')
+    breaker.check('sr/d/1')
+    assert not breaker.is_open('sr/d/1')
+
+    breaker.failure('sr/d/1')
+    assert breaker.is_open('sr/d/1')
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.check('sr/d/1')
+    # other devices are not blocked
+    breaker.check('sr/d/2')
+
+
+def test_breaker_half_open_cycle():
+    breaker = retry.CircuitBreaker(threshold=1, reset_time=0.05)
+    breaker.failure('sr/d/1')
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.check('sr/d/1')
+
+    # half open after reset_time: one trial call goes through, its failure opens the circuit again
+    time.sleep(0.06)
+    breaker.check('sr/d/1')
+    breaker.failure('sr/d/1')
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.check('sr/d/1')
+
+    # a successful trial call closes it
+    time.sleep(0.06)
+    breaker.check('sr/d/1')
+    breaker.success('sr/d/1')
+    assert not breaker.is_open('sr/d/1')
+    breaker.check('sr/d/1')
+    assert breaker.stats()['sr/d/1'] == {'consecutive_failures': 0, 'trips': 1, 'open': False}
+
+
+def test_retrier_retries_then_opens():
+    retrier = retry.Retrier(retry.RetryPolicy(max_attempts=3, initial_delay=0.0),
+                            retry.CircuitBreaker(threshold=1, reset_time=60.0), errors=DeviceError)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise DeviceError('timeout')
+
+    with pytest.raises(DeviceError):
+        retrier.call('sr/d/1', fail)
+    assert len(calls) == 3
+    assert retrier.retries('sr/d/1') == 2
+    # the device is dead: next calls fail without calling it
+    with pytest.raises(retry.CircuitOpenError):
+        retrier.call('sr/d/1', fail)
+    assert len(calls) == 3
+
+
+def test_retrier_other_errors_not_retried():
+    retrier = retry.Retrier(retry.RetryPolicy(max_attempts=3, initial_delay=0.0),
+                            retry.CircuitBreaker(), errors=DeviceError)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise KeyError('bad name')
+
+    with pytest.raises(KeyError):
+        retrier.call('sr/d/1', fail)
+    assert len(calls) == 1
+
+
+def test_retrier_success_after_retry():
+    retrier = retry.Retrier(retry.RetryPolicy(max_attempts=3, initial_delay=0.0),
+                            retry.CircuitBreaker(), errors=DeviceError)
+    results = iter([DeviceError('timeout'), 42])
+
+    def flaky():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert retrier.call('sr/d/1', flaky) == 42
+    assert retrier.last_retries() == 1
@@ -0,0 +1,79 @@
+import threading
+import time
+import numpy as np
+import pytest
+from environments.esrf_sext_and_oct_knobs.sampler import BackgroundSampler, relative_drift
+
+
+def test_relative_drift():
+    times = np.arange(10.0)
+    assert relative_drift(times[:2], [1.0, 2.0]) == np.inf
+    assert relative_drift(times, np.full(10, 5.0)) == pytest.approx(0.0, abs=1e-12)
+    # 0.1 / s over 9 s around a mean of 10.45
+    assert relative_drift(times, 10.0 + 0.1 * times) == pytest.approx(0.9 / 10.45)
+    assert relative_drift(times[:3], [-1.0, 0.0, 1.0]) == np.inf  # zero mean
+
+
+@pytest.fixture
+def sampler():
+    reads = []
+    fail = threading.Event()
+
+    def read(channels):
+        if fail.is_set():
+            raise RuntimeError('device not answering')
+        reads.append(list(channels))
+        return {name: float(len(reads)) for name in channels}
+
+    sampler = BackgroundSampler(read, period=0.01, buffer_size=5)
+    sampler.reads, sampler.fail = reads, fail
+    yield sampler
+    sampler.stop()
+
+
+def test_samples_buffered(sampler):
+    t0 = time.time()
+    sampler.start(['srdiag/blm/all/TotalLoss'])
+    first = sampler.wait_sample(t0, timeout=1.0)
+    assert first.t > t0 and first.values == {'srdiag/blm/all/TotalLoss': 1.0}
+    time.sleep(0.1)
+    samples = sampler.samples_between(t0)
+    assert len(samples) == 5  # ring buffer
+    assert [a.t for a in samples] == sorted(a.t for a in samples)
+    assert sampler.samples_between(t0, samples[1].t) == samples[:2]
+
+
+def test_other_channels_clear_the_buffer(sampler):
+    sampler.start(['srdiag/blm/all/TotalLoss'])
+    sampler.wait_sample(0.0, timeout=1.0)
+    t_switch = time.time()
+    sampler.start(['srdiag/bpm/lifetime/Lifetime'])
+    assert all('srdiag/bpm/lifetime/Lifetime' in a.values for a in sampler.samples_between(0.0))
+    assert 'srdiag/bpm/lifetime/Lifetime' in sampler.wait_sample(t_switch, timeout=1.0).values
+
+
+def test_failed_reads_counted(sampler):
+    sampler.fail.set()
+    sampler.start(['srdiag/blm/all/TotalLoss'])
+    with pytest.raises(TimeoutError):
+        sampler.wait_sample(0.0, timeout=0.1)
+    assert sampler.errors() > 0 and sampler.is_running()
+
+    # sampling goes on once the device answers again
+    sampler.fail.clear()
+    assert sampler.wait_sample(0.0, timeout=1.0).values
+
+    sampler.stop()
+    assert not sampler.is_running()
+    with pytest.raises(TimeoutError):
+        sampler.wait_sample(time.time(), timeout=1.0)
+
+
+def test_restart_clears_the_buffer(sampler):
+    sampler.start(['srdiag/blm/all/TotalLoss'])
+    sampler.wait_sample(0.0, timeout=1.0)
+    sampler.stop()
+    # same channels, but acquisitions of the previous run are not served
+    sampler.start(['srdiag/blm/all/TotalLoss'])
+    assert sampler.wait_sample(0.0, timeout=1.0).values['srdiag/blm/all/TotalLoss'] > 1.0
+    assert all(a.values['srdiag/blm/all/TotalLoss'] > 1.0 for a in sampler.samples_between(0.0))
@@ -0,0 +1,47 @@
+import math
+import numpy as np
+import pytest
+from environments.esrf_sext_and_oct_knobs.sampling import RunningStats, SampleStats, acquire_adaptive
+
+
+def test_running_stats_match_numpy():
+    samples = np.random.default_rng(0).normal(5.0, 2.0, 1000)
+    stats = RunningStats()
+    for x in samples:
+        stats.add(x)
+    assert stats.n == 1000
+    assert stats.mean == pytest.approx(samples.mean())
+    assert stats.sem == pytest.approx(samples.std(ddof=1) / math.sqrt(1000))
+    assert stats.relative_sem() == pytest.approx(stats.sem / samples.mean())
+
+
+def test_unknown_uncertainty():
+    stats = RunningStats()
+    stats.add(3.0)
+    assert stats.result() == SampleStats(3.0, math.inf, 1)
+    stats.add(3.0)
+    assert stats.sem == 0.0 and stats.relative_sem() == 0.0
+
+
+def test_fixed_number_of_acquisitions():
+    values = iter(range(100))
+    stats = acquire_adaptive(lambda: {'loss': next(values)}, ['loss'], min_samples=4, max_samples=10)
+    assert stats['loss'].n == 4 and stats['loss'].mean == 1.5
+
+
+def test_acquire_until_tolerance():
+    rng = np.random.default_rng(1)
+    calls = []
+
+    def acquire():
+        calls.append(1)
+        return {'loss': 1.0 + 0.01 * rng.standard_normal(), 'lifetime': 10.0 + rng.standard_normal()}
+
+    stats = acquire_adaptive(acquire, ['loss', 'lifetime'], min_samples=3, max_samples=1000, rel_tol=0.01)
+    # the noisier observable sets the number of acquisitions
+    assert 3 < stats['lifetime'].n == stats['loss'].n == len(calls) < 1000
+    assert stats['lifetime'].sem / stats['lifetime'].mean <= 0.01
+
+    calls.clear()
+    stats = acquire_adaptive(acquire, ['lifetime'], min_samples=2, max_samples=5, rel_tol=1e-6)
+    assert len(calls) == 5 and stats['lifetime'].n == 5
@@ -0,0 +1,181 @@
+import enum
+import logging
+import time
+import pytest
+from environments.injection_efficiency.sequencer import ShotSequencer
+
+
+class State(enum.Enum):
+    ON = 'ON'
+    OFF = 'OFF'
+    STANDBY = 'STANDBY'
+    MOVING = 'MOVING'
+    RUNNING = 'RUNNING'
+    FAULT = 'FAULT'
+
+
+class Injector:
+    """
+    RIPS, gun and KE answering their commands with state transitions, commands logged in order
+    """
+
+    def __init__(self):
+        self.log = []
+        self.failures = {}  # command: number of failures before it succeeds
+        self.stuck = set()  # commands without effect on the state
+        self.states = {'rips': State.ON, 'gun': State.OFF, 'KE': State.STANDBY}
+        self.devices = {name: self.device(name) for name in self.states}
+
+    def command(self, name, new_state):
+        def run():
+            self.log.append(name)
+            if self.failures.get(name, 0) > 0:
+                self.failures[name] -= 1
+                raise RuntimeError(f'{name} failed')
+            if name not in self.stuck:
+                self.states[name.split('.')[0]] = new_state
+        return run
+
+    def device(self, name):
+        injector = self
+
+        class Device:
+            CounterMode = 0
+
+            def state(self):
+                state = injector.states[name]
+                if name == 'KE' and state == State.ON:
+                    injector.states[name] = State.OFF  # counted shots done
+                return state
+
+        device = Device()
+        commands = {'rips': {'StartRamping': State.RUNNING, 'StopRamping': State.ON},
+                    'gun': {'On': State.ON, 'Off': State.OFF},
+                    'KE': {'On': State.ON, 'Standby': State.STANDBY, 'Reset': State.STANDBY}}[name]
+        for command, new_state in commands.items():
+            setattr(device, command, self.command(f'{name}.{command}', new_state))
+        return device
+
+
+@pytest.fixture
+def injector():
+    return Injector()
+
+
+def sequencer(injector, **kwargs):
+    return ShotSequencer(injector.devices, poll_period=0.001, state_timeout=0.1, verbose=False, states=State,
+                         **kwargs)
+
+
+def test_run(injector):
+    seq = sequencer(injector)
+    injector.devices['KE'].CounterMode = 7
+    seq.run(4)
+    assert injector.log == ['rips.StartRamping', 'gun.On', 'KE.On', 'KE.Standby', 'rips.StopRamping', 'gun.Off']
+    assert injector.devices['KE'].CounterMode == 7
+    # phases end on the state transitions, not after worst case waits
+    assert list(seq.get_durations()) == list(ShotSequencer.PHASES)
+    assert sum(seq.get_durations().values()) < 0.5
+
+
+def test_durations_logged_without_verbose(injector, caplog):
+    caplog.set_level(logging.INFO)
+    sequencer(injector).run(2)
+    assert [record.getMessage().split(':')[0] for record in caplog.records] == list(ShotSequencer.PHASES) + \
+        ['shot sequence']
+
+
+def test_ke_command_retried_after_reset(injector):
+    injector.failures['KE.On'] = 1
+    seq = sequencer(injector, retry_delay=10.0, ke_retry_delay=0.01)
+    t0 = time.monotonic()
+    seq.run(2)
+    assert injector.log[2:6] == ['KE.On', 'KE.Reset', 'KE.On', 'KE.Standby']
+    assert time.monotonic() - t0 < 1.0  # KE retried after ke_retry_delay, not retry_delay
+
+
+def test_aborted_on_timeout(injector):
+    injector.stuck.add('gun.On')
+    with pytest.raises(TimeoutError):
+        sequencer(injector).run(2)
+    # ramp stopped, gun and KE left off
+    assert injector.log == ['rips.StartRamping', 'gun.On', 'rips.StopRamping', 'KE.Standby']
+    assert injector.states == {'rips': State.ON, 'gun': State.OFF, 'KE': State.STANDBY}
+
+
+def test_abort_without_ke(injector):
+    class Devices(dict):
+        def __getitem__(self, name):
+            if name == 'KE':
+                raise ConnectionError('KE device not exported')
+            return super().__getitem__(name)
+
+    injector.states.update(rips=State.RUNNING, gun=State.ON)
+    seq = ShotSequencer(Devices(injector.devices), poll_period=0.001, state_timeout=0.1, verbose=False, states=State)
+    # the ramp and the gun are stopped even if KE cannot be reached
+    seq.abort()
+    assert injector.log == ['rips.StopRamping', 'gun.Off']
+
+
+def test_ke_not_in_standby(injector):
+    injector.states['KE'] = State.FAULT
+    with pytest.raises(ValueError):
+        sequencer(injector).run(2)
+    assert 'KE.On' not in injector.log and injector.states['rips'] == State.ON
+
+
+def test_session_armed_once(injector):
+    seq = sequencer(injector, idle_timeout=0.0)
+    seq.run(2, session=True)
+    seq.run(2, session=True)
+    assert seq.is_armed()
+    assert injector.log == ['rips.StartRamping', 'gun.On', 'KE.On', 'KE.Standby', 'KE.On', 'KE.Standby']
+
+    seq.disarm()
+    assert not seq.is_armed()
+    assert injector.log[-2:] == ['rips.StopRamping', 'gun.Off']
+
+    # a run outside a session ends a previous session first
+    seq.run(2, session=True)
+    injector.log.clear()
+    seq.run(2)
+    assert injector.log == ['rips.StopRamping', 'gun.Off',
+                            'rips.StartRamping', 'gun.On', 'KE.On', 'KE.Standby', 'rips.StopRamping', 'gun.Off']
+
+
+def test_idle_session_disarmed(injector):
+    seq = sequencer(injector, idle_timeout=0.2)
+    seq.run(2, session=True)
+    time.sleep(0.1)
+    seq.run(2, session=True)  # restarts the watchdog
+    time.sleep(0.15)
+    assert seq.is_armed()
+    time.sleep(0.3)
+    assert not seq.is_armed()
+    assert injector.states == {'rips': State.ON, 'gun': State.OFF, 'KE': State.STANDBY}
+
+
+def test_failed_session_run_disarms(injector):
+    seq = sequencer(injector, idle_timeout=0.0)
+    seq.run(2, session=True)
+    injector.states['KE'] = State.FAULT
+    with pytest.raises(ValueError):
+        seq.run(2, session=True)
+    assert not seq.is_armed()
+    assert injector.states['rips'] == State.ON and injector.states['gun'] == State.OFF
+
+
+def test_environment_settings_followed(injector, plugin):
+    environment = plugin('environments.injection_efficiency').Environment()
+    environment._sequencer = sequencer(injector)
+    environment._get_sequencer().run(2, session=True)
+    assert environment._sequencer.idle_timeout == environment.session_idle_timeout
+
+    # changed after the first evaluation: the next session run uses the new idle timeout
+    environment.session_idle_timeout = 0.05
+    environment.state_timeout = 0.2
+    seq = environment._get_sequencer()
+    assert seq is environment._sequencer and seq.state_timeout == 0.2
+    seq.run(2, session=True)
+    time.sleep(0.3)
+    assert not seq.is_armed()
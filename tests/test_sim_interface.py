@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def sim(plugin):
+    return plugin('interfaces.sim')
+
+
+@pytest.fixture
+def interface(sim):
+    interface = sim.Interface()
+    interface.read_latency = interface.write_latency = interface.latency_jitter = 0.0
+    return interface
+
+
+def test_values_and_set_points(interface):
+    assert interface.get_values(['srdiag/beam-current/total/Current']) == {'srdiag/beam-current/total/Current': 200.0}
+    report = interface.set_values({'srmag/m-s/all/CorrectionStrengths': np.ones(192), 'tl2/ps/qf1/Current': 2.0})
+    assert all(entry['success'] for entry in report.values())
+    values = interface.get_values(['tl2/ps/qf1/Current', 'srmag/m-s/all/CorrectionStrengths'])
+    assert values['tl2/ps/qf1/Current'] == 2.0
+    np.testing.assert_array_equal(values['srmag/m-s/all/CorrectionStrengths'], np.ones(192))
+    assert interface.get_calls() == {'read': 3, 'write': 2, 'failures': 0}
+
+
+def test_ramping_read_value(interface, monkeypatch):
+    monkeypatch.setattr(interface, 'ramp_rate', 10.0)
+    interface.set_values({'srdiag/blm/all/TotalLoss': 1e3})
+    sample = interface.snapshot(['srdiag/blm/all/TotalLoss'])['srdiag/blm/all/TotalLoss']
+    assert 1.0 <= sample.value < 10.0 and sample.quality == 'ATTR_CHANGING'
+
+
+def test_failing_device(sim, interface, monkeypatch):
+    monkeypatch.setattr(interface, 'failing_devices', ['tl2/ps/qf1'])
+    with pytest.raises(sim.SimulatedFailure):
+        interface.set_values({'tl2/ps/qf1/Current': 2.0, 'tl2/ps/qf2/Current': 3.0})
+    assert interface.get_values(['tl2/ps/qf2/Current'])['tl2/ps/qf2/Current'] == 3.0
+    assert interface.get_calls()['failures'] == 1
+
+
+def test_snapshot_skew(sim, interface, monkeypatch):
+    names = ['srdiag/beam-current/total/Current', 'srdiag/blm/all/TotalLoss']
+    # devices are read one after the other: the slow loss monitor delays its timestamp
+    monkeypatch.setattr(interface, 'device_latency', {'srdiag/blm/all': [0.05, 0.0]})
+    samples = interface.snapshot(names)
+    assert samples[names[1]].timestamp - samples[names[0]].timestamp >= 0.05
+
+    calls = interface.get_calls()['read']
+    with pytest.raises(sim.SnapshotSkewError):
+        interface.snapshot(names, max_skew=0.01, max_attempts=2)
+    assert interface.get_calls()['read'] - calls == 4
+    assert interface.snapshot(names, max_skew=1.0)[names[0]].value == 200.0
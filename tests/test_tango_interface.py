@@ -0,0 +1,205 @@
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+tango = pytest.importorskip('tango')
+
+from interfaces.tango.retry import CircuitOpenError
+from interfaces.tango.snapshot import Sample, SnapshotSkewError, timestamp_skew
+
+
+class Machine:
+    """
+    in-memory control system behind the tango.DeviceProxy / tango.AttributeProxy of the interface
+    """
+
+    def __init__(self):
+        # attribute name: [read value, set point]
+        self.attributes = {'srdiag/beam-current/total/Current': [0.2, None],
+                           'srdiag/beam-current/total/Lifetime': [72000.0, None],
+                           'srdiag/blm/all/TotalLoss': [3.0, None],
+                           'srmag/m-s/all/CorrectionStrengths': [None, np.zeros(4)],
+                           'tl2/ps/qf1/Current': [None, 1.0],
+                           'tl2/ps/qf2/Current': [None, 2.0]}
+        self.dead = set()  # devices not answering
+        self.write_delay = 0.0
+        self.delays = {}  # device: age in s of its readings
+        self.calls = []  # (operation, device, thread name)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def local_name(full_name):
+        # tango://host:port/domain/family/member[/attribute]
+        return full_name.split('/', 3)[3]
+
+    def call(self, operation, device):
+        with self._lock:
+            self.calls.append((operation, device, threading.current_thread().name))
+        if device in self.dead:
+            error = tango.DevError()
+            error.reason = 'API_CantConnectToDevice'
+            raise tango.DevFailed(error)
+
+    def reading(self, name):
+        value, set_point = self.attributes[name]
+        timestamp = time.time() - self.delays.get(name.rsplit('/', 1)[0], 0.0)
+        return SimpleNamespace(value=value, w_value=set_point, has_failed=False, quality='ATTR_VALID',
+                               time=SimpleNamespace(totime=lambda: timestamp))
+
+    def config(self, name):
+        value, set_point = self.attributes[name]
+        spectrum = isinstance(set_point, np.ndarray)
+        return SimpleNamespace(writable=tango.AttrWriteType.READ if set_point is None else tango.AttrWriteType.READ_WRITE,
+                               data_format=tango.AttrDataFormat.SPECTRUM if spectrum else tango.AttrDataFormat.SCALAR,
+                               data_type=tango.CmdArgType.DevDouble, max_dim_x=4 if spectrum else 1)
+
+    def device_proxy(self, full_name):
+        machine, device = self, self.local_name(full_name)
+
+        class Device:
+            def read_attributes(self, attributes):
+                machine.call('read_attributes', device)
+                return [machine.reading(f'{device}/{a}') for a in attributes]
+
+            def get_attribute_config(self, attributes):
+                machine.call('get_attribute_config', device)
+                return [machine.config(f'{device}/{a}') for a in attributes]
+
+        return Device()
+
+    def attribute_proxy(self, full_name):
+        machine, name = self, self.local_name(full_name)
+        device = name.rsplit('/', 1)[0]
+
+        class Attribute:
+            def read(self):
+                machine.call('read', device)
+                return machine.reading(name)
+
+            def write(self, value):
+                machine.call('write', device)
+                time.sleep(machine.write_delay)
+                machine.attributes[name][1] = value
+
+            def get_config(self):
+                machine.call('get_config', device)
+                return machine.config(name)
+
+        return Attribute()
+
+
+@pytest.fixture
+def machine(monkeypatch):
+    machine = Machine()
+    monkeypatch.setattr(tango, 'DeviceProxy', machine.device_proxy)
+    monkeypatch.setattr(tango, 'AttributeProxy', machine.attribute_proxy)
+    return machine
+
+
+@pytest.fixture
+def interface_class(plugin, machine):
+    return plugin('interfaces.tango').Interface
+
+
+@pytest.fixture
+def interface(interface_class):
+    interface = interface_class()
+    interface._retrier.policy.initial_delay = 0.0
+    yield interface
+    interface.close()
+
+
+def test_reads_grouped_by_device(interface, machine):
+    names = ['srdiag/beam-current/total/Current', 'tl2/ps/qf1/Current', 'srdiag/beam-current/total/Lifetime']
+    values = interface.get_values(names)
+    # in the requested order, set point of writable attributes, value of read only ones
+    assert list(values) == names
+    assert values == {'srdiag/beam-current/total/Current': 0.2, 'tl2/ps/qf1/Current': 1.0,
+                      'srdiag/beam-current/total/Lifetime': 72000.0}
+    reads = [device for operation, device, _ in machine.calls if operation == 'read_attributes']
+    assert sorted(reads) == ['srdiag/beam-current/total', 'tl2/ps/qf1']
+
+
+def test_config_fetch_of_dead_device_retried(interface, machine):
+    machine.dead.add('srdiag/blm/all')
+    for _ in range(interface.breaker_threshold + 2):
+        with pytest.raises((tango.DevFailed, CircuitOpenError)):
+            interface.get_values(['srdiag/blm/all/TotalLoss'])
+
+    # the config fetch is retried, counted and trips the breaker, which then answers without calling
+    config_calls = [call for call in machine.calls if call[0] == 'get_attribute_config']
+    assert len(config_calls) == interface.breaker_threshold * interface.retry_max_attempts
+    stats = interface.get_retry_stats()['srdiag/blm/all']
+    assert stats['trips'] == 1 and stats['retries'] > 0
+    assert interface.get_pool_stats()['evictions'] > 0
+    assert interface.get_telemetry()['read']['srdiag/blm/all/TotalLoss']['failures'] == interface.breaker_threshold + 2
+
+
+def test_writes_in_parallel(interface, machine):
+    machine.write_delay = 0.2
+    t0 = time.perf_counter()
+    report = interface.set_values({'tl2/ps/qf1/Current': 1.5, 'tl2/ps/qf2/Current': 2.5,
+                                   'srmag/m-s/all/CorrectionStrengths': np.ones(4)})
+    # the barrier lasts as long as the slowest write, not the sum of them
+    assert time.perf_counter() - t0 < 0.5
+    assert all(entry['success'] and not entry['skipped'] for entry in report.values())
+    assert machine.attributes['tl2/ps/qf2/Current'][1] == 2.5
+    np.testing.assert_array_equal(machine.attributes['srmag/m-s/all/CorrectionStrengths'][1], np.ones(4))
+
+
+def test_failed_write_does_not_abort_the_barrier(interface, machine):
+    # a value that cannot be converted to the spectrum dtype fails before the write
+    with pytest.raises(ValueError):
+        interface.set_values({'tl2/ps/qf1/Current': 1.5, 'srmag/m-s/all/CorrectionStrengths': 'not a spectrum',
+                              'tl2/ps/qf2/Current': 2.5})
+    report = interface.get_last_write_report()
+    assert not report['srmag/m-s/all/CorrectionStrengths']['success']
+    assert isinstance(report['srmag/m-s/all/CorrectionStrengths']['error'], ValueError)
+    assert report['tl2/ps/qf1/Current']['success'] and report['tl2/ps/qf2/Current']['success']
+    assert machine.attributes['tl2/ps/qf2/Current'][1] == 2.5
+
+
+def test_snapshot_reads_beside_the_writes(interface_class, machine):
+    class Interface(interface_class):
+        max_write_workers: int = 1
+
+    interface = Interface()
+    machine.write_delay = 0.3
+    writes = threading.Thread(target=interface.set_values,
+                              args=({f'tl2/ps/qf{i}/Current': 10.0 + i for i in (1, 2)},))
+    writes.start()
+    time.sleep(0.05)
+    t0 = time.perf_counter()
+    samples = interface.snapshot(['srdiag/beam-current/total/Current', 'srdiag/blm/all/TotalLoss'])
+    # not queued behind the writes
+    assert time.perf_counter() - t0 < 0.2
+    writes.join()
+    interface.close()
+    assert samples['srdiag/blm/all/TotalLoss'].value == 3.0
+    assert {thread for operation, _, thread in machine.calls if operation == 'read_attributes'} <= \
+        {f'tango-read_{i}' for i in range(interface.max_read_workers)}
+
+
+def test_timestamp_skew():
+    assert timestamp_skew({}) == 0.0
+    assert timestamp_skew({'a': Sample(1.0, 10.0, 'ATTR_VALID'), 'b': Sample(2.0, 12.5, 'ATTR_VALID'),
+                           'c': Sample(3.0, 11.0, 'ATTR_VALID')}) == 2.5
+
+
+def test_snapshot_skew(interface, machine):
+    names = ['srdiag/beam-current/total/Current', 'srdiag/blm/all/TotalLoss']
+    machine.delays['srdiag/blm/all'] = 5.0
+    samples = interface.snapshot(names)
+    assert samples['srdiag/blm/all/TotalLoss'] == (3.0, pytest.approx(time.time() - 5.0, abs=1.0), 'ATTR_VALID')
+    assert timestamp_skew(samples) == pytest.approx(5.0, abs=0.1)
+
+    # read again max_attempts times, then raise
+    machine.calls.clear()
+    with pytest.raises(SnapshotSkewError):
+        interface.snapshot(names, max_skew=1.0, max_attempts=2)
+    assert [call[1] for call in machine.calls if call[0] == 'read_attributes'].count('srdiag/blm/all') == 2
+
+    machine.delays.clear()
+    assert interface.snapshot(names, max_skew=1.0)['srdiag/beam-current/total/Current'].value == 0.2
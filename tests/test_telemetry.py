@@ -0,0 +1,53 @@
+import json
+import numpy as np
+from interfaces.tango.telemetry import Telemetry, estimate_bytes
+
+
+def test_estimate_bytes():
+    assert estimate_bytes(None) == 0
+    assert estimate_bytes(0.2) == 8
+    assert estimate_bytes(np.zeros(288)) == 288 * 8
+    assert estimate_bytes('ON') == 2
+    assert estimate_bytes([1.0, np.zeros(2)]) == 24
+
+
+def test_summary():
+    telemetry = Telemetry()
+    for i in range(100):
+        telemetry.record('read', 'srdiag/blm/all/TotalLoss', latency=(i + 1) * 1e-3, nbytes=8, retries=i % 2)
+    telemetry.record('write', 'tl2/ps/qf1/Current', latency=0.01, failed=True)
+
+    summary = telemetry.summary()
+    read = summary['read']['srdiag/blm/all/TotalLoss']
+    assert (read['count'], read['bytes'], read['retries'], read['failures']) == (100, 800, 50, 0)
+    np.testing.assert_allclose([read['p50'], read['p95'], read['p99']], [0.0505, 0.09505, 0.09901])
+    np.testing.assert_allclose(read['latency_sum'], 5.05)
+    assert summary['write']['tl2/ps/qf1/Current']['failures'] == 1
+
+    telemetry.reset()
+    assert telemetry.summary() == {}
+
+
+def test_written_as_json_and_prometheus(tmp_path):
+    telemetry = Telemetry()
+    telemetry.record('read', 'srdiag/blm/all/TotalLoss', latency=0.002, nbytes=8)
+
+    telemetry.write(tmp_path / 'telemetry.json')
+    channels = json.loads((tmp_path / 'telemetry.json').read_text())['channels']
+    assert channels['read']['srdiag/blm/all/TotalLoss']['count'] == 1
+
+    telemetry.write(tmp_path / 'telemetry.prom', fmt='prometheus')
+    text = (tmp_path / 'telemetry.prom').read_text()
+    assert 'badger_tango_calls_total{op="read",channel="srdiag/blm/all/TotalLoss"} 1' in text
+    assert 'badger_tango_latency_seconds{op="read",channel="srdiag/blm/all/TotalLoss",quantile="0.99"} 0.002' in text
+    assert not (tmp_path / 'telemetry.prom.tmp').exists()
+
+
+def test_periodic_flush(tmp_path):
+    telemetry = Telemetry()
+    telemetry.start_flush(tmp_path / 'telemetry.json', period=60.0)
+    telemetry.record('write', 'tl2/ps/qf1/Current', latency=0.01)
+    # the last statistics are written when the flush is stopped
+    telemetry.stop_flush()
+    channels = json.loads((tmp_path / 'telemetry.json').read_text())['channels']
+    assert channels['write']['tl2/ps/qf1/Current']['count'] == 1